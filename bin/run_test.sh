@@ -23,6 +23,60 @@ pytest -s -v tests/test_model.py::test_model_discovery
 pytest -s -v tests/test_model.py::test_num_models
 pytest -s -v tests/test_model.py::test_status
 
+# Model catalog tests
+pytest -s -v tests/test_catalog.py
+
+# Video availability tests
+pytest -s -v tests/test_video_checker.py
+
+# Result reuse tests
+pytest -s -v tests/test_dedup.py
+
+# Status change feed tests
+pytest -s -v tests/test_feed.py
+
+# Metrics tests
+pytest -s -v tests/test_metrics.py
+
+# Retention tests
+pytest -s -v tests/test_retention.py
+
+# Database executor tests
+pytest -s -v tests/test_executor.py
+
+# Admission control tests
+pytest -s -v tests/test_admission.py
+
+# Processing time statistics tests
+pytest -s -v tests/test_stats.py
+
+# Scheduling policy tests
+pytest -s -v tests/test_scheduler.py
+
+# Results download tests
+pytest -s -v tests/test_results.py
+
+# Cancellation tests
+pytest -s -v tests/test_cancel.py
+
+# Status cache tests
+pytest -s -v tests/test_status_cache.py
+
+# Batch and conditional status tests
+pytest -s -v tests/test_status_batch.py
+
+# Daemon wakeup tests
+pytest -s -v tests/test_wakeup.py
+
+# Docker container events tests
+pytest -s -v tests/test_container_events.py
+
+# Container slot tests
+pytest -s -v tests/test_slots.py
+
+# Worker claim and lease tests
+pytest -s -v tests/test_lease.py
+
 # Health tests
 pytest -s -v tests/test_health.py::test_health
 
@@ -35,6 +89,9 @@ pytest -s -v tests/test_database.py::test_pydantic_sqlalchemy
 pytest -s -v tests/test_database.py::test_queued_status
 pytest -s -v tests/test_database.py::test_running_status
 pytest -s -v tests/test_database.py::test_update_one_media
+pytest -s -v tests/test_database.py::test_migrate_existing_database
+pytest -s -v tests/test_database.py::test_job_status_in_sync
+pytest -s -v tests/test_database.py::test_metadata_columns
 
 # Predict tests - these take a while to run
 # pytest -s -v tests/test_predict.py::test_predict_invalid_model
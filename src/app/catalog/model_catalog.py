@@ -0,0 +1,142 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: app/catalog/model_catalog.py
+# Description: In-memory catalog of the models available in the minio bucket, refreshed in the background
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from urllib.parse import urlparse
+
+from app.logger import info, debug, exception
+from app.utils.misc import list_objects
+
+
+class ModelCatalog:
+
+    def __init__(self,
+                 bucket: str,
+                 prefix: str,
+                 suffixes: List[str] = None,
+                 ttl_secs: float = 30,
+                 lister: Callable[[str, str, List[str]], List[dict]] = list_objects):
+        """
+        Catalog of model names to model s3 paths, served from memory and refreshed every ttl_secs
+        :param bucket: the bucket to fetch the models from
+        :param prefix: the prefix to fetch the models from
+        :param suffixes: the model suffixes, e.g. ['.gz', '.pt']
+        :param ttl_secs: how long the catalog is considered fresh
+        :param lister: function to list the objects in the bucket; returns S3 object summaries
+        """
+        self._bucket = bucket
+        self._prefix = prefix
+        self._suffixes = suffixes or ['.gz', '.pt']
+        self._ttl_secs = ttl_secs
+        self._lister = lister
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._model_paths: Dict[str, str] = {}
+        self._fingerprint = None
+        self._loaded_at = None
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._changes = 0
+        self._errors = 0
+
+    def refresh(self) -> bool:
+        """
+        Fetch the models from the bucket and rebuild the catalog if the listing changed
+        :return: True if the catalog changed, False otherwise
+        """
+        info(f'Fetching models from s3://{self._bucket}/{self._prefix}')
+        try:
+            objects = self._lister(self._bucket, self._prefix, self._suffixes)
+        except Exception as e:
+            exception(f'Error refreshing the model catalog: {e}')
+            with self._lock:
+                self._errors += 1
+            return False
+
+        # The keys and their ETags identify the listing, so an unchanged listing keeps the current catalog
+        digest = hashlib.sha1()
+        for obj in sorted(objects, key=lambda o: o['Key']):
+            digest.update(f"{obj['Key']}:{obj.get('ETag', '')}\n".encode())
+        fingerprint = digest.hexdigest()
+
+        with self._lock:
+            self._refreshes += 1
+            self._loaded_at = time.monotonic()
+            if fingerprint == self._fingerprint:
+                debug(f'Model catalog unchanged with {len(self._model_paths)} models')
+                return False
+
+            debug(f'Creating dictionary of model names to model paths')
+            model_s3 = [f"s3://{self._bucket}/{obj['Key']}" for obj in objects]
+            self._model_paths = {Path(urlparse(m).path).stem.split('.')[0]: m for m in model_s3}
+            self._fingerprint = fingerprint
+            self._changes += 1
+            debug(f'Found {len(self._model_paths)} models')
+            return True
+
+    def models(self) -> Dict[str, str]:
+        """
+        Get the model names and their s3 paths. This is served from memory; the bucket is only listed
+        if the catalog was never loaded, or is stale and not being refreshed in the background
+        :return: dictionary of model names to model s3 paths
+        """
+        with self._lock:
+            fresh = self._loaded_at is not None and \
+                    (self.is_running() or time.monotonic() - self._loaded_at < self._ttl_secs)
+            if fresh:
+                self._hits += 1
+                return self._model_paths
+            self._misses += 1
+
+        self.refresh()
+        with self._lock:
+            return self._model_paths
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters for the catalog
+        :return: dictionary of counters
+        """
+        with self._lock:
+            age_secs = None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 3)
+            return {"num_models": len(self._model_paths),
+                    "hits": self._hits,
+                    "misses": self._misses,
+                    "refreshes": self._refreshes,
+                    "changes": self._changes,
+                    "errors": self._errors,
+                    "age_secs": age_secs,
+                    "ttl_secs": self._ttl_secs}
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start refreshing the catalog in a background thread every ttl_secs
+        """
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='model-catalog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background refresh
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self._ttl_secs):
+            self.refresh()
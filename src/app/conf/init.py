@@ -34,6 +34,34 @@ with yaml_path.open('r') as yaml_file:
 
     database_path = Path(os.environ.get('DATABASE_DIR'))
 
+    # Finished jobs are archived here by the daemon
+    archive_path = Path(os.environ.get('ARCHIVE_DIR', database_path / 'archive'))
+
+    # API settings; these are optional so older configuration files still work
+    api = data.get('api') or {}
+    model_catalog_ttl_secs = api.get('model_catalog', {}).get('ttl_secs', 30)
+    video_check = api.get('video_check', {})
+    database_max_readers = api.get('database', {}).get('max_readers', 4)
+
+    # Wait estimates assume the daemon runs NUM_CONCURRENT_PROCS jobs at a time
+    num_procs = int(os.environ.get('NUM_CONCURRENT_PROCS', 1))
+
+    # Limits on queued jobs
+    admission = api.get('admission', {})
+    admission['num_procs'] = num_procs
+
+    # Processing time statistics of recent jobs
+    stats = api.get('stats', {})
+
+    # Cache of job status served to polling clients
+    status_cache = api.get('status_cache', {})
+
+    # Downloads of the track results
+    results = api.get('results', {})
+    results_chunk_bytes = results.get('chunk_bytes', 1024 * 1024)
+    results_presign_expires_secs = results.get('presign_expires_secs', 3600)
+    results_public_endpoint_url = results.get('public_endpoint_url')
+
 # A list of fun short names from sherman lagoon
 lagoon_names = [
     'sherman',
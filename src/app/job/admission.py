@@ -0,0 +1,109 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/admission.py
+# Description: Limit the number of queued jobs in total, per model and per client
+
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy import func, cast, String
+from sqlalchemy.orm import Session, Query
+
+from app.job.database import JobLocal, MediaLocal
+from app.utils.exceptions import TooManyJobsException
+
+
+@dataclass
+class AdmissionLimits:
+    max_queued: int = 0  # Maximum number of queued jobs; 0 for no limit
+    max_queued_per_model: int = 0  # Maximum number of queued jobs for each model; 0 for no limit
+    max_queued_per_client: int = 0  # Maximum number of queued jobs for each client; 0 for no limit
+    client_key: str = 'client'  # The metadata key that identifies the client
+    num_procs: int = 1  # Number of jobs the daemon runs concurrently
+    default_processing_secs: float = 300.  # Processing time to assume before any job has completed
+    max_retry_after_secs: int = 3600
+
+
+def queued_jobs(db: Session) -> Query:
+    """
+    Query the queued jobs that will be run. Jobs attached to an identical job are not run.
+    :param db: The database session
+    :return: The query
+    """
+    return db.query(JobLocal.id).filter(JobLocal.status == Status.QUEUED, JobLocal.duplicate_of.is_(None))
+
+
+def mean_processing_secs(db: Session, num_recent: int = 100) -> float | None:
+    """
+    Get the mean processing time of the most recently completed jobs
+    :param db: The database session
+    :param num_recent: The number of recent jobs to average
+    :return: The mean processing time in seconds, or None if no job has completed
+    """
+    # Attached jobs share the processing time of the job they are attached to
+    recent = db.query(MediaLocal.processing_time_secs) \
+        .join(JobLocal, MediaLocal.job_id == JobLocal.id) \
+        .filter(MediaLocal.status == Status.SUCCESS, MediaLocal.processing_time_secs.isnot(None),
+                JobLocal.duplicate_of.is_(None)) \
+        .order_by(MediaLocal.id.desc()) \
+        .limit(num_recent) \
+        .subquery()
+    return db.query(func.avg(recent.c.processing_time_secs)).scalar()
+
+
+def retry_after_secs(db: Session, limits: AdmissionLimits, queued: Query, excess: int) -> int:
+    """
+    Estimate when enough jobs will have started to admit the rejected jobs. Jobs start in id order, so this is
+    the time to start every queued job up to and including the excess-th job counted against the limit.
+    :param db: The database session
+    :param limits: The admission limits
+    :param queued: The queued jobs counted against the limit
+    :param excess: The number of queued jobs over the limit
+    :return: The estimated seconds to wait
+    """
+    last_id = db.query(func.max(queued.order_by(JobLocal.id).limit(excess).subquery().c.id)).scalar()
+    num_ahead = queued_jobs(db).filter(JobLocal.id <= last_id).count() if last_id else excess
+    secs = mean_processing_secs(db) or limits.default_processing_secs
+    return max(1, min(limits.max_retry_after_secs, math.ceil(num_ahead * secs / max(1, limits.num_procs))))
+
+
+def check_admission(db: Session, limits: AdmissionLimits, jobs: List[dict]):
+    """
+    Check that queueing the jobs keeps the queue within the limits
+    :param db: The database session
+    :param limits: The admission limits
+    :param jobs: The column values of the jobs to queue, as for bulk_add_jobs
+    :raises TooManyJobsException: If a limit would be exceeded, with the estimated seconds to wait
+    """
+    jobs = [job for job in jobs if job.get('duplicate_of') is None]
+    if not jobs:
+        return
+
+    checks = []
+    if limits.max_queued:
+        checks.append(('total', 'queued jobs', limits.max_queued, queued_jobs(db), len(jobs)))
+    if limits.max_queued_per_model:
+        for model, num_jobs in Counter(job['model'] for job in jobs).items():
+            checks.append(('model', f'queued jobs for model {model}', limits.max_queued_per_model,
+                           queued_jobs(db).filter(JobLocal.model == model), num_jobs))
+    if limits.max_queued_per_client:
+        clients = Counter((job.get('metadata_json') or {}).get(limits.client_key) for job in jobs)
+        for client, num_jobs in clients.items():
+            if client is None:
+                continue
+            # Compare as text, as json_extract returns a client id stored as a JSON number as a number
+            client_column = cast(JobLocal.metadata_json[limits.client_key].as_string(), String)
+            checks.append(('client', f'queued jobs for {limits.client_key} {client}', limits.max_queued_per_client,
+                           queued_jobs(db).filter(client_column == str(client)), num_jobs))
+
+    for limit_name, description, limit, queued, num_jobs in checks:
+        excess = queued.count() + num_jobs - limit
+        if excess > 0:
+            reason = f'Limit of {limit} {description} reached'
+            if num_jobs > limit:
+                reason = f'{num_jobs} jobs exceed the limit of {limit} {description}; submit fewer jobs at a time'
+            raise TooManyJobsException(limit=limit_name,
+                                       reason=reason,
+                                       retry_after_secs=retry_after_secs(db, limits, queued, excess))
@@ -0,0 +1,75 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/cancel.py
+# Description: Cancel queued and running jobs. The daemon stops the container of a cancelled running job.
+
+from dataclasses import dataclass
+from typing import List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy.orm import Session, Query, selectinload
+
+from app.job.database import JobLocal, update_media, CANCELLED
+from app.job.dedup import get_followers
+
+# Jobs that can be cancelled
+CANCELLABLE_STATUSES = [Status.QUEUED, Status.RUNNING]
+
+
+@dataclass
+class Cancellation:
+    job_id: int
+    previous_status: str
+    promoted: int | None = None  # The attached job that runs in place of the cancelled job, if any
+
+
+def promote_follower(db: Session, job: JobLocal) -> JobLocal | None:
+    """
+    Queue the oldest job attached to a job in its place, and attach the other jobs to it, so jobs submitted
+    while the job was in flight still run when it is cancelled
+    :param db: The database session
+    :param job: The job
+    :return: The promoted job, or None if no job is attached
+    """
+    followers = sorted(get_followers(db, job), key=lambda f: f.id)
+    if not followers:
+        return None
+    primary, *others = followers
+    primary.duplicate_of = None
+    update_media(db, primary, primary.media[0].name, Status.QUEUED)
+    for follower in others:
+        follower.duplicate_of = primary.id
+        if follower.status != Status.QUEUED:
+            update_media(db, follower, follower.media[0].name, Status.QUEUED)
+    return primary
+
+
+def cancel_job(db: Session, job: JobLocal) -> Cancellation:
+    """
+    Cancel a queued or running job. A queued job is never picked by the daemon, and the daemon stops the
+    container of a running job on its next check. Attached jobs are not cancelled.
+    :param db: The database session
+    :param job: The job, with a status in CANCELLABLE_STATUSES
+    :return: The cancellation
+    """
+    cancellation = Cancellation(job_id=job.id, previous_status=job.status)
+    update_media(db, job, job.media[0].name, CANCELLED)
+    if job.duplicate_of is None:
+        promoted = promote_follower(db, job)
+        cancellation.promoted = promoted.id if promoted else None
+    return cancellation
+
+
+def cancel_jobs(db: Session, query: Query, max_jobs: int) -> List[Cancellation]:
+    """
+    Cancel the queued and running jobs matched by a query, oldest first
+    :param db: The database session
+    :param query: A query with the job id as its first column, e.g. from query_job_status
+    :param max_jobs: Maximum number of jobs to cancel
+    :return: The cancellations
+    """
+    job_ids = [row[0] for row in query.filter(JobLocal.status.in_(CANCELLABLE_STATUSES)).limit(max_jobs)]
+    jobs = db.query(JobLocal).options(selectinload(JobLocal.media)) \
+        .filter(JobLocal.id.in_(job_ids)) \
+        .order_by(JobLocal.id) \
+        .all()
+    return [cancel_job(db, job) for job in jobs]
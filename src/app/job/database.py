@@ -1,38 +1,166 @@
 # fastapi-localtrack, Apache-2.0 license
 # Filename: job/database.py
 # Description: Job database
-from datetime import datetime
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Dict
 
-from app.logger import info
-from deepsea_ai.database.job import MediaBase, Status, Media, Job
+from app.logger import info, exception
+from deepsea_ai.database.job import MediaBase, Status, Job
+from deepsea_ai.database.job.database_helper import get_status, json_b64_decode
+from deepsea_ai.database.job.misc import JobType
 from pydantic_sqlalchemy import sqlalchemy_to_pydantic
-from sqlalchemy import Column, String, create_engine, Integer, ForeignKey
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base, Session
+from sqlalchemy import Column, String, create_engine, Integer, ForeignKey, case, func, inspect, text, Float, \
+    TIMESTAMP, Index, event, select, JSON, bindparam
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import relationship, sessionmaker, declarative_base, Session, Query
+from sqlalchemy.schema import CreateTable
 from pathlib import Path
 
 Base = declarative_base()
 
+# Pragmas applied to every connection. WAL lets the API read while the daemon writes, NORMAL sync is safe in WAL
+# mode (a power loss can only roll back the last commits), and writers wait for the lock instead of failing
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    'cache_size': -16000,
+}
+
+# Pragmas that only take effect on a new database; existing databases are converted by the retention monitor.
+# Setting them writes to the database even when unchanged, which would clear the API status cache on every connection
+NEW_DATABASE_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+}
+
+# Status of jobs cancelled by a client; deepsea_ai's Status has no cancelled state
+CANCELLED = 'CANCELLED'
+
+# Job columns that count the media in each state
+STATUS_COUNTERS = {
+    Status.QUEUED: 'num_queued',
+    Status.RUNNING: 'num_running',
+    Status.FAILED: 'num_failed',
+    Status.SUCCESS: 'num_success',
+    CANCELLED: 'num_cancelled',
+}
+
+# Media results stored in their own columns rather than in the media metadata
+RESULT_COLUMNS = ('s3_path', 'num_tracks', 'processing_time_secs', 'hardware')
+
+# Number of rows to convert at a time when moving the base64 metadata into the JSON columns
+MIGRATE_BATCH_SIZE = 1000
+
+# One engine per database file so the connection pool and migrations are not repeated on each call to init_db
+_engines = {}
+
 
 class JobLocal(Job):
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ix_job_name', 'name'),
+        # Serves the job type filter in id order for status paging
+        Index('ix_job_job_type_id', 'job_type', 'id'),
+        # Serves status filters and counts, in id order for status paging
+        Index('ix_job_status_id', 'status', 'id'),
+        # Never reuse the ids of deleted jobs, e.g. archived, which clients may still hold
+        {'extend_existing': True, 'sqlite_autoincrement': True}
+    )
     __tablename__ = "job"
 
     args = Column(String, nullable=True)
 
+    # Replaced by metadata_json; only read for jobs written by an earlier version
     metadata_b64 = Column(String, nullable=True)
 
+    # Metadata passed through to the notification
+    metadata_json = Column(JSON(none_as_null=True), nullable=True)
+
     model = Column(String, nullable=False)
 
+    # Identifies the video, model and args so identical submissions can reuse results
+    content_key = Column(String, nullable=True, index=True)
+
+    # Optional client supplied key to make submissions idempotent
+    idempotency_key = Column(String, nullable=True, index=True)
+
+    # The job this job is attached to if it was submitted while an identical job was queued or running
+    duplicate_of = Column(Integer, ForeignKey('job.id'), nullable=True, index=True)
+
+    # Higher priority jobs run first with the priority scheduling policy
+    priority = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # Status derived from the media as in deepsea_ai's get_status, and the number of media in each state.
+    # Kept in sync on every media update so status filters and counts do not need to load the media
+    status = Column(String, nullable=True)
+    num_media = Column(Integer, nullable=False, default=0, server_default='0')
+    num_queued = Column(Integer, nullable=False, default=0, server_default='0')
+    num_running = Column(Integer, nullable=False, default=0, server_default='0')
+    num_failed = Column(Integer, nullable=False, default=0, server_default='0')
+    num_success = Column(Integer, nullable=False, default=0, server_default='0')
+    num_cancelled = Column(Integer, nullable=False, default=0, server_default='0')
+
+    # The daemon worker that claimed the job, and when its claim lapses unless the worker renews it. A job held by
+    # a worker that stopped renewing is queued again once its lease expires
+    worker_id = Column(String, nullable=True, index=True)
+    lease_expires = Column(TIMESTAMP(timezone=True), nullable=True)
+
     media = relationship('MediaLocal', backref="job", passive_deletes=True)
 
 
 class MediaLocal(MediaBase):
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Serves the queue pick, oldest job first, and any filter on status
+        Index('ix_media_status_job_id', 'status', 'job_id'),
+        Index('ix_media_job_id', 'job_id'),
+        {'extend_existing': True}
+    )
     __tablename__ = "media"
 
     job_id = Column(Integer, ForeignKey('job.id', ondelete='CASCADE'))
 
+    # Results of processing the video
+    s3_path = Column(String, nullable=True)
+    num_tracks = Column(Integer, nullable=True)
+    processing_time_secs = Column(Float, nullable=True)
+    hardware = Column(String, nullable=True)  # Where the video was processed, e.g. x86_64 1 gpu
+
+    # Size of the video when it was submitted, to normalize the processing time
+    size_bytes = Column(Integer, nullable=True)
+
+    # Any other media metadata
+    metadata_json = Column(JSON(none_as_null=True), nullable=True)
+
+
+class JobEvent(Base):
+    """
+    Change feed of job status transitions, written by the API and the daemon
+    """
+    __tablename__ = "job_event"
+    # Never reuse the ids of pruned events, so subscribers reading after their last id do not miss new events
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, nullable=False, index=True)
+    status = Column(String, nullable=False)
+    num_tracks = Column(Integer, nullable=True)
+    processing_time_secs = Column(Float, nullable=True)
+    createdAt = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class WorkerHeartbeat(Base):
+    """
+    Last heartbeat of each daemon worker draining the queue
+    """
+    __tablename__ = "worker"
+
+    id = Column(String, primary_key=True)
+    hostname = Column(String, nullable=False)
+    pid = Column(Integer, nullable=False)
+    num_slots = Column(Integer, nullable=False, default=0)
+    num_running = Column(Integer, nullable=False, default=0)
+    startedAt = Column(TIMESTAMP(timezone=True), nullable=False)
+    heartbeatAt = Column(TIMESTAMP(timezone=True), nullable=False)
+
 
 PydanticJob2 = sqlalchemy_to_pydantic(JobLocal)
 PydanticMedia2 = sqlalchemy_to_pydantic(MediaLocal)
@@ -54,10 +182,16 @@ def init_db(db_path: Path, reset: bool = False) -> sessionmaker:
     db_path.mkdir(parents=True, exist_ok=True)
 
     db = db_path / f'sqlite_job_cache_docker.db'
-    info(f"Initializing job cache database in {db_path} as {db}")
-    engine = create_engine(f"sqlite:///{db.as_posix()}", connect_args={"check_same_thread": False}, echo=False)
+    engine = _engines.get(db.as_posix())
+    if engine is None:
+        info(f"Initializing job cache database in {db_path} as {db}")
+        engine = create_engine(f"sqlite:///{db.as_posix()}", connect_args={"check_same_thread": False}, echo=False)
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
 
-    Base.metadata.create_all(engine, tables=[JobLocal.__table__, MediaLocal.__table__])
+        Base.metadata.create_all(engine, tables=[JobLocal.__table__, MediaLocal.__table__, JobEvent.__table__,
+                                                 WorkerHeartbeat.__table__])
+        migrate_db(engine)
+        _engines[db.as_posix()] = engine
 
     # If the database is missing, create it
     if not db.exists():
@@ -68,18 +202,301 @@ def init_db(db_path: Path, reset: bool = False) -> sessionmaker:
         with sessionmaker(bind=engine).begin() as db:
             db.query(JobLocal).delete()
             db.query(MediaLocal).delete()
+            db.query(JobEvent).delete()
+            db.query(WorkerHeartbeat).delete()
+            # Start the ids again from 1
+            db.execute(text(f"DELETE FROM sqlite_sequence WHERE name IN "
+                            f"('{JobLocal.__tablename__}', '{JobEvent.__tablename__}')"))
+
+    session_maker = sessionmaker(bind=engine)
+    event.listen(session_maker, 'before_flush', _sync_job_status)
+    event.listen(session_maker, 'after_flush_postexec', _sync_job_status_by_id)
+    return session_maker
 
-    return sessionmaker(bind=engine)
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if cursor.execute('PRAGMA page_count').fetchone()[0] == 0:
+        for name, value in NEW_DATABASE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
 
-def update_media(db: Session, job: Job, video_name: str, status: str, metadata_b64: str = None):
+
+def migrate_db(engine: Engine):
+    """
+    Add any columns and indexes missing from a database created by an earlier version
+    :param engine: The database engine
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in (JobLocal.__table__, MediaLocal.__table__):
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    info(f'Adding column {column.name} to table {table.name}')
+                    # SQLite can only add a column with a constant default
+                    default = ''
+                    if column.server_default is not None and isinstance(column.server_default.arg, str):
+                        default = f" DEFAULT '{column.server_default.arg}'"
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                      f'{column.type.compile(engine.dialect)}{default}'))
+
+        # Derive the status of any jobs added before the status was stored with the job
+        num_jobs = update_job_status(conn, JobLocal.__table__.c.status.is_(None))
+        if num_jobs:
+            info(f'Set the status of {num_jobs} jobs from their media')
+
+        # Move any base64 metadata into the JSON and result columns
+        for table in (JobLocal.__table__, MediaLocal.__table__):
+            num_rows = migrate_metadata(conn, table)
+            if num_rows:
+                info(f'Moved the metadata of {num_rows} rows in table {table.name} to JSON')
+
+    # Rebuild any tables that would reuse the ids of deleted rows; their indexes are created again below
+    for table in (JobLocal.__table__, JobEvent.__table__):
+        if migrate_autoincrement(engine, table):
+            info(f'Rebuilt table {table.name} to never reuse the ids of deleted rows')
+
+    created = False
+    inspector = inspect(engine)
+    for table in (JobLocal.__table__, MediaLocal.__table__, JobEvent.__table__):
+        for index in table.indexes:
+            if index.name not in {i['name'] for i in inspector.get_indexes(table.name)}:
+                info(f'Creating index {index.name} on table {table.name}')
+                index.create(engine)
+                created = True
+
+    # Update the planner statistics so the new indexes are used
+    if created:
+        with engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+
+
+def migrate_autoincrement(engine: Engine, table) -> bool:
+    """
+    Rebuild a table created by an earlier version without AUTOINCREMENT. SQLite otherwise hands out the ids of
+    deleted rows again once they are the highest ids. The rows keep their ids and the next id continues from the
+    highest id left; the ids of rows already deleted from the end of the table cannot be recovered.
+    :param engine: The database engine
+    :param table: The job or job event table
+    :return: True if the table was rebuilt
+    """
+    with engine.connect() as conn:
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           dict(name=table.name)).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return False
+
+        rebuilt = f'{table.name}_rebuilt'
+        create = str(CreateTable(table).compile(dialect=engine.dialect)) \
+            .replace(f'CREATE TABLE {table.name} (', f'CREATE TABLE {rebuilt} (', 1)
+        columns = ', '.join(f'"{c.name}"' for c in table.columns)
+        # Rows written by an earlier version may lack values the table now requires
+        values = []
+        for column in table.columns:
+            value = f'"{column.name}"'
+            if not column.nullable and column.server_default is not None:
+                default = column.server_default.arg
+                default = f"'{default}'" if isinstance(default, str) else default.compile(dialect=engine.dialect)
+                value = f'COALESCE({value}, {default})'
+            values.append(value)
+        values = ', '.join(values)
+        # One script in one transaction that takes the write lock up front, so the other process sharing the
+        # database never sees the table half rebuilt
+        dbapi_conn = conn.connection
+        try:
+            dbapi_conn.executescript(f'BEGIN IMMEDIATE;'
+                                     f'DROP TABLE IF EXISTS {rebuilt};'
+                                     f'{create};'
+                                     f'INSERT INTO {rebuilt} ({columns}) SELECT {values} FROM {table.name};'
+                                     f'DROP TABLE {table.name};'
+                                     f'ALTER TABLE {rebuilt} RENAME TO {table.name};'
+                                     f'COMMIT;')
+        except Exception:
+            dbapi_conn.rollback()
+            raise
+    return True
+
+
+def migrate_metadata(conn, table) -> int:
+    """
+    Move the base64 metadata of a table into its JSON column, and any media results into their columns
+    :param conn: The database connection
+    :param table: The job or media table
+    :return: The number of rows moved
+    """
+    is_media = table is MediaLocal.__table__
+    result_columns = RESULT_COLUMNS if is_media else ()
+    pending = table.c.metadata_b64.isnot(None) & table.c.metadata_json.is_(None)
+    update = table.update() \
+        .where(table.c.id == bindparam('row_id')) \
+        .values(metadata_b64=None, metadata_json=bindparam('json'),
+                **{c: func.coalesce(table.c[c], bindparam(c)) for c in result_columns})
+
+    num_rows = 0
+    last_id = 0
+    while True:
+        # Page by id so rows that cannot be decoded, and so stay pending, are passed over
+        rows = conn.execute(select(table.c.id, table.c.metadata_b64)
+                            .where(pending, table.c.id > last_id)
+                            .order_by(table.c.id)
+                            .limit(MIGRATE_BATCH_SIZE)).all()
+        if not rows:
+            return num_rows
+        last_id = rows[-1][0]
+        params = []
+        for row_id, metadata_b64 in rows:
+            try:
+                metadata = json_b64_decode(metadata_b64)
+            except Exception as e:
+                # Leave the row as it is so nothing is lost and the base64 metadata is still read
+                exception(f'Could not decode the metadata of row {row_id} in table {table.name}, skipping it: {e}')
+                continue
+            results = {c: metadata.pop(c, None) for c in result_columns}
+            params.append(dict(row_id=row_id, json=metadata, **results))
+        if params:
+            conn.execute(update, params)
+            num_rows += len(params)
+
+
+def get_metadata(obj) -> dict:
+    """
+    Get the metadata of a job or media, reading the base64 metadata of rows written by an earlier version
+    :param obj: The job or media
+    :return: The metadata
+    """
+    if obj.metadata_json is not None:
+        return dict(obj.metadata_json)
+    if obj.metadata_b64:
+        return json_b64_decode(obj.metadata_b64)
+    return {}
+
+
+def get_results(media: MediaLocal) -> dict:
+    """
+    Get the results of processing a video, e.g. num_tracks
+    :param media: The media
+    :return: Dictionary of s3_path, num_tracks and processing_time_secs
+    """
+    results = {c: getattr(media, c) for c in RESULT_COLUMNS}
+    if media.metadata_json is None and media.metadata_b64:
+        metadata = json_b64_decode(media.metadata_b64)
+        results = {c: results[c] if results[c] is not None else metadata.get(c) for c in RESULT_COLUMNS}
+    return results
+
+
+def set_metadata(obj, metadata: dict):
+    """
+    Set the metadata of a job or media. Media results, e.g. num_tracks, are set in their own columns.
+    :param obj: The job or media
+    :param metadata: The metadata
+    """
+    metadata = dict(metadata)
+    if isinstance(obj, MediaBase):
+        for c in RESULT_COLUMNS:
+            if c in metadata:
+                setattr(obj, c, metadata.pop(c))
+    obj.metadata_json = metadata
+    obj.metadata_b64 = None
+
+
+def update_job_status(conn, whereclause) -> int:
+    """
+    Set the status and media counters of jobs from their media in SQL
+    :param conn: The database connection
+    :param whereclause: Which jobs to update, e.g. JobLocal.__table__.c.status.is_(None)
+    :return: The number of jobs updated
+    """
+    job = JobLocal.__table__
+    media = MediaLocal.__table__
+
+    def num(status: str | None = None):
+        query = select(func.count(media.c.id)).where(media.c.job_id == job.c.id)
+        if status:
+            query = query.where(media.c.status == status)
+        return query.scalar_subquery()
+
+    counters = {counter: num(status) for status, counter in STATUS_COUNTERS.items()}
+    result = conn.execute(job.update().where(whereclause).values(num_media=num(), **counters))
+    if result.rowcount:
+        conn.execute(job.update().where(whereclause).values(status=job_status_column(job.c)))
+    return result.rowcount
+
+
+def get_job_status(job: Job) -> str:
+    """
+    Get the status of a job from its media as deepsea_ai's get_status, which does not know cancelled media
+    :param job: The job
+    :return: The status of the job
+    """
+    status = get_status(job)
+    if status == Status.UNKNOWN and any(m.status == CANCELLED for m in job.media):
+        return CANCELLED
+    return status
+
+
+def set_job_status(job: JobLocal):
+    """
+    Set the status and media counters of a job from its media
+    :param job: The job
+    """
+    statuses = [m.status for m in job.media]
+    job.num_media = len(statuses)
+    for status, counter in STATUS_COUNTERS.items():
+        setattr(job, counter, statuses.count(status))
+    job.status = get_job_status(job)
+
+
+def _sync_job_status(db: Session, flush_context, instances):
+    # Catch media changed or added directly through the ORM rather than through update_media
+    jobs = set()
+    job_ids = db.info.setdefault('job_ids_to_sync', set())
+    for obj in list(db.new) + list(db.dirty) + list(db.deleted):
+        if isinstance(obj, JobLocal):
+            jobs.add(obj)
+        elif isinstance(obj, MediaBase):
+            if isinstance(getattr(obj, 'job', None), JobLocal) and obj not in db.deleted:
+                jobs.add(obj.job)
+            elif obj.job_id is not None:
+                # Media added by job id alone are not in the media of the job until it is loaded again
+                job_ids.add(obj.job_id)
+    for job in jobs:
+        set_job_status(job)
+
+
+def _sync_job_status_by_id(db: Session, flush_context):
+    job_ids = db.info.pop('job_ids_to_sync', None)
+    if not job_ids:
+        return
+    update_job_status(db.connection(), JobLocal.__table__.c.id.in_(job_ids))
+    for obj in db.identity_map.values():
+        if isinstance(obj, JobLocal) and obj.id in job_ids:
+            db.expire(obj, ['status', 'num_media', *STATUS_COUNTERS.values()])
+
+
+def count_jobs_by_status(db: Session, job_type: str | None = None) -> Dict[str, int]:
+    """
+    Count the jobs in each state
+    :param db: The database session
+    :param job_type: Only count jobs of this type, e.g. JobType.DOCKER
+    :return: Dictionary of status to number of jobs
+    """
+    query = db.query(JobLocal.status, func.count(JobLocal.id))
+    if job_type:
+        query = query.filter(JobLocal.job_type == job_type)
+    return dict(query.group_by(JobLocal.status).all())
+
+
+def update_media(db: Session, job: Job, video_name: str, status: str, metadata: dict = None):
     """
     Update a video in a job. If the video does not exist, add it to the job.
     :param db: The database session
     :param job: The job
     :param video_name: The name of the video to update
     :param status: The status of the video
-    :param metadata_b64: The metadata to pass to the job
+    :param metadata: Metadata to add to the media metadata, including any results, e.g. num_tracks
     """
     info(f'Updating media {video_name} in job {job.id} {job.name} to {status}')
 
@@ -94,15 +511,114 @@ def update_media(db: Session, job: Job, video_name: str, status: str, metadata_b
         # Update the media status, timestamp and any additional kwargs
         media.status = status
         media.updatedAt = datetime.utcnow()
-        if metadata_b64:
-            media.metadata_b64 = metadata_b64
+        if metadata:
+            set_metadata(media, {**get_metadata(media), **metadata})
 
     else:
         info(f'A new media {video_name} was added to job {job.id} {job.name}')
-        new_media = Media(name=video_name,
-                          status=status,
-                          job=job,
-                          metadata_b64=metadata_b64,
-                          updatedAt=datetime.utcnow())
-        db.add(new_media)
-        job.media.append(new_media)
+        media = MediaLocal(name=video_name,
+                           status=status,
+                           updatedAt=datetime.utcnow())
+        set_metadata(media, metadata or {})
+        db.add(media)
+        job.media.append(media)
+
+    set_job_status(job)
+    add_job_event(db, job, media)
+
+
+def add_job_event(db: Session, job: Job, media: MediaLocal):
+    """
+    Record the status of a job in the change feed
+    :param db: The database session
+    :param job: The job
+    :param media: The media that changed, with any results, e.g. num_tracks
+    """
+    results = get_results(media)
+    db.add(JobEvent(job_id=job.id,
+                    status=job.status,
+                    num_tracks=results['num_tracks'],
+                    processing_time_secs=results['processing_time_secs']))
+
+
+def bulk_add_jobs(db: Session, jobs: List[dict], media: List[dict]) -> List[int]:
+    """
+    Add many jobs, each with a single media, with one executemany per table instead of the ORM unit of work.
+    Ids are assigned in insert order under the write lock held by the transaction, so the jobs added
+    are the last rows in the job table.
+    :param db: The database session
+    :param jobs: The job column values
+    :param media: The media column values for each job, in the same order as the jobs
+    :return: The ids of the jobs, in the same order as the jobs
+    """
+    if not jobs:
+        return []
+
+    jobs = [dict(job, status=m['status'], num_media=1,
+                 **{counter: int(m['status'] == status) for status, counter in STATUS_COUNTERS.items()})
+            for job, m in zip(jobs, media)]
+    db.execute(JobLocal.__table__.insert(), jobs)
+    last_id = db.query(func.max(JobLocal.id)).scalar()
+    job_ids = list(range(last_id - len(jobs) + 1, last_id + 1))
+    db.execute(MediaLocal.__table__.insert(), [dict(m, job_id=job_id) for m, job_id in zip(media, job_ids)])
+    db.execute(JobEvent.__table__.insert(), [dict(job_id=job_id, status=m['status']) for m, job_id in zip(media, job_ids)])
+    return job_ids
+
+
+def job_status_column(columns):
+    """
+    SQL expression for the status of a job from its media counters, with the same precedence as get_job_status
+    :param columns: The job table columns
+    :return: The status expression
+    """
+    return case(
+        (columns.num_running > 0, Status.RUNNING),
+        (columns.num_queued > 0, Status.QUEUED),
+        (columns.num_failed > 0, Status.FAILED),
+        (columns.num_success == columns.num_media, Status.SUCCESS),
+        (columns.num_cancelled > 0, CANCELLED),
+        else_=Status.UNKNOWN)
+
+
+def _utc_naive(dt: datetime | None) -> datetime | None:
+    # Timestamps are stored as naive UTC
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def query_job_status(db: Session,
+                     after_id: int | None = None,
+                     limit: int | None = None,
+                     status: str | None = None,
+                     model: str | None = None,
+                     created_after: datetime | None = None,
+                     created_before: datetime | None = None) -> Query:
+    """
+    Query the id, name and status of the DOCKER jobs, ordered by id. Paging is keyset based on the job id
+    so each page costs the same regardless of how many jobs are in the database, including when filtered by status.
+    :param db: The database session
+    :param after_id: Only return jobs with an id greater than this
+    :param limit: Maximum number of jobs to return
+    :param status: Only return jobs with this status
+    :param model: Only return jobs run with this model s3 path
+    :param created_after: Only return jobs created at or after this time
+    :param created_before: Only return jobs created before this time
+    :return: The query of (id, name, status) rows
+    """
+    query = db.query(JobLocal.id, JobLocal.name, JobLocal.status) \
+        .filter(JobLocal.job_type == JobType.DOCKER)
+    if status:
+        query = query.filter(JobLocal.status == status)
+    if after_id is not None:
+        query = query.filter(JobLocal.id > after_id)
+    if model:
+        query = query.filter(JobLocal.model == model)
+    if created_after:
+        query = query.filter(JobLocal.createdAt >= _utc_naive(created_after))
+    if created_before:
+        query = query.filter(JobLocal.createdAt < _utc_naive(created_before))
+    query = query.order_by(JobLocal.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
@@ -0,0 +1,132 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/dedup.py
+# Description: Identify identical video, model and args submissions so results can be reused
+
+import hashlib
+import json
+import shlex
+from dataclasses import dataclass
+from typing import Dict, List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy.orm import Session, aliased
+
+from app.job.database import JobLocal, MediaLocal, update_media, CANCELLED
+
+# SQLite limits the number of variables in a statement
+MAX_KEYS_PER_QUERY = 500
+
+
+@dataclass
+class Duplicate:
+    job_id: int
+    job_name: str
+    status: str
+    s3_path: str | None = None
+    num_tracks: int | None = None
+
+
+def normalize_args(args: str | None) -> str:
+    """
+    Normalize the model arguments so equivalent arguments compare equal, e.g.
+    '--iou-thres=0.4 --conf-thres 0.01' and '--conf-thres=0.01 --iou-thres 0.4'
+    :param args: The arguments to pass to the model
+    :return: The arguments sorted by flag with values separated by a space
+    """
+    if not args:
+        return ''
+
+    options = []
+    for token in shlex.split(args):
+        is_value = not token.startswith('-') or token[1:2].isdigit() or token[1:2] == '.'
+        if is_value and options:
+            options[-1].append(token)
+        elif '=' in token:
+            options.append(token.split('=', 1))
+        else:
+            options.append([token])
+    return ' '.join(' '.join(option) for option in sorted(options))
+
+
+def content_key(video: str, etag: str | None, content_length: int | None, model_s3: str, args: str | None) -> str:
+    """
+    Key for the content of a submission. Identical keys produce identical results.
+    :param video: The url of the video
+    :param etag: The ETag of the video, if known
+    :param content_length: The size of the video, if known
+    :param model_s3: The s3 path of the model
+    :param args: The arguments to pass to the model
+    :return: The content key
+    """
+    content = json.dumps([video, etag, content_length, model_s3, normalize_args(args)])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def find_duplicates(db: Session, keys: List[str]) -> Dict[str, Duplicate]:
+    """
+    Find the jobs that completed or are in flight for each content key. A completed job is preferred.
+    :param db: The database session
+    :param keys: The content keys
+    :return: Dictionary of content key to the matching job
+    """
+    duplicates = {}
+    keys = list(set(keys))
+    for i in range(0, len(keys), MAX_KEYS_PER_QUERY):
+        rows = db.query(JobLocal.id, JobLocal.name, JobLocal.content_key, MediaLocal.status, MediaLocal.s3_path,
+                        MediaLocal.num_tracks) \
+            .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+            .filter(JobLocal.content_key.in_(keys[i:i + MAX_KEYS_PER_QUERY]),
+                    JobLocal.duplicate_of.is_(None),
+                    MediaLocal.status.in_([Status.SUCCESS, Status.QUEUED, Status.RUNNING])) \
+            .order_by(JobLocal.id)
+        for job_id, job_name, key, status, s3_path, num_tracks in rows:
+            found = duplicates.get(key)
+            if found and found.status == Status.SUCCESS and status != Status.SUCCESS:
+                continue
+            duplicate = Duplicate(job_id=job_id, job_name=job_name, status=status)
+            if status == Status.SUCCESS:
+                duplicate.s3_path = s3_path
+                duplicate.num_tracks = num_tracks
+            duplicates[key] = duplicate
+    return duplicates
+
+
+def get_followers(db: Session, job: JobLocal) -> List[JobLocal]:
+    """
+    Get the jobs attached to a job because they were submitted while it was queued or running, other than
+    those cancelled since
+    :param db: The database session
+    :param job: The job
+    :return: The attached jobs
+    """
+    return db.query(JobLocal).filter(JobLocal.duplicate_of == job.id, JobLocal.status != CANCELLED).all()
+
+
+def update_followers(db: Session, job: JobLocal, status: str, metadata: dict = None) -> List[JobLocal]:
+    """
+    Update the jobs attached to a job to the status of the job
+    :param db: The database session
+    :param job: The job
+    :param status: The status of the job
+    :param metadata: Results to add to the media metadata of the attached jobs, e.g. s3_path
+    :return: The attached jobs
+    """
+    followers = get_followers(db, job)
+    for follower in followers:
+        update_media(db, follower, follower.media[0].name, status, metadata=metadata)
+    return followers
+
+
+def get_orphaned_followers(db: Session) -> List[JobLocal]:
+    """
+    Get the attached jobs that are still queued or running although the job they are attached to has completed,
+    e.g. because they were attached while the job was completing
+    :param db: The database session
+    :return: The attached jobs
+    """
+    primary = aliased(JobLocal)
+    return db.query(JobLocal) \
+        .join(primary, JobLocal.duplicate_of == primary.id) \
+        .filter(JobLocal.status.in_([Status.QUEUED, Status.RUNNING]),
+                primary.status.in_([Status.SUCCESS, Status.FAILED])) \
+        .all()
@@ -0,0 +1,47 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/executor.py
+# Description: Run blocking database work off the event loop
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.metrics import DB_SECONDS
+
+
+class DatabaseExecutor:
+
+    def __init__(self, max_readers: int = 4):
+        """
+        Thread pools for database work so SQLite lock waits do not block the event loop.
+        Reads run concurrently; writes run one at a time on a single thread. SQLite allows one writer anyway,
+        and it keeps read-then-insert submissions, e.g. finding duplicates then adding jobs, from interleaving.
+        :param max_readers: Maximum number of concurrent reads
+        """
+        self._readers = ThreadPoolExecutor(max_workers=max_readers, thread_name_prefix='db-read')
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+
+    async def _run(self, executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs) -> Any:
+        time_start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            DB_SECONDS.labels(fn.__name__).observe(time.perf_counter() - time_start)
+
+    async def read(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a function that reads from the database
+        """
+        return await self._run(self._readers, fn, *args, **kwargs)
+
+    async def write(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a function that writes to the database, after any writes already submitted
+        """
+        return await self._run(self._writer, fn, *args, **kwargs)
+
+    def shutdown(self):
+        self._readers.shutdown(wait=False, cancel_futures=True)
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,125 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/feed.py
+# Description: Fan out job status transitions from the job_event table to subscribers
+
+import asyncio
+import contextlib
+from typing import AsyncIterator, Iterable, List, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from app.job.database import JobEvent
+from app.logger import exception
+
+
+class Subscription:
+
+    def __init__(self, job_ids: Iterable[int] | None = None, max_events: int = 1000):
+        """
+        Queue of job status events for a subscriber
+        :param job_ids: The jobs to receive events for, or None for all jobs
+        :param max_events: Maximum number of events to hold; the oldest are dropped for slow subscribers
+        """
+        self.job_ids: Set[int] | None = set(job_ids) if job_ids else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_events)
+
+    def publish(self, event: dict):
+        if self.job_ids is not None and event['job_id'] not in self.job_ids:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """
+        Wait for the next event
+        :param timeout: Seconds to wait, or None to wait forever
+        :return: The event, or None if the timeout expired
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class JobFeed:
+
+    def __init__(self, session_maker: sessionmaker, poll_secs: float = 0.5, batch_size: int = 1000):
+        """
+        Tail the job_event table and publish new events to subscribers. The table is only polled while there
+        are subscribers, so a single cheap indexed query serves any number of clients.
+        :param session_maker: The database sessionmaker
+        :param poll_secs: Seconds between polls of the job_event table
+        :param batch_size: Maximum number of events to read per poll
+        """
+        self._session_maker = session_maker
+        self._poll_secs = poll_secs
+        self._batch_size = batch_size
+        self._subscribers: Set[Subscription] = set()
+        self._last_id = None
+        self._task = None
+
+    def _fetch_last_id(self) -> int:
+        with self._session_maker.begin() as db:
+            return db.query(func.max(JobEvent.id)).scalar() or 0
+
+    def _fetch(self, after_id: int) -> List[dict]:
+        with self._session_maker.begin() as db:
+            events = db.query(JobEvent) \
+                .filter(JobEvent.id > after_id) \
+                .order_by(JobEvent.id) \
+                .limit(self._batch_size) \
+                .all()
+            return [{"id": e.id,
+                     "job_id": e.job_id,
+                     "status": e.status,
+                     "num_tracks": e.num_tracks,
+                     "processing_time_secs": e.processing_time_secs,
+                     "updated_at": f"{e.createdAt}"} for e in events]
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                events = await asyncio.to_thread(self._fetch, self._last_id)
+                for event in events:
+                    self._last_id = event['id']
+                    for subscriber in list(self._subscribers):
+                        subscriber.publish(event)
+                # Read the next batch straight away if this one was full
+                if len(events) == self._batch_size:
+                    continue
+            except Exception as e:
+                exception(f'Error reading job events: {e}')
+            await asyncio.sleep(self._poll_secs)
+
+        # Nobody is listening so start from the latest event next time
+        self._last_id = None
+        self._task = None
+
+    @contextlib.asynccontextmanager
+    async def listen(self, job_ids: Iterable[int] | None = None) -> AsyncIterator[Subscription]:
+        """
+        Subscribe to the status events published after the subscription starts
+        :param job_ids: The jobs to receive events for, or None for all jobs
+        :return: The subscription
+        """
+        if self._last_id is None:
+            self._last_id = await asyncio.to_thread(self._fetch_last_id)
+        subscription = Subscription(job_ids)
+        self._subscribers.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            yield subscription
+        finally:
+            self._subscribers.discard(subscription)
+
+    async def stop(self):
+        self._subscribers.clear()
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
+        self._last_id = None
@@ -0,0 +1,157 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/lease.py
+# Description: Claim queued jobs for a daemon worker under a lease, so any number of workers can drain one queue.
+# Workers renew the leases of their running jobs; the jobs of a worker that stops renewing are queued again.
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy import update
+from sqlalchemy.orm import Session, selectinload
+
+from app.job.database import JobLocal, WorkerHeartbeat, update_media
+from app.job.dedup import update_followers
+
+
+@dataclass
+class Worker:
+    id: str
+    hostname: str
+    pid: int
+    num_slots: int
+    num_running: int
+    started_at: str
+    heartbeat_at: str
+    heartbeat_age_secs: float
+
+
+def claim_jobs(db: Session, job_ids: List[int], worker_id: str, lease_secs: float,
+               max_jobs: int | None = None) -> List[JobLocal]:
+    """
+    Claim queued jobs for a worker and mark them running. Each claim is a conditional update that only succeeds
+    if the job is still queued, so of any workers racing for a job exactly one gets it. The first claim takes the
+    database write lock, which is held until the session commits.
+    :param db: The database session
+    :param job_ids: The jobs to claim, e.g. from the scheduler
+    :param worker_id: The worker
+    :param lease_secs: How long the claim lasts unless renewed
+    :param max_jobs: Stop after claiming this many jobs, e.g. the free slots of the worker
+    :return: The jobs claimed, in the order of job_ids
+    """
+    lease_expires = datetime.utcnow() + timedelta(seconds=lease_secs)
+    claimed = []
+    for job_id in job_ids:
+        if max_jobs is not None and len(claimed) == max_jobs:
+            break
+        result = db.execute(update(JobLocal)
+                            .where(JobLocal.id == job_id,
+                                   JobLocal.status == Status.QUEUED,
+                                   JobLocal.duplicate_of.is_(None))
+                            .values(worker_id=worker_id, lease_expires=lease_expires)
+                            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    if not claimed:
+        return []
+
+    jobs = {job.id: job for job in db.query(JobLocal)
+            .options(selectinload(JobLocal.media))
+            .filter(JobLocal.id.in_(claimed))}
+    for job in jobs.values():
+        update_media(db, job, job.media[0].name, Status.RUNNING)
+        update_followers(db, job, Status.RUNNING)
+    return [jobs[job_id] for job_id in claimed]
+
+
+def renew_leases(db: Session, worker_id: str, lease_secs: float) -> int:
+    """
+    Extend the leases of the running jobs of a worker
+    :param db: The database session
+    :param worker_id: The worker
+    :param lease_secs: How long from now the leases last
+    :return: The number of leases renewed
+    """
+    result = db.execute(update(JobLocal)
+                        .where(JobLocal.worker_id == worker_id, JobLocal.status == Status.RUNNING)
+                        .values(lease_expires=datetime.utcnow() + timedelta(seconds=lease_secs))
+                        .execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def reclaim_expired(db: Session) -> List[int]:
+    """
+    Queue again the running jobs whose lease expired, e.g. their worker died. Each is a conditional update, so a
+    job is only queued again once when several workers reclaim at the same time.
+    :param db: The database session
+    :return: The ids of the jobs queued again
+    """
+    now = datetime.utcnow()
+    expired = [job_id for job_id, in db.query(JobLocal.id)
+               .filter(JobLocal.status == Status.RUNNING, JobLocal.lease_expires < now)]
+    reclaimed = []
+    for job_id in expired:
+        result = db.execute(update(JobLocal)
+                            .where(JobLocal.id == job_id,
+                                   JobLocal.status == Status.RUNNING,
+                                   JobLocal.lease_expires < now)
+                            .values(worker_id=None, lease_expires=None)
+                            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            reclaimed.append(job_id)
+
+    for job in db.query(JobLocal).options(selectinload(JobLocal.media)).filter(JobLocal.id.in_(reclaimed)):
+        update_media(db, job, job.media[0].name, Status.QUEUED)
+        update_followers(db, job, Status.QUEUED)
+    return reclaimed
+
+
+def holds_lease(job: JobLocal, worker_id: str) -> bool:
+    """
+    Check a worker still holds a job, so a worker whose job was reclaimed does not overwrite its new worker
+    :param job: The job
+    :param worker_id: The worker
+    :return: True if the job is running under the worker's claim
+    """
+    return job.worker_id == worker_id and job.status == Status.RUNNING
+
+
+def record_heartbeat(db: Session, worker_id: str, hostname: str, pid: int, num_slots: int, num_running: int,
+                     started_at: datetime):
+    """
+    Record that a worker is alive
+    :param db: The database session
+    :param worker_id: The worker
+    :param hostname: Where the worker runs
+    :param pid: The process id of the worker
+    :param num_slots: The number of jobs the worker runs concurrently
+    :param num_running: The number of jobs the worker is running
+    :param started_at: When the worker started
+    """
+    db.merge(WorkerHeartbeat(id=worker_id, hostname=hostname, pid=pid, num_slots=num_slots, num_running=num_running,
+                             startedAt=started_at, heartbeatAt=datetime.utcnow()))
+
+
+def forget_workers(db: Session, older_than_secs: float) -> int:
+    """
+    Delete the heartbeats of workers that stopped long ago
+    :param db: The database session
+    :param older_than_secs: Delete heartbeats older than this
+    :return: The number of workers forgotten
+    """
+    before = datetime.utcnow() - timedelta(seconds=older_than_secs)
+    return db.query(WorkerHeartbeat).filter(WorkerHeartbeat.heartbeatAt < before).delete(synchronize_session=False)
+
+
+def get_workers(db: Session) -> List[Worker]:
+    """
+    Get the workers by their last heartbeat, most recent first
+    :param db: The database session
+    :return: The workers
+    """
+    now = datetime.utcnow()
+    return [Worker(id=w.id, hostname=w.hostname, pid=w.pid, num_slots=w.num_slots, num_running=w.num_running,
+                   started_at=w.startedAt.isoformat(), heartbeat_at=w.heartbeatAt.isoformat(),
+                   heartbeat_age_secs=round((now - w.heartbeatAt).total_seconds(), 3))
+            for w in db.query(WorkerHeartbeat).order_by(WorkerHeartbeat.heartbeatAt.desc())]
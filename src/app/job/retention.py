@@ -0,0 +1,179 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/retention.py
+# Description: Archive finished jobs, prune the change feed and compact the job cache database
+
+import gzip
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy import func, inspect, text
+from sqlalchemy.orm import Session, sessionmaker, aliased, selectinload
+
+from app.job.database import JobLocal, MediaLocal, JobEvent, CANCELLED
+from app.logger import info, debug
+
+# Jobs that will not change again and can be archived
+FINISHED_STATUSES = [Status.SUCCESS, Status.FAILED, CANCELLED]
+
+# PRAGMA auto_vacuum value for incremental vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _row_dict(obj) -> dict:
+    return {c.key: getattr(obj, c.key) for c in inspect(obj).mapper.column_attrs}
+
+
+def get_archivable_jobs(db: Session, older_than: datetime, limit: int) -> List[JobLocal]:
+    """
+    Get the oldest finished jobs created before a time. Jobs with attached jobs still in flight are kept
+    so the attached jobs can get their results.
+    :param db: The database session
+    :param older_than: Only return jobs created before this time, as naive UTC
+    :param limit: Maximum number of jobs to return
+    :return: The jobs, in id order
+    """
+    follower = aliased(JobLocal)
+    in_flight_followers = db.query(follower.id) \
+        .filter(follower.duplicate_of == JobLocal.id, follower.status.in_([Status.QUEUED, Status.RUNNING])) \
+        .exists()
+    return db.query(JobLocal) \
+        .options(selectinload(JobLocal.media)) \
+        .filter(JobLocal.status.in_(FINISHED_STATUSES), JobLocal.createdAt < older_than, ~in_flight_followers) \
+        .order_by(JobLocal.id) \
+        .limit(limit) \
+        .all()
+
+
+def archive_jobs(session_maker: sessionmaker, archive_path: Path, older_than: datetime, batch_size: int = 1000) -> int:
+    """
+    Move finished jobs created before a time to a gzip compressed NDJSON file, one job with its media per line.
+    Each batch is written and synced to the file before it is deleted from the database, so a failure may repeat
+    jobs in the archive but never loses them.
+    :param session_maker: The database sessionmaker
+    :param archive_path: The directory to write the archive files to, one file per month
+    :param older_than: Archive jobs created before this time, as naive UTC
+    :param batch_size: Number of jobs to archive per transaction
+    :return: The number of jobs archived
+    """
+    archive_path.mkdir(parents=True, exist_ok=True)
+    archive_file = archive_path / f'jobs-{datetime.utcnow().strftime("%Y%m")}.ndjson.gz'
+
+    num_archived = 0
+    while True:
+        with session_maker.begin() as db:
+            jobs = get_archivable_jobs(db, older_than, batch_size)
+            if not jobs:
+                break
+
+            # Each batch is a new gzip member; gzip readers read the members of a file as one stream
+            with gzip.open(archive_file, 'at', encoding='utf-8') as f:
+                for job in jobs:
+                    record = _row_dict(job)
+                    record['media'] = [_row_dict(m) for m in job.media]
+                    f.write(json.dumps(record, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            job_ids = [job.id for job in jobs]
+            db.query(JobEvent).filter(JobEvent.job_id.in_(job_ids)).delete(synchronize_session=False)
+            db.query(MediaLocal).filter(MediaLocal.job_id.in_(job_ids)).delete(synchronize_session=False)
+            db.query(JobLocal).filter(JobLocal.id.in_(job_ids)).delete(synchronize_session=False)
+            num_archived += len(job_ids)
+            debug(f'Archived jobs {job_ids[0]} to {job_ids[-1]} to {archive_file}')
+
+    if num_archived:
+        info(f'Archived {num_archived} jobs created before {older_than} to {archive_file}')
+    return num_archived
+
+
+def read_archive(archive_file: Path) -> List[dict]:
+    """
+    Read the jobs in an archive file
+    :param archive_file: The archive file
+    :return: The jobs with their media
+    """
+    with gzip.open(archive_file, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def prune_events(session_maker: sessionmaker, older_than: datetime) -> int:
+    """
+    Delete change feed events created before a time. Subscribers only need recent events.
+    :param session_maker: The database sessionmaker
+    :param older_than: Delete events created before this time, as naive UTC
+    :return: The number of events deleted
+    """
+    with session_maker.begin() as db:
+        last_id = db.query(func.max(JobEvent.id)).filter(JobEvent.createdAt < older_than).scalar()
+        if last_id is None:
+            return 0
+        # Delete by id so the primary key is used rather than scanning the timestamps
+        num_deleted = db.query(JobEvent).filter(JobEvent.id <= last_id).delete(synchronize_session=False)
+    if num_deleted:
+        info(f'Deleted {num_deleted} job events created before {older_than}')
+    return num_deleted
+
+
+def compact(session_maker: sessionmaker, max_pages: int = 1000) -> int:
+    """
+    Return free pages to the file system. The first call on a database created without incremental vacuum
+    runs a full VACUUM to enable it, so call this when the database is idle.
+    :param session_maker: The database sessionmaker
+    :param max_pages: Maximum number of pages to free per call, to bound the time the write lock is held
+    :return: The number of pages freed
+    """
+    engine = session_maker.kw['bind']
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        free_pages = conn.execute(text('PRAGMA freelist_count')).scalar()
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() != AUTO_VACUUM_INCREMENTAL:
+            info(f'Enabling incremental vacuum with a full VACUUM')
+            conn.execute(text(f'PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}'))
+            conn.execute(text('VACUUM'))
+            return free_pages
+        if free_pages == 0:
+            return 0
+        # pysqlite steps a statement without result columns only once, which frees a single page, so run it
+        # as a script to step it to completion
+        conn.connection.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+        conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        freed = free_pages - conn.execute(text('PRAGMA freelist_count')).scalar()
+    info(f'Freed {freed} of {free_pages} free database pages')
+    return freed
+
+
+def database_stats(session_maker: sessionmaker, archive_path: Path | None = None) -> dict:
+    """
+    Get the size of the database and the number of rows in each table
+    :param session_maker: The database sessionmaker
+    :param archive_path: The directory of the archive files, if any
+    :return: dictionary of sizes and counts
+    """
+    engine = session_maker.kw['bind']
+    db_file = Path(engine.url.database)
+    wal_file = db_file.with_name(db_file.name + '-wal')
+    with session_maker.begin() as db:
+        page_size = db.execute(text('PRAGMA page_size')).scalar()
+        stats = {
+            "file_bytes": db_file.stat().st_size if db_file.exists() else 0,
+            "wal_bytes": wal_file.stat().st_size if wal_file.exists() else 0,
+            "page_size": page_size,
+            "page_count": db.execute(text('PRAGMA page_count')).scalar(),
+            "free_pages": db.execute(text('PRAGMA freelist_count')).scalar(),
+            "incremental_vacuum": db.execute(text('PRAGMA auto_vacuum')).scalar() == AUTO_VACUUM_INCREMENTAL,
+            "rows": {
+                "job": db.query(func.count(JobLocal.id)).scalar(),
+                "media": db.query(func.count(MediaLocal.id)).scalar(),
+                "job_event": db.query(func.count(JobEvent.id)).scalar(),
+            },
+        }
+    if archive_path is not None:
+        files = sorted(archive_path.glob('jobs-*.ndjson.gz')) if archive_path.exists() else []
+        stats["archive"] = {"path": archive_path.as_posix(),
+                            "files": [f.name for f in files],
+                            "bytes": sum(f.stat().st_size for f in files)}
+    return stats
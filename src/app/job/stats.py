@@ -0,0 +1,263 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/stats.py
+# Description: Rolling processing time statistics per model, args and hardware, and start and completion
+# estimates for queued and running jobs
+
+import heapq
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from deepsea_ai.database.job import Status
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.job.database import JobLocal, MediaLocal
+
+GB = 1e9
+
+
+@dataclass
+class ProcessingStats:
+    args: str | None
+    hardware: str | None
+    num_jobs: int  # Number of recent jobs the statistics are computed from
+    mean_secs: float
+    median_secs: float
+    p90_secs: float
+    secs_per_gb: float | None  # Processing time normalized by video size, if the sizes are known
+    jobs_per_hour: float  # Throughput of one concurrent process
+    last_completed: str
+
+
+@dataclass
+class Sample:
+    secs: float
+    size_bytes: int | None
+    completed: datetime
+
+
+def rate(samples: List[Sample]) -> (float, float | None):
+    """
+    The mean processing time of jobs, and the mean processing time per byte of the jobs with a known video size
+    :param samples: The jobs
+    :return: The mean seconds, and the seconds per byte or None if no video size is known
+    """
+    sized = [s for s in samples if s.size_bytes]
+    secs_per_byte = sum(s.secs for s in sized) / sum(s.size_bytes for s in sized) if sized else None
+    return statistics.fmean(s.secs for s in samples), secs_per_byte
+
+
+def summarize(args: str | None, hardware: str | None, samples: List[Sample]) -> ProcessingStats:
+    """
+    Summarize the processing times of a group of jobs
+    :param args: The arguments of the jobs
+    :param hardware: Where the jobs were processed
+    :param samples: The jobs, most recent first
+    :return: The statistics
+    """
+    secs = sorted(s.secs for s in samples)
+    mean_secs, secs_per_byte = rate(samples)
+    return ProcessingStats(args=args,
+                           hardware=hardware,
+                           num_jobs=len(samples),
+                           mean_secs=round(mean_secs, 3),
+                           median_secs=round(statistics.median(secs), 3),
+                           p90_secs=round(secs[min(len(secs) - 1, int(0.9 * len(secs)))], 3),
+                           secs_per_gb=round(secs_per_byte * GB, 3) if secs_per_byte is not None else None,
+                           jobs_per_hour=round(3600 / mean_secs, 3) if mean_secs > 0 else 0.,
+                           last_completed=f"{samples[0].completed}")
+
+
+class StatsService:
+
+    def __init__(self, session_maker: sessionmaker, num_recent: int = 100, ttl_secs: float = 60,
+                 default_processing_secs: float = 300., data_version: Callable[[], int] | None = None,
+                 queue_ttl_secs: float = 5):
+        """
+        Processing time statistics of the most recent completed jobs for each model, args and hardware,
+        loaded from the database and kept for ttl_secs. Jobs attached to an identical job are not counted
+        as they share its processing time.
+        :param session_maker: The database sessionmaker
+        :param num_recent: Number of recent jobs to keep for each model, args and hardware
+        :param ttl_secs: How long the statistics are considered fresh
+        :param default_processing_secs: Processing time to assume before any job has completed
+        :param data_version: Returns a number that changes when the database changes, e.g. StatusCache.data_version;
+        the queue simulation is reused until it changes. Without it the queue is simulated on every call
+        :param queue_ttl_secs: How long the queue simulation is reused without a change, as the estimates move
+        with time
+        """
+        self._session_maker = session_maker
+        self._num_recent = num_recent
+        self._ttl_secs = ttl_secs
+        self._default_processing_secs = default_processing_secs
+        self._data_version = data_version
+        self._queue_ttl_secs = queue_ttl_secs
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str | None, str | None], List[Sample]] = {}
+        self._rates: Dict[tuple, Tuple[float, float | None]] = {}
+        self._loaded_at = None
+        # The last queue simulation: its database version, number of processes, expiry and estimates
+        self._queue = None
+
+    def refresh(self):
+        """
+        Load the processing times of the most recent completed jobs
+        """
+        group = (JobLocal.model, JobLocal.args, MediaLocal.hardware)
+        samples = {}
+        with self._session_maker.begin() as db:
+            # Number the completed jobs of each group, most recent first
+            recent = db.query(*group,
+                              MediaLocal.processing_time_secs,
+                              MediaLocal.size_bytes,
+                              MediaLocal.updatedAt,
+                              func.row_number().over(partition_by=group, order_by=MediaLocal.id.desc()).label('n')) \
+                .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+                .filter(MediaLocal.status == Status.SUCCESS,
+                        MediaLocal.processing_time_secs.isnot(None),
+                        JobLocal.duplicate_of.is_(None)) \
+                .subquery()
+            rows = db.query(recent).filter(recent.c.n <= self._num_recent).order_by(recent.c.n)
+            for model, args, hardware, secs, size_bytes, completed, _ in rows:
+                samples.setdefault((model, args, hardware), []).append(Sample(secs, size_bytes, completed))
+
+        # Rates for the same model and args, the same model, and any model, for expected_secs
+        pooled = {}
+        for (model, args, _), group_samples in samples.items():
+            for key in (('args', model, args), ('model', model), ('all',)):
+                pooled.setdefault(key, []).extend(group_samples)
+        rates = {key: rate(pooled_samples) for key, pooled_samples in pooled.items()}
+
+        with self._lock:
+            self._samples = samples
+            self._rates = rates
+            self._loaded_at = time.monotonic()
+
+    def _refresh_if_stale(self):
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self._ttl_secs
+        if not fresh:
+            self.refresh()
+
+    def model_stats(self, model: str) -> List[ProcessingStats]:
+        """
+        Get the statistics of a model for each args and hardware
+        :param model: The s3 path of the model
+        :return: The statistics, most jobs first
+        """
+        self._refresh_if_stale()
+        with self._lock:
+            samples = self._samples
+        stats = [summarize(args, hardware, group_samples)
+                 for (m, args, hardware), group_samples in samples.items() if m == model]
+        return sorted(stats, key=lambda s: s.num_jobs, reverse=True)
+
+    def expected_secs(self, model: str, args: str | None, size_bytes: int | None) -> float:
+        """
+        Estimate the processing time of a job from the jobs with the same model and args, or the same model,
+        or any model, scaled by the video size when the sizes are known
+        :param model: The s3 path of the model
+        :param args: The arguments to pass to the model
+        :param size_bytes: The size of the video, if known
+        :return: The estimated processing time in seconds
+        """
+        self._refresh_if_stale()
+        with self._lock:
+            rates = self._rates
+        for key in (('args', model, args), ('model', model), ('all',)):
+            if key in rates:
+                mean_secs, secs_per_byte = rates[key]
+                if size_bytes and secs_per_byte is not None:
+                    return secs_per_byte * size_bytes
+                return mean_secs
+        return self._default_processing_secs
+
+    def estimate(self, db: Session, job: JobLocal, num_procs: int) -> (datetime | None, datetime | None):
+        """
+        Estimate when a queued or running job will start and complete. Queued jobs start in id order as
+        the running jobs complete, with num_procs jobs running at a time.
+        :param db: The database session
+        :param job: The job
+        :param num_procs: Number of jobs the daemon runs concurrently
+        :return: The estimated start and completion as naive UTC, or None if the job has finished
+        """
+        return self.estimates(db, [job], num_procs)[job.id]
+
+    def estimates(self, db: Session, jobs: List[JobLocal], num_procs: int) -> Dict[int, Tuple[datetime | None,
+                                                                                             datetime | None]]:
+        """
+        Estimate when jobs will start and complete as in estimate, from one simulation of the queue
+        :param db: The database session
+        :param jobs: The jobs
+        :param num_procs: Number of jobs the daemon runs concurrently
+        :return: Dictionary of job id to the estimated start and completion
+        """
+        # Attached jobs complete with the job they are attached to
+        primaries = {job.id: job for job in jobs if job.duplicate_of is None}
+        missing = {job.duplicate_of for job in jobs if job.duplicate_of is not None} - primaries.keys()
+        if missing:
+            primaries.update((job.id, job) for job in db.query(JobLocal).filter(JobLocal.id.in_(missing)))
+
+        now = datetime.utcnow()
+        estimates = {}
+        for job in primaries.values():
+            if job.status == Status.RUNNING:
+                media = job.media[0]
+                start = media.updatedAt or now
+                secs = self.expected_secs(job.model, job.args, media.size_bytes)
+                estimates[job.id] = start, max(now, start + timedelta(seconds=secs))
+
+        if any(job.status == Status.QUEUED for job in primaries.values()):
+            queue = self.queue_estimates(db, num_procs)
+            for job in primaries.values():
+                if job.status == Status.QUEUED and job.id in queue:
+                    estimates[job.id] = queue[job.id]
+
+        return {job.id: estimates.get(job.id if job.duplicate_of is None else job.duplicate_of, (None, None))
+                for job in jobs}
+
+    def queue_estimates(self, db: Session, num_procs: int) -> Dict[int, Tuple[datetime, datetime]]:
+        """
+        Simulate the whole queue: queued jobs start in id order as the running jobs complete, with num_procs jobs
+        running at a time. The simulation is reused until the database changes or queue_ttl_secs pass, so status
+        polls do not each cost a pass over the queue.
+        :param db: The database session
+        :param num_procs: Number of jobs the daemon runs concurrently
+        :return: Dictionary of the id of each queued job to its estimated start and completion
+        """
+        # Read the version before the queue, so a change while simulating is seen on the next call
+        version = self._data_version() if self._data_version else None
+        with self._lock:
+            queue = self._queue
+        if version is not None and queue is not None and queue[:2] == (version, num_procs) \
+                and time.monotonic() < queue[2]:
+            return queue[3]
+
+        now = datetime.utcnow()
+        job_columns = (JobLocal.model, JobLocal.args, MediaLocal.size_bytes, MediaLocal.updatedAt)
+        primary_jobs = db.query(JobLocal.id, *job_columns) \
+            .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+            .filter(JobLocal.duplicate_of.is_(None))
+        running = primary_jobs.filter(JobLocal.status == Status.RUNNING).all()
+        queued = primary_jobs.filter(JobLocal.status == Status.QUEUED).order_by(JobLocal.id)
+
+        # The time each process frees up, starting with the running jobs
+        slots = [max(now, (updated or now) + timedelta(seconds=self.expected_secs(model, args, size_bytes)))
+                 for _, model, args, size_bytes, updated in running]
+        slots += [now] * max(0, num_procs - len(slots))
+        heapq.heapify(slots)
+        estimates = {}
+        for job_id, model, args, size_bytes, _ in queued:
+            start = heapq.heappop(slots)
+            completion = start + timedelta(seconds=self.expected_secs(model, args, size_bytes))
+            heapq.heappush(slots, completion)
+            estimates[job_id] = start, completion
+
+        if version is not None:
+            with self._lock:
+                self._queue = (version, num_procs, time.monotonic() + self._queue_ttl_secs, estimates)
+        return estimates
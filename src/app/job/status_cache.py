@@ -0,0 +1,124 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: job/status_cache.py
+# Description: Read-through cache of job status, cleared when the job cache database changes
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from sqlalchemy.orm import sessionmaker
+
+
+def status_key(kind: str, value: Hashable) -> tuple:
+    """
+    Get the cache key of a job status, shared by the single and batch status requests
+    :param kind: job_id or job_name
+    :param value: The job id or name
+    :return: The key, e.g. ('job_id', 19)
+    """
+    return kind, value
+
+
+class StatusCache:
+
+    def __init__(self, session_maker: sessionmaker, max_entries: int = 10000, ttl_secs: float = 5):
+        """
+        Cache of job status by job id or name. Every read checks PRAGMA data_version on a dedicated connection,
+        which changes when any other connection, e.g. the daemon or an API writer, commits to the database. The
+        whole cache is cleared on a change, so a cached status is never older than the database.
+        :param session_maker: The database sessionmaker
+        :param max_entries: Maximum number of entries; the least recently used are evicted first
+        :param ttl_secs: How long an entry is kept without a change, as the start and completion estimates of
+        queued and running jobs move with time
+        """
+        self._engine = session_maker.kw['bind']
+        self._max_entries = max_entries
+        self._ttl_secs = ttl_secs
+        self._lock = threading.Lock()
+        # Held while the database is queried, so a slow query never holds up the cache lookups
+        self._conn_lock = threading.Lock()
+        self._conn = None
+        self._version = None
+        self._cache: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _data_version(self) -> int:
+        # The version only changes for commits made by other connections, so this connection is only used here
+        if self._conn is None:
+            self._conn = self._engine.raw_connection()
+        cursor = self._conn.cursor()
+        try:
+            return cursor.execute('PRAGMA data_version').fetchone()[0]
+        finally:
+            cursor.close()
+
+    def data_version(self) -> int:
+        """
+        Get a number that changes when another connection commits to the database
+        :return: The data version
+        """
+        with self._conn_lock:
+            return self._data_version()
+
+    def get(self, key: Hashable, version: int | None = None) -> (int, Any):
+        """
+        Get a cached value, clearing the cache if the database changed since the last call
+        :param key: The key, e.g. ('job_id', 19)
+        :param version: The database version from data_version, read off the event loop, e.g. with the database
+        executor, as the query waits for the database. Read here if not given
+        :return: The database version to pass to put, and the value or None if not cached
+        """
+        if version is None:
+            version = self.data_version()
+        with self._lock:
+            # A version read before a newer one already seen, e.g. by a concurrent request, is a miss
+            if self._version is not None and version < self._version:
+                self.misses += 1
+                return version, None
+            if version != self._version:
+                if self._cache:
+                    self.invalidations += 1
+                self._cache.clear()
+                self._version = version
+
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return version, entry[1]
+            self.misses += 1
+            return version, None
+
+    def put(self, key: Hashable, value: Any, version: int):
+        """
+        Cache a value read from the database after a call to get
+        :param key: The key
+        :param value: The value
+        :param version: The database version returned by get before the value was read; the value is not cached
+        if the database changed since
+        """
+        with self._lock:
+            if version != self._version:
+                return
+            self._cache[key] = (time.monotonic() + self._ttl_secs, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations}
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._lock:
+            self._cache.clear()
+            self._version = None
@@ -2,30 +2,54 @@
 # Filename: app/main.py
 # Description: Runs a FastAPI server to run video detection and tracking models locally
 
+import asyncio
+import dataclasses
 import datetime
+import email.utils
+import hashlib
+import json
 import signal
 import random
 import os
 
 from pathlib import Path
-from urllib.parse import urlparse
 
-from deepsea_ai.database.job.database_helper import get_status, json_b64_encode, json_b64_decode
 from deepsea_ai.database.job.misc import JobType, Status
-from fastapi import FastAPI, HTTPException, status, Request
+from fastapi import FastAPI, HTTPException, status, Request, Query
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from botocore.exceptions import ClientError
+from fastapi.responses import JSONResponse, StreamingResponse, Response, ORJSONResponse, RedirectResponse
+import orjson
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import text, or_
+from sqlalchemy.orm import selectinload
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.conf import temp_path, default_args, default_video_url, root_bucket, model_prefix, engine, database_path, \
-    lagoon_names, lagoon_states
+    lagoon_names, lagoon_states, model_catalog_ttl_secs, video_check, archive_path, database_max_readers, admission, \
+    num_procs, stats, results_chunk_bytes, results_presign_expires_secs, results_public_endpoint_url, status_cache
 from app import __version__
-from app.job import JobLocal, MediaLocal, init_db
-from app.logger import info, debug
+from app.catalog import ModelCatalog
+from app.job import JobLocal, MediaLocal, init_db, query_job_status, bulk_add_jobs, get_metadata, get_results, \
+    get_job_status, CANCELLED
+from app.job.cancel import CANCELLABLE_STATUSES, cancel_job, cancel_jobs
+from app.job.admission import AdmissionLimits, check_admission
+from app.job.dedup import content_key, find_duplicates
+from app.job.executor import DatabaseExecutor
+from app.job.feed import JobFeed
+from app.job.lease import Worker, get_workers
+from app.job.retention import database_stats
+from app.job.stats import StatsService
+from app.job.status_cache import StatusCache, status_key
+from app.logger import info, debug, err
+from app.metrics import MetricsMiddleware, ApiCollector, register_collector, ADMISSION_REJECTED
+from app.schemas import JobDetail, JobStatus, StatusPage, StatusBatch, ModelList, ModelStats, WorkerList
 from app import logger
-from app.utils.exceptions import NotFoundException
-from app.utils.misc import check_video_availability, list_by_suffix
+from app.utils.exceptions import NotFoundException, TooManyJobsException
+from app.utils.misc import check_video_availability, parse_s3_path, get_object, presigned_url
+from app.utils.video_checker import VideoChecker, VideoInfo
+from app.utils.wakeup import DaemonWakeup
 
 if not os.getenv('MINIO_ENDPOINT_URL') or not os.getenv('MINIO_ACCESS_KEY') or not os.getenv('MINIO_SECRET_KEY'):
     info(f"MINIO_ENDPOINT_URL, MINIO_ACCESS_KEY, and MINIO_SECRET_KEY environment variables must be set")
@@ -36,6 +60,7 @@ app = FastAPI(
                     Predicts (bounding box) localizations using YOLOv5 models, forwards to notification service, then uploads results to minio S3.""",
     version=__version__
 )
+app.add_middleware(MetricsMiddleware)
 
 
 shutdown_flag = False
@@ -48,6 +73,26 @@ if not logger.custom_logger():
 info(f'Initializing the database')
 session_maker = init_db(database_path, reset=False)
 
+# Submissions are rejected when the queue is too long for the daemon to catch up
+admission_limits = AdmissionLimits(**admission)
+
+# Database work runs in threads so lock waits caused by the daemon do not block other requests
+db_executor = DatabaseExecutor(max_readers=database_max_readers)
+
+# Repeated status polls are served from memory until the database changes
+job_status_cache = StatusCache(session_maker, **status_cache)
+
+# Processing time statistics for the model stats and the job start and completion estimates. The queue is
+# simulated once per database change for the estimates of all the queued jobs
+stats_service = StatsService(session_maker, default_processing_secs=admission_limits.default_processing_secs,
+                             data_version=job_status_cache.data_version, **stats)
+
+# The daemon is woken when jobs are submitted or cancelled instead of finding them on its next poll
+daemon_wakeup = DaemonWakeup(database_path)
+
+# Status transitions from the API and the daemon are pushed to subscribers instead of being polled by each client
+job_feed = JobFeed(session_maker)
+
 
 # Define a function to handle the SIGINT signal (Ctrl+C)
 def handle_sigint(signum, frame):
@@ -60,32 +105,36 @@ def handle_sigint(signum, frame):
 # Set up the signal handler for SIGINT
 signal.signal(signal.SIGINT, handle_sigint)
 
-global model_paths, default_model, example_video, default_args, default_video_url
+global default_model, example_video, default_args, default_video_url
 
+# Models are served from memory and refreshed in the background so requests do not list the bucket each time
+model_catalog = ModelCatalog(root_bucket, model_prefix, ['.gz', '.pt'], ttl_secs=model_catalog_ttl_secs)
 
-def fetch_models():
+
+def fetch_models() -> dict:
     """
-    Fetch the models from the minio bucket
-    :return:
+    Fetch the models from the model catalog
+    :return: dictionary of model names to model s3 paths
     """
-    global model_paths, default_model, example_video, default_video_url, default_args
-    info(f'Fetching models from s3://{root_bucket}/{model_prefix}')
-    model_s3 = list_by_suffix(root_bucket, model_prefix, ['.gz', '.pt'])
-    debug(f'Creating dictionary of model names to model paths')
-    model_paths = {Path(urlparse(m).path).stem.split('.')[0]: m for m in model_s3}
-    debug(f'Found {len(model_paths)} models')
-    # Get an example model to use for the API documentation
-    if model_paths and len(model_paths) > 0:
-        default_model = list(model_paths.keys())[0]
-    else:
-        default_model = None
+    return model_catalog.models()
 
 
+# Video availability is checked without blocking the event loop and cached per url
+video_checker = VideoChecker(ttl_secs=video_check.get('ttl_secs', 300),
+                             negative_ttl_secs=video_check.get('negative_ttl_secs', 30),
+                             max_entries=video_check.get('max_entries', 4096),
+                             timeout_secs=video_check.get('timeout_secs', 10))
+
+# Queue depth and cache counters are collected from the database and caches when /metrics is scraped
+register_collector(ApiCollector(session_maker, model_catalog, video_checker, job_status_cache))
+
 if default_video_url:
     if not check_video_availability(default_video_url):
         default_video_url = None
 
-fetch_models()
+# Get an example model to use for the API documentation
+model_catalog.refresh()
+default_model = next(iter(fetch_models()), None)
 
 
 class PredictModel(BaseModel):
@@ -93,6 +142,49 @@ class PredictModel(BaseModel):
     video: str | None = default_video_url
     metadata: dict | None = {}
     args: str | None = default_args
+    reuse: bool = True
+    idempotency_key: str | None = None
+    priority: int = 0
+
+
+class StatusBatchModel(BaseModel):
+    job_ids: list[int] = []
+    job_names: list[str] = []
+    if_none_match: list[str] = []
+
+
+# Maximum number of jobs in a status batch
+MAX_STATUS_BATCH = 1000
+
+
+# Maximum number of videos in a predict batch
+MAX_PREDICT_BATCH = 1000
+
+
+class BatchPredictModel(BaseModel):
+    videos: list[str] = Field(..., min_items=1, max_items=MAX_PREDICT_BATCH)
+    model: str | None = default_model
+    models: list[str] | None = None
+    metadata: dict | None = {}
+    args: str | None = default_args
+    reuse: bool = True
+    idempotency_key: str | None = None
+    priority: int = 0
+
+
+@app.on_event("startup")
+async def startup_event():
+    model_catalog.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    model_catalog.stop()
+    await video_checker.close()
+    await job_feed.stop()
+    db_executor.shutdown()
+    job_status_cache.close()
+    daemon_wakeup.close()
 
 
 # Exception handler for 404 errors
@@ -104,16 +196,81 @@ async def nof_found_exception(request: Request, exc: NotFoundException):
     )
 
 
-def get_job_detail(**kwargs):
+# Exception handler for submissions over an admission limit
+@app.exception_handler(TooManyJobsException)
+async def too_many_jobs_exception(request: Request, exc: TooManyJobsException):
+    ADMISSION_REJECTED.labels(exc._limit).inc()
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"message": exc._reason, "retry_after_secs": exc._retry_after_secs},
+        headers={"Retry-After": str(exc._retry_after_secs)},
+    )
+
+
+def job_etag(job_id: int, job_status: str, last_updated: str) -> str:
+    """
+    Weak ETag of the status of a job; it changes with every media update. Weak as the estimates of queued and
+    running jobs move without an update.
+    :param job_id: The job id
+    :param job_status: The status of the job
+    :param last_updated: When the media of the job was last updated
+    :return: The ETag
+    """
+    digest = hashlib.sha1(f"{job_id} {job_status} {last_updated}".encode()).hexdigest()[:16]
+    return f'W/"{job_id}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    True if an If-None-Match header matches an ETag, with the weak comparison used for If-None-Match
+    :param if_none_match: The If-None-Match header, if any
+    :param etag: The ETag
+    :return: True if the client has the current version
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+def to_job_detail(job: JobLocal, estimate: tuple) -> JobDetail:
+    """
+    Get the detailed status of a job
+    :param job: The job, with its media
+    :param estimate: The estimated start and completion of the job
+    :return: The status of the job
+    """
+    job_status = get_job_status(job)
+    last_updated = f"{job.media[0].updatedAt}"
+    # fetch the results, e.g. processing_time_secs from the media
+    results = get_results(job.media[0])
+    estimated_start, estimated_completion = estimate
+    return JobDetail(status=job_status,
+                     last_updated=last_updated,
+                     created_at=f"{job.createdAt}",
+                     name=job.name,
+                     job_id=job.id,
+                     video=job.media[0].name,
+                     args=job.args,
+                     model=job.model,
+                     metadata=get_metadata(job),
+                     processing_time_secs=results['processing_time_secs'],
+                     num_tracks=results['num_tracks'],
+                     s3_path=results['s3_path'],
+                     estimated_start=f"{estimated_start}" if estimated_start else None,
+                     estimated_completion=f"{estimated_completion}" if estimated_completion else None,
+                     etag=job_etag(job.id, job_status, last_updated))
+
+
+def get_job_detail(**kwargs) -> JobDetail:
     """
     Get more detailed status of a job
     :param kwargs: The job name or job id
     :return: The status of the job or a 404 error
     """
     job = None
-    job_status = Status.UNKNOWN
-    media_name = ''
-    metadata = {}
     with session_maker.begin() as db:
         if 'job_name' in kwargs:
             job_name = kwargs['job_name']
@@ -122,34 +279,34 @@ def get_job_detail(**kwargs):
             job_id = kwargs['job_id']
             job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
         if job:
-            job_status = get_status(job)
-            media_name = job.media[0].name
-            if job.metadata_b64:
-                metadata = json_b64_decode(job.metadata_b64)
-            else:
-                metadata = {}
-
-            # fetch other metadata, e.g. processing_time_secs from the media metadata
-            media_metadata = json_b64_decode(job.media[0].metadata_b64)
-            processing_time_secs = media_metadata.get('processing_time_secs', None)
-            num_tracks = media_metadata.get('num_tracks', None)
-            s3_path = media_metadata.get('s3_path', None)
-        if job:
-            json_response = {"status": job_status,
-                             "last_updated": f"{job.media[0].updatedAt}",
-                             "created_at": f"{job.createdAt}",
-                             "name": job.name,
-                             "job_id": job.id,
-                             "video": media_name,
-                             "args": job.args,
-                             "model": job.model,
-                             "metadata": metadata,
-                             "processing_time_secs": processing_time_secs,
-                             "num_tracks": num_tracks,
-                             "s3_path": s3_path}
-            return json_response
-        else:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {kwargs} not found")
+            return to_job_detail(job, stats_service.estimate(db, job, num_procs))
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {kwargs} not found")
+
+
+def get_job_details(job_ids: list[int], job_names: list[str]) -> dict:
+    """
+    Get the detailed status of many jobs with one query
+    :param job_ids: The job ids
+    :param job_names: The job names; the oldest job is returned if several have the same name
+    :return: Dictionary of ('job_id', id) or ('job_name', name) to the status of each job found
+    """
+    with session_maker.begin() as db:
+        jobs = db.query(JobLocal) \
+            .options(selectinload(JobLocal.media)) \
+            .filter(or_(JobLocal.id.in_(job_ids), JobLocal.name.in_(job_names))) \
+            .order_by(JobLocal.id) \
+            .all()
+        estimates = stats_service.estimates(db, jobs, num_procs)
+        details = {}
+        job_ids = set(job_ids)
+        job_names = set(job_names)
+        for job in jobs:
+            job_detail = to_job_detail(job, estimates[job.id])
+            if job.id in job_ids:
+                details[('job_id', job.id)] = job_detail
+            if job.name in job_names:
+                details.setdefault(('job_name', job.name), job_detail)
+        return details
 
 
 @app.get("/")
@@ -160,8 +317,8 @@ async def root():
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def root():
     # Check if models are available and return a 503 error if not
-    fetch_models()
-    database_online = is_database_online()
+    model_paths = fetch_models()
+    database_online = await db_executor.read(is_database_online)
 
     if len(model_paths) == 0:
         return {"message": "no models available"}, 503
@@ -172,10 +329,193 @@ async def root():
     return {"message": "OK"}
 
 
-@app.get("/models", status_code=status.HTTP_200_OK)
+@app.get("/database/stats", status_code=status.HTTP_200_OK)
+async def read_database_stats():
+    # Size of the job cache database, rows in each table and the archived jobs
+    return await db_executor.read(database_stats, session_maker, archive_path)
+
+
+def read_worker_heartbeats() -> list[Worker]:
+    with session_maker.begin() as db:
+        return get_workers(db)
+
+
+@app.get("/workers", status_code=status.HTTP_200_OK, response_model=WorkerList)
+async def read_workers():
+    # The daemon workers draining the queue, most recent heartbeat first. A worker whose heartbeat is older than
+    # its lease has stopped, and its running jobs are queued again
+    workers = await db_executor.read(read_worker_heartbeats)
+    return ORJSONResponse(WorkerList(workers=workers))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Collecting the queue depth reads the database
+    content = await db_executor.read(generate_latest)
+    return Response(content=content, headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+@app.get("/models", status_code=status.HTTP_200_OK, response_model=ModelList)
 async def read_models():
-    fetch_models()
-    return {"model": list(model_paths.keys())}
+    model_paths = fetch_models()
+    return ORJSONResponse(ModelList(model=list(model_paths.keys())))
+
+
+@app.get("/models/{model_name}/stats", status_code=status.HTTP_200_OK, response_model=ModelStats)
+async def read_model_stats(model_name: str):
+    # Processing time statistics of recent jobs for each args and hardware the model was run with
+    model_paths = fetch_models()
+    if model_name not in model_paths:
+        raise NotFoundException(name=model_name)
+    model_stats = await db_executor.read(stats_service.model_stats, model_paths[model_name])
+    return ORJSONResponse(ModelStats(model=model_name, stats=model_stats))
+
+
+@app.get("/models/catalog", status_code=status.HTTP_200_OK)
+async def read_model_catalog():
+    # Cache counters for the model catalog, e.g. how many bucket listings were avoided
+    return model_catalog.stats()
+
+
+def new_job(model_name: str, model_s3: str, video: str, metadata: dict, args: str,
+            key: str | None = None,
+            idempotency_key: str | None = None,
+            duplicate_of: int | None = None,
+            media_status: str = Status.QUEUED,
+            size_bytes: int | None = None,
+            priority: int = 0) -> (dict, dict):
+    """
+    Create the column values for a queued job to process a video with a model
+    :param model_name: The name of the model
+    :param model_s3: The s3 path of the model
+    :param video: The url of the video
+    :param metadata: The metadata to pass through to the notification
+    :param args: The arguments to pass to the model
+    :param key: The content key of the video, model and args
+    :param idempotency_key: The client supplied idempotency key
+    :param duplicate_of: The id of the identical job this job is attached to
+    :param media_status: The status of the video
+    :param size_bytes: The size of the video, if known
+    :param priority: Higher priority jobs run first with the priority scheduling policy
+    :return: The job and media column values
+    """
+    # Create a name for the job based on the video prefix, model name and lagoon fun to honor Duane and his lagoons
+    video_name = video.split('=')[-1]
+    # random number in the range of the lagoons
+    index_name = random.randint(0, len(lagoon_names) - 1)
+    index_state = random.randint(0, len(lagoon_states) - 1)
+
+    job_name = f"{model_name} {Path(video_name).stem} {lagoon_names[index_name]} {lagoon_states[index_state]}"
+
+    job = dict(name=job_name,
+               metadata_json=metadata,
+               args=args,
+               engine=engine,  # this is the name of the docker container
+               model=model_s3,
+               job_type=JobType.DOCKER,
+               content_key=key,
+               idempotency_key=idempotency_key,
+               duplicate_of=duplicate_of,
+               priority=priority)
+
+    media = dict(name=video,
+                 status=media_status,
+                 size_bytes=size_bytes,
+                 updatedAt=datetime.datetime.utcnow())
+    return job, media
+
+
+def queue_jobs(db, submissions: list[(str, VideoInfo)], model_paths: dict, metadata: dict, args: str,
+               reuse: bool = True, idempotency_key: str | None = None, priority: int = 0) -> list[dict]:
+    """
+    Queue a job for each model and video. Identical submissions reuse the results of a completed job, or are
+    attached to an identical job that is queued or running and notified when it completes.
+    :param db: The database session
+    :param submissions: The model name and video for each job
+    :param model_paths: Dictionary of model names to model s3 paths
+    :param metadata: The metadata to pass through to the notification
+    :param args: The arguments to pass to the model
+    :param reuse: Whether to reuse the results of identical submissions
+    :param idempotency_key: The client supplied idempotency key
+    :param priority: The priority of the jobs
+    :return: The job for each submission
+    :raises TooManyJobsException: If the jobs would exceed an admission limit
+    """
+    keys = [content_key(v.url, v.etag, v.content_length, model_paths[model_name], args)
+            for model_name, v in submissions]
+    duplicates = find_duplicates(db, keys) if reuse else {}
+
+    results = [None] * len(submissions)
+    jobs, media, queued = [], [], []
+    for i, ((model_name, video_info), key) in enumerate(zip(submissions, keys)):
+        duplicate = duplicates.get(key)
+        if duplicate and duplicate.status == Status.SUCCESS:
+            results[i] = {"job_id": duplicate.job_id,
+                          "job_name": duplicate.job_name,
+                          "video": video_info.url,
+                          "status": duplicate.status,
+                          "s3_path": duplicate.s3_path,
+                          "num_tracks": duplicate.num_tracks,
+                          "reused": True}
+            continue
+        job, m = new_job(model_name, model_paths[model_name], video_info.url, metadata, args,
+                         key=key,
+                         idempotency_key=idempotency_key,
+                         duplicate_of=duplicate.job_id if duplicate else None,
+                         media_status=duplicate.status if duplicate else Status.QUEUED,
+                         size_bytes=video_info.content_length,
+                         priority=priority)
+        jobs.append(job)
+        media.append(m)
+        queued.append(i)
+
+    # Reject all the jobs if the new ones would exceed a queue limit
+    check_admission(db, admission_limits, jobs)
+    job_ids = bulk_add_jobs(db, jobs, media)
+    for i, job_id, job, m in zip(queued, job_ids, jobs, media):
+        results[i] = {"job_id": job_id,
+                      "job_name": job['name'],
+                      "video": m['name'],
+                      "duplicate_of": job['duplicate_of']}
+    return results
+
+
+def submit_jobs(submissions: list[(str, VideoInfo)], model_paths: dict, metadata: dict, args: str,
+                reuse: bool = True, idempotency_key: str | None = None,
+                priority: int = 0) -> (list[dict], list[dict]):
+    """
+    Queue the jobs in a single transaction, unless they were already submitted with the idempotency key.
+    Run with db_executor.write so duplicate detection and the insert are not interleaved with another submission.
+    :param submissions: The model name and video for each job
+    :param model_paths: Dictionary of model names to model s3 paths
+    :param metadata: The metadata to pass through to the notification
+    :param args: The arguments to pass to the model
+    :param reuse: Whether to reuse the results of identical submissions
+    :param idempotency_key: The client supplied idempotency key
+    :param priority: The priority of the jobs
+    :return: The jobs already submitted with the idempotency key, and the queued jobs
+    """
+    with session_maker.begin() as db:
+        submitted = find_idempotent(db, idempotency_key)
+        if submitted:
+            return submitted, []
+        return [], queue_jobs(db, submissions, model_paths, metadata, args,
+                              reuse=reuse,
+                              idempotency_key=idempotency_key,
+                              priority=priority)
+
+
+def find_idempotent(db, idempotency_key: str | None) -> list[dict]:
+    """
+    Find the jobs already submitted with an idempotency key
+    :param db: The database session
+    :param idempotency_key: The client supplied idempotency key
+    :return: The jobs submitted with the key, if any
+    """
+    if not idempotency_key:
+        return []
+    jobs = db.query(JobLocal).filter(JobLocal.idempotency_key == idempotency_key).order_by(JobLocal.id).all()
+    return [{"job_id": job.id, "job_name": job.name, "video": job.media[0].name} for job in jobs]
 
 
 @app.post("/predict", status_code=status.HTTP_200_OK)
@@ -185,73 +525,426 @@ async def process_video(item: PredictModel):
     model_name = data['model']
     metadata = data['metadata']
     args = data['args']
-    fetch_models()
+    model_paths = fetch_models()
 
-    # If the video cannot be reached return a 400 error
-    if not check_video_availability(video):
+    # If the video cannot be reached return a 404 error
+    video_info = await video_checker.check(video)
+    if not video_info.available:
         raise NotFoundException(name=video)
 
     # If the model does not exist, return a 404 error
     if model_name not in model_paths.keys():
         raise NotFoundException(name=model_name)
 
-    # Create a name for the job based on the video prefix, model name and lagoon fun to honor Duane and his lagoons
-    video_name = video.split('=')[-1]
-    # random number in the range of the lagoons
-    index_name = random.randint(0, len(lagoon_names) - 1)
-    index_state = random.randint(0, len(lagoon_states) - 1)
+    # Add the job to the cache, unless it was already submitted or processed
+    submitted, results = await db_executor.write(submit_jobs, [(model_name, video_info)], model_paths, metadata,
+                                                 args, reuse=data['reuse'], idempotency_key=data['idempotency_key'],
+                                                 priority=data['priority'])
+    if submitted:
+        return {"message": f"{video} already submitted",
+                "job_id": submitted[0]['job_id'],
+                "job_name": submitted[0]['job_name']}
 
-    job_name = f"{model_name} {Path(video_name).stem} {lagoon_names[index_name]} {lagoon_states[index_state]}"
+    result, = results
 
-    # Add the job to the cache
-    with session_maker.begin() as db:
-        job = JobLocal(name=job_name,
-                       metadata_b64=json_b64_encode(metadata),
-                       args=args,
-                       engine=engine,  # this is the name of the docker container
-                       model=model_paths[model_name],
-                       job_type=JobType.DOCKER)
-
-        media = MediaLocal(name=video,
-                           status=Status.QUEUED,
-                           metadata_b64=json_b64_encode({}),
-                           updatedAt=datetime.datetime.utcnow())
-        job.media.append(media)
-        db.add(job)
+    if result.get('reused'):
+        return {"message": f"{video} already processed", **result}
 
-    with session_maker.begin() as db:
-        job = db.query(JobLocal).filter(JobLocal.name == job_name).first()
-        job_id = job.id
-        job_name = job.name
+    daemon_wakeup.notify()
+
+    response = {"message": f"{video} queued for processing",
+                "job_id": result['job_id'],
+                "job_name": result['job_name']}
+    if result['duplicate_of']:
+        response['duplicate_of'] = result['duplicate_of']
+    return response
+
+
+@app.post("/predict/batch", status_code=status.HTTP_200_OK)
+async def process_videos(item: BatchPredictModel):
+    data = jsonable_encoder(item)
+    videos = list(dict.fromkeys(data['videos']))
+    model_names = data['models'] or [data['model']]
+    metadata = data['metadata']
+    args = data['args']
+    model_paths = fetch_models()
+
+    # If any model does not exist, return a 404 error
+    for model_name in model_names:
+        if model_name not in model_paths.keys():
+            raise NotFoundException(name=model_name)
+
+    # Check the videos concurrently; any that cannot be reached are rejected
+    video_infos = await asyncio.gather(*[video_checker.check(video) for video in videos])
+    available = [v for v in video_infos if v.available]
+    rejected = [v.url for v in video_infos if not v.available]
+    if not available:
+        raise NotFoundException(name=', '.join(rejected))
+
+    # Add all the jobs to the cache in a single transaction, unless they were already submitted
+    submitted, jobs = await db_executor.write(submit_jobs,
+                                              [(model_name, v) for v in available for model_name in model_names],
+                                              model_paths, metadata, args,
+                                              reuse=data['reuse'],
+                                              idempotency_key=data['idempotency_key'],
+                                              priority=data['priority'])
+    if submitted:
+        return {"message": f"{len(submitted)} jobs already submitted",
+                "jobs": submitted,
+                "rejected": rejected}
+
+    num_reused = sum(1 for job in jobs if job.get('reused'))
+    if num_reused < len(jobs):
+        daemon_wakeup.notify()
+    return {"message": f"{len(jobs) - num_reused} jobs queued for processing, {num_reused} reused",
+            "jobs": jobs,
+            "rejected": rejected}
+
+
+async def read_job_detail(**kwargs) -> JobDetail:
+    """
+    Get the detailed status of a job from the status cache, or from the database if not cached
+    :param kwargs: The job name or job id
+    :return: The status of the job or a 404 error
+    """
+    (kind, value), = kwargs.items()
+    key = status_key(kind, value)
+    version, job_detail = job_status_cache.get(key, await db_executor.read(job_status_cache.data_version))
+    if job_detail is None:
+        job_detail = await db_executor.read(get_job_detail, **kwargs)
+        job_status_cache.put(key, job_detail, version)
+    return job_detail
 
-        return {"message": f"{video} queued for processing",
-                "job_id": job_id,
-                "job_name": job_name}
 
+async def wait_for_job_detail(wait: float, if_none_match: str | None = None, **kwargs) -> JobDetail:
+    """
+    Get the detailed status of a job, waiting up to wait seconds for its status to change
+    :param wait: The maximum number of seconds to wait
+    :param if_none_match: The If-None-Match header; if the client has an older version it is not kept waiting
+    :param kwargs: The job name or job id
+    :return: The status of the job or a 404 error
+    """
+    job_detail = await read_job_detail(**kwargs)
+    if not wait or job_detail.status in (Status.SUCCESS, Status.FAILED, CANCELLED):
+        return job_detail
+    if if_none_match and not etag_matches(if_none_match, job_detail.etag):
+        return job_detail
+
+    last_status = job_detail.status
+    deadline = asyncio.get_running_loop().time() + wait
+    async with job_feed.listen([job_detail.job_id]) as subscription:
+        # Read again in case the status changed before subscribing
+        job_detail = await read_job_detail(job_id=job_detail.job_id)
+        while job_detail.status == last_status:
+            remaining = deadline - asyncio.get_running_loop().time()
+            event = await subscription.get(timeout=remaining) if remaining > 0 else None
+            if event is None:
+                break
+            if event['status'] != last_status:
+                job_detail = await read_job_detail(job_id=job_detail.job_id)
+    return job_detail
+
+
+def job_detail_response(job_detail: JobDetail, request: Request) -> Response:
+    """
+    Respond with the status of a job, or 304 if the If-None-Match header of the request has its ETag
+    :param job_detail: The status of the job
+    :param request: The request
+    :return: The response
+    """
+    headers = {"ETag": job_detail.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), job_detail.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return ORJSONResponse(job_detail, headers=headers)
+
+
+@app.get("/status_by_id/{job_id}", response_model=JobDetail)
+async def get_status_by_id(job_id: int, request: Request,
+                           wait: float = Query(0, ge=0, le=300, description="Seconds to wait for a change")):
+    job_detail = await wait_for_job_detail(wait, request.headers.get('if-none-match'), job_id=job_id)
+    return job_detail_response(job_detail, request)
+
+
+@app.get("/status_by_name/{job_name}", response_model=JobDetail)
+async def get_status_by_name(job_name: str, request: Request,
+                             wait: float = Query(0, ge=0, le=300, description="Seconds to wait for a change")):
+    job_detail = await wait_for_job_detail(wait, request.headers.get('if-none-match'), job_name=job_name)
+    return job_detail_response(job_detail, request)
+
+
+@app.post("/status/batch", response_model=StatusBatch)
+async def get_status_batch(item: StatusBatchModel, request: Request):
+    # The status of many jobs in one request; cached jobs are served from memory and the rest read with one query
+    keys = list(dict.fromkeys([status_key('job_id', job_id) for job_id in item.job_ids] +
+                              [status_key('job_name', job_name) for job_name in item.job_names]))
+    if len(keys) > MAX_STATUS_BATCH:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"At most {MAX_STATUS_BATCH} jobs can be requested at a time")
+
+    details = {}
+    version = await db_executor.read(job_status_cache.data_version)
+    for key in keys:
+        _, job_detail = job_status_cache.get(key, version)
+        if job_detail is not None:
+            details[key] = job_detail
+    missing = [key for key in keys if key not in details]
+    if missing:
+        found = await db_executor.read(get_job_details,
+                                       [value for kind, value in missing if kind == 'job_id'],
+                                       [value for kind, value in missing if kind == 'job_name'])
+        for key, job_detail in found.items():
+            job_status_cache.put(key, job_detail, version)
+        details.update(found)
+
+    if_none_match = set(item.if_none_match)
+    batch = StatusBatch(jobs=[])
+    for (kind, value) in keys:
+        job_detail = details.get((kind, value))
+        if job_detail is None:
+            (batch.not_found_ids if kind == 'job_id' else batch.not_found_names).append(value)
+        elif job_detail.etag in if_none_match:
+            batch.not_modified.append(job_detail.job_id)
+        else:
+            batch.jobs.append(job_detail)
 
-@app.get("/status_by_id/{job_id}")
-async def get_status_by_id(job_id: int):
-    return get_job_detail(job_id=job_id)
+    # The batch ETag changes when any job changes, so an unchanged batch is a 304
+    digest = hashlib.sha1(orjson.dumps([[details[key].etag if key in details else None for key in keys],
+                                        sorted(if_none_match)])).hexdigest()
+    etag = f'W/"{digest[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return ORJSONResponse(batch, headers=headers)
 
 
-@app.get("/status_by_name/{job_name}")
-async def get_status_by_name(job_name: str):
-    return get_job_detail(job_name=job_name)
+def get_results_path(job_id: int) -> str:
+    """
+    Get the s3 path of the track results of a job
+    :param job_id: The job id
+    :return: The s3 path, or a 404 error if the job does not exist or a 409 error if it has no results
+    """
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
+        if not job:
+            raise NotFoundException(name=f"Job {job_id}")
+        s3_path = get_results(job.media[0])['s3_path']
+        if job.status != Status.SUCCESS or not s3_path:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"Job {job_id} has no results, its status is {job.status}")
+        return s3_path
 
 
-@app.get("/status")
-async def get_status_all():
-    # Get status for all DOCKER jobs
+def results_conditions(request: Request) -> dict:
+    """
+    Get the S3 arguments for the range and conditional headers of a request
+    :param request: The request
+    :return: The Range, IfMatch, IfNoneMatch, IfModifiedSince and IfUnmodifiedSince arguments in the request
+    """
+    headers = request.headers
+    conditions = {}
+    # S3 serves a single range and has no If-Range, so multiple ranges or an If-Range get the whole object
+    if 'range' in headers and ',' not in headers['range'] and 'if-range' not in headers:
+        conditions['Range'] = headers['range']
+    for header, argument in (('if-match', 'IfMatch'), ('if-none-match', 'IfNoneMatch')):
+        if header in headers:
+            conditions[argument] = headers[header]
+    for header, argument in (('if-modified-since', 'IfModifiedSince'), ('if-unmodified-since', 'IfUnmodifiedSince')):
+        if header in headers:
+            try:
+                conditions[argument] = email.utils.parsedate_to_datetime(headers[header])
+            except (TypeError, ValueError):
+                pass  # Invalid dates are ignored
+    return conditions
+
+
+def iter_body(body, chunk_bytes: int):
+    """
+    Stream an S3 object body in chunks, closing the connection to minio when done or when the client disconnects
+    """
+    try:
+        yield from body.iter_chunks(chunk_bytes)
+    finally:
+        body.close()
+
+
+@app.api_route("/jobs/{job_id}/results", methods=["GET", "HEAD"])
+async def get_job_results(job_id: int, request: Request,
+                          redirect: bool = Query(False, description="Redirect to a presigned minio url")):
+    # Stream the track results of a completed job from minio, with support for range and conditional requests
+    s3_path = await db_executor.read(get_results_path, job_id)
+    bucket, key = parse_s3_path(s3_path)
+
+    if redirect:
+        url = presigned_url(bucket, key, results_presign_expires_secs, results_public_endpoint_url)
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    head = request.method == "HEAD"
+    try:
+        obj = await asyncio.to_thread(get_object, bucket, key, head=head, **results_conditions(request))
+    except ClientError as e:
+        status_code = e.response['ResponseMetadata']['HTTPStatusCode']
+        if status_code == status.HTTP_304_NOT_MODIFIED:
+            etag = e.response['ResponseMetadata']['HTTPHeaders'].get('etag')
+            return Response(status_code=status_code, headers={"ETag": etag} if etag else None)
+        if status_code == status.HTTP_412_PRECONDITION_FAILED:
+            return Response(status_code=status_code)
+        if status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE:
+            size = e.response['Error'].get('ActualObjectSize')
+            return Response(status_code=status_code, headers={"Content-Range": f"bytes */{size}"} if size else None)
+        if status_code == status.HTTP_404_NOT_FOUND:
+            raise NotFoundException(name=s3_path)
+        raise
+
+    last_modified = obj['LastModified'].astimezone(datetime.timezone.utc)
+    headers = {"Accept-Ranges": "bytes",
+               "Content-Length": str(obj['ContentLength']),
+               "ETag": obj['ETag'],
+               "Last-Modified": email.utils.format_datetime(last_modified, usegmt=True),
+               "Content-Disposition": f'attachment; filename="{Path(key).name}"'}
+    if obj.get('ContentRange'):
+        headers["Content-Range"] = obj['ContentRange']
+    status_code = status.HTTP_206_PARTIAL_CONTENT if obj.get('ContentRange') else status.HTTP_200_OK
+    media_type = obj.get('ContentType') or 'application/gzip'
+    if head:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(iter_body(obj['Body'], results_chunk_bytes), status_code=status_code, headers=headers,
+                             media_type=media_type)
+
+
+def cancel_job_by_id(job_id: int) -> dict:
+    """
+    Cancel a queued or running job
+    :param job_id: The job id
+    :return: The cancellation, or a 404 error if the job does not exist or a 409 error if it has finished
+    """
     with session_maker.begin() as db:
-        jobs = db.query(JobLocal).filter(JobLocal.job_type == JobType.DOCKER).all()
-        return {"jobs": [{"id": job.id, "name": job.name, "status": get_status(job)} for job in jobs]}
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
+        if not job:
+            raise NotFoundException(name=f"Job {job_id}")
+        if job.status not in CANCELLABLE_STATUSES:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail=f"Job {job_id} cannot be cancelled, its status is {job.status}")
+        return dataclasses.asdict(cancel_job(db, job))
+
+
+def cancel_jobs_by_filter(max_jobs: int, job_ids: list[int] | None, **filters) -> list[dict]:
+    """
+    Cancel the queued and running jobs that match the filters
+    :param max_jobs: Maximum number of jobs to cancel
+    :param job_ids: Only cancel these jobs, if any
+    :param filters: The filters to pass to query_job_status
+    :return: The cancellations
+    """
+    with session_maker.begin() as db:
+        query = query_job_status(db, **filters)
+        if job_ids:
+            query = query.filter(JobLocal.id.in_(job_ids))
+        return [dataclasses.asdict(c) for c in cancel_jobs(db, query, max_jobs)]
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: int):
+    # Cancel a job; the daemon stops the container of a running job and frees its process on its next check
+    cancellation = await db_executor.write(cancel_job_by_id, job_id)
+    daemon_wakeup.notify()
+    return {"message": f"Job {job_id} cancelled", **cancellation}
+
+
+@app.delete("/jobs")
+async def delete_jobs(job_id: list[int] | None = Query(None),
+                      job_status: str | None = Query(None, alias="status"),
+                      model: str | None = None,
+                      created_after: datetime.datetime | None = None,
+                      created_before: datetime.datetime | None = None,
+                      limit: int = Query(10000, ge=1, le=10000)):
+    # Cancel the queued and running jobs that match all the filters; at least one filter is required
+    if job_status and job_status not in CANCELLABLE_STATUSES:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Only {' and '.join(CANCELLABLE_STATUSES)} jobs can be cancelled")
+    if not (job_id or job_status or model or created_after or created_before):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Set job_id, status, model, created_after or created_before to select the jobs")
+
+    # Models can be filtered by name or by s3 path
+    if model:
+        model = fetch_models().get(model, model)
+
+    cancellations = await db_executor.write(cancel_jobs_by_filter, limit, job_id,
+                                            status=job_status,
+                                            model=model,
+                                            created_after=created_after,
+                                            created_before=created_before)
+    if cancellations:
+        daemon_wakeup.notify()
+    return {"message": f"{len(cancellations)} jobs cancelled", "jobs": cancellations}
+
+
+@app.get("/status/events")
+async def stream_status_events(request: Request, job_id: list[int] | None = Query(None)):
+    # Server-sent events for the status transitions of the given jobs, or all jobs
+    async def events():
+        async with job_feed.listen(job_id) as subscription:
+            yield ': connected\n\n'
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"id: {event['id']}\nevent: status\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def get_status_page(limit: int, **filters) -> StatusPage:
+    """
+    Get a page of job status, e.g. {"jobs": [{"id": 1, "name": "...", "status": "QUEUED"}], "next_cursor": 1}
+    :param limit: The maximum number of jobs in the page
+    :param filters: The filters to pass to query_job_status
+    :return: The page, with the cursor for the next page or None on the last page
+    """
+    with session_maker.begin() as db:
+        # Fetch one extra row to know if there is another page
+        jobs = [JobStatus(job_id, job_name, job_status)
+                for job_id, job_name, job_status in query_job_status(db, limit=limit + 1, **filters)]
+    if len(jobs) > limit:
+        return StatusPage(jobs=jobs[:limit], next_cursor=jobs[limit - 1].id)
+    return StatusPage(jobs=jobs)
+
+
+@app.get("/status", response_model=StatusPage)
+async def get_status_all(cursor: int | None = Query(None, description="next_cursor from the previous page"),
+                         limit: int = Query(100, ge=1, le=1000),
+                         job_status: str | None = Query(None, alias="status"),
+                         model: str | None = None,
+                         created_after: datetime.datetime | None = None,
+                         created_before: datetime.datetime | None = None):
+    # Get a page of status for the DOCKER jobs
+    if job_status and job_status not in (Status.QUEUED, Status.RUNNING, Status.FAILED, Status.SUCCESS, Status.UNKNOWN,
+                                         CANCELLED):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid status {job_status}")
+
+    # Models can be filtered by name or by s3 path
+    if model:
+        model = fetch_models().get(model, model)
+
+    page = await db_executor.read(get_status_page, limit,
+                                  after_id=cursor,
+                                  status=job_status,
+                                  model=model,
+                                  created_after=created_after,
+                                  created_before=created_before)
+    return ORJSONResponse(page)
 
 
 def is_database_online():
     """
-    True if we can get a session to the database
+    True if the database answers a query
     :return:
     """
-    with session_maker.begin() as db:
+    try:
+        with session_maker.begin() as db:
+            db.execute(text('SELECT 1'))
         return True
-    return False
+    except Exception as e:
+        err(f'Database is not online: {e}')
+        return False
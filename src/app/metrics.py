@@ -0,0 +1,123 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: app/metrics.py
+# Description: Prometheus metrics for the API
+
+import time
+from pathlib import Path
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from sqlalchemy.orm import sessionmaker
+
+from app.job import count_jobs_by_status
+from app.logger import exception
+
+REQUEST_LATENCY = Histogram('localtrack_api_request_duration_seconds',
+                            'Time to handle a request, by route template',
+                            ['method', 'route', 'status'])
+
+S3_CALLS = Counter('localtrack_s3_calls_total', 'Number of S3 API calls', ['operation'])
+
+ADMISSION_REJECTED = Counter('localtrack_admission_rejected_total', 'Number of submissions rejected by an admission limit',
+                             ['limit'])
+
+DB_SECONDS = Histogram('localtrack_api_database_seconds',
+                       'Time for database work off the event loop, including the wait for a thread', ['operation'])
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        """
+        ASGI middleware that records the latency of each request by route template, e.g. /status_by_id/{job_id}
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(scope['method'],
+                                   route.path if route else 'unmatched',
+                                   status_code).observe(time.perf_counter() - start)
+
+
+class ApiCollector:
+
+    def __init__(self, session_maker: sessionmaker, model_catalog, video_checker, status_cache=None):
+        """
+        Collect the queue depth and cache counters when the metrics are scraped
+        :param session_maker: The database sessionmaker
+        :param model_catalog: The model catalog
+        :param video_checker: The video availability checker
+        :param status_cache: The job status cache, if any
+        """
+        self._session_maker = session_maker
+        self._model_catalog = model_catalog
+        self._video_checker = video_checker
+        self._status_cache = status_cache
+
+    def collect(self):
+        jobs = GaugeMetricFamily('localtrack_jobs', 'Number of jobs by status', labels=['status'])
+        try:
+            with self._session_maker.begin() as db:
+                for status, count in count_jobs_by_status(db).items():
+                    jobs.add_metric([status], count)
+        except Exception as e:
+            exception(f'Error collecting job metrics: {e}')
+        yield jobs
+
+        db_file = Path(self._session_maker.kw['bind'].url.database)
+        if db_file.exists():
+            yield GaugeMetricFamily('localtrack_database_bytes', 'Size of the job cache database file',
+                                    value=db_file.stat().st_size)
+
+        stats = self._model_catalog.stats()
+        yield GaugeMetricFamily('localtrack_models', 'Number of models in the catalog', value=stats['num_models'])
+        for name in ('hits', 'misses', 'refreshes', 'changes', 'errors'):
+            yield CounterMetricFamily(f'localtrack_model_catalog_{name}', f'Model catalog {name}', value=stats[name])
+        if stats['age_secs'] is not None:
+            yield GaugeMetricFamily('localtrack_model_catalog_age_seconds', 'Seconds since the catalog was refreshed',
+                                    value=stats['age_secs'])
+
+        yield CounterMetricFamily('localtrack_video_check_hits', 'Video checks served from the cache',
+                                  value=self._video_checker.hits)
+        yield CounterMetricFamily('localtrack_video_check_misses', 'Video checks sent to the video host',
+                                  value=self._video_checker.misses)
+
+        if self._status_cache is not None:
+            stats = self._status_cache.stats()
+            yield GaugeMetricFamily('localtrack_status_cache_entries', 'Number of job status in the cache',
+                                    value=stats['entries'])
+            for name in ('hits', 'misses', 'invalidations'):
+                yield CounterMetricFamily(f'localtrack_status_cache_{name}', f'Job status cache {name}',
+                                          value=stats[name])
+
+
+# The collector registered in each registry, so it can be replaced
+_registered = {}
+
+
+def register_collector(collector, registry: CollectorRegistry = REGISTRY):
+    """
+    Register a collector, replacing the collector previously registered with this function, e.g. on reload
+    """
+    previous = _registered.pop(registry, None)
+    if previous is not None:
+        registry.unregister(previous)
+    registry.register(collector)
+    _registered[registry] = collector
@@ -0,0 +1,68 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: app/schemas.py
+# Description: Response schemas. Endpoints return them in an ORJSONResponse, which encodes the dataclasses directly;
+# the response_model of the endpoint only documents the schema as FastAPI skips encoding returned responses
+
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.job.lease import Worker
+from app.job.stats import ProcessingStats
+
+
+@dataclass
+class JobDetail:
+    status: str
+    last_updated: str
+    created_at: str
+    name: str
+    job_id: int
+    video: str
+    args: Optional[str]
+    model: str
+    metadata: dict = field(default_factory=dict)
+    processing_time_secs: Optional[float] = None
+    num_tracks: Optional[int] = None
+    s3_path: Optional[str] = None
+    estimated_start: Optional[str] = None
+    estimated_completion: Optional[str] = None
+    # The queue order the estimates assume; the daemon may start jobs in another order with other scheduling policies
+    estimate_order: str = 'fifo'
+    etag: Optional[str] = None  # Changes with the status and results; the ETag of the single job responses
+
+
+@dataclass
+class JobStatus:
+    id: int
+    name: str
+    status: str
+
+
+@dataclass
+class StatusPage:
+    jobs: List[JobStatus]
+    next_cursor: Optional[int] = None
+
+
+@dataclass
+class StatusBatch:
+    jobs: List[JobDetail]
+    not_modified: List[int] = field(default_factory=list)  # Jobs left out as their etag was in if_none_match
+    not_found_ids: List[int] = field(default_factory=list)
+    not_found_names: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ModelList:
+    model: List[str]
+
+
+@dataclass
+class ModelStats:
+    model: str
+    stats: List[ProcessingStats]
+
+
+@dataclass
+class WorkerList:
+    workers: List[Worker]
@@ -5,3 +5,10 @@ class NotFoundException(Exception):
 class InvalidException(Exception):
     def __init__(self, name: str):
         self._name = name
+
+
+class TooManyJobsException(Exception):
+    def __init__(self, limit: str, reason: str, retry_after_secs: int):
+        self._limit = limit
+        self._reason = reason
+        self._retry_after_secs = retry_after_secs
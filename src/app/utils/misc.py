@@ -2,6 +2,7 @@
 # Filename: app/conf/init.py
 # Description: Miscellaneous utility functions
 
+import functools
 import os
 
 import boto3
@@ -9,37 +10,50 @@ import pathlib
 import requests
 
 from app.logger import info, debug, err, exception
+from app.metrics import S3_CALLS
 from app import logger
 
 
-def list_by_suffix(bucket: str, prefix: str, suffixes: list[str]) -> list[str]:
+@functools.lru_cache(maxsize=None)
+def s3_client(endpoint_url: str | None = None):
     """
-    Fetch all the objects in the bucket with the given prefix and save them to the local path
-    :param bucket: the bucket to fetch from
-    :param prefix: the prefix to fetch
-    :param suffixes: the suffixes to fetch, e.g. ['tar.gz', 'pt']
-    :return: list of objects with the given suffixes, s3://bucket/prefix/object.suffix
+    Get the S3 client for the minio server. The client is created once and shared as boto3 clients are thread safe
+    :param endpoint_url: the minio url, if not MINIO_ENDPOINT_URL, e.g. the url clients use for presigned urls
+    :return: boto3 S3 client
     """
-    s3 = boto3.client(
+    return boto3.client(
         's3',
-        endpoint_url=os.environ['MINIO_ENDPOINT_URL'],
+        endpoint_url=endpoint_url or os.environ['MINIO_ENDPOINT_URL'],
         aws_access_key_id=os.environ['MINIO_ACCESS_KEY'],
         aws_secret_access_key=os.environ['MINIO_SECRET_KEY'],
         region_name='us-west-2',
         config=boto3.session.Config(signature_version='s3v4')
     )
+
+
+def list_objects(bucket: str, prefix: str, suffixes: list[str]) -> list[dict]:
+    """
+    Fetch all the objects in the bucket with the given prefix, following pagination past 1000 keys
+    :param bucket: the bucket to fetch from
+    :param prefix: the prefix to fetch
+    :param suffixes: the suffixes to fetch, e.g. ['tar.gz', 'pt']
+    :return: list of S3 object summaries (Key, ETag, Size, LastModified) with the given suffixes
+    """
     objects = []
 
     try:
         debug(f'Listing objects in s3://{bucket}/{prefix}')
-        response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        if 'Contents' in response:
-            info(f'Found {len(response["Contents"])} objects in s3://{bucket}/{prefix}')
-            for obj in response['Contents']:
-                for s in suffixes:
-                    if pathlib.Path(obj['Key']).suffix == s:
-                        debug(f'Found {obj["Key"]} in s3://{bucket}')
-                        objects.append(f"s3://{bucket}/{obj['Key']}")
+        paginator = s3_client().get_paginator('list_objects_v2')
+        num_objects = 0
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            S3_CALLS.labels('list_objects_v2').inc()
+            for obj in page.get('Contents', []):
+                num_objects += 1
+                if pathlib.Path(obj['Key']).suffix in suffixes:
+                    debug(f'Found {obj["Key"]} in s3://{bucket}')
+                    objects.append(obj)
+        if num_objects > 0:
+            info(f'Found {num_objects} objects in s3://{bucket}/{prefix}')
         else:
             info(f'Bucket {bucket} is empty')
     except Exception as e:
@@ -49,6 +63,56 @@ def list_by_suffix(bucket: str, prefix: str, suffixes: list[str]) -> list[str]:
     return objects
 
 
+def parse_s3_path(s3_path: str) -> (str, str):
+    """
+    Split an s3 path into the bucket and key
+    :param s3_path: the s3 path, e.g. s3://localtrack/tracks/video.tracks.tar.gz
+    :return: the bucket and key, e.g. localtrack, tracks/video.tracks.tar.gz
+    """
+    bucket, _, key = s3_path.removeprefix('s3://').partition('/')
+    return bucket, key
+
+
+def get_object(bucket: str, key: str, head: bool = False, **conditions) -> dict:
+    """
+    Get an object, or only its headers. Conditions that do not hold raise a botocore ClientError with the
+    http status, e.g. 304 for IfNoneMatch or 416 for an unsatisfiable Range.
+    :param bucket: the bucket of the object
+    :param key: the key of the object
+    :param head: True to get only the headers
+    :param conditions: the Range, IfMatch, IfNoneMatch, IfModifiedSince and IfUnmodifiedSince arguments, if any
+    :return: the S3 response with a streaming Body unless head is True
+    """
+    operation = 'head_object' if head else 'get_object'
+    S3_CALLS.labels(operation).inc()
+    return getattr(s3_client(), operation)(Bucket=bucket, Key=key, **conditions)
+
+
+def presigned_url(bucket: str, key: str, expires_secs: int, endpoint_url: str | None = None) -> str:
+    """
+    Get a url to download an object without credentials
+    :param bucket: the bucket of the object
+    :param key: the key of the object
+    :param expires_secs: how long the url is valid
+    :param endpoint_url: the minio url the client can reach, if not MINIO_ENDPOINT_URL
+    :return: the presigned url
+    """
+    return s3_client(endpoint_url).generate_presigned_url('get_object',
+                                                          Params={'Bucket': bucket, 'Key': key},
+                                                          ExpiresIn=expires_secs)
+
+
+def list_by_suffix(bucket: str, prefix: str, suffixes: list[str]) -> list[str]:
+    """
+    Fetch all the objects in the bucket with the given prefix
+    :param bucket: the bucket to fetch from
+    :param prefix: the prefix to fetch
+    :param suffixes: the suffixes to fetch, e.g. ['tar.gz', 'pt']
+    :return: list of objects with the given suffixes, s3://bucket/prefix/object.suffix
+    """
+    return [f"s3://{bucket}/{obj['Key']}" for obj in list_objects(bucket, prefix, suffixes)]
+
+
 def check_video_availability(video_url):
     """
     Check if a video is available at a url
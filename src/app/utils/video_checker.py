@@ -0,0 +1,144 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: app/utils/video_checker.py
+# Description: Non-blocking video availability check with a bounded per-url result cache
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import httpx
+
+from app.logger import info, debug
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    url: str
+    available: bool
+    status_code: int | None = None
+    content_length: int | None = None
+    etag: str | None = None
+
+
+class VideoChecker:
+
+    def __init__(self,
+                 ttl_secs: float = 300,
+                 negative_ttl_secs: float = 30,
+                 max_entries: int = 4096,
+                 timeout_secs: float = 10,
+                 max_connections: int = 20,
+                 transport: httpx.AsyncBaseTransport = None):
+        """
+        Check if videos are available with a HEAD request on a pooled http client. Results are cached per url,
+        including unavailable results which are kept for a shorter time
+        :param ttl_secs: how long an available result is cached
+        :param negative_ttl_secs: how long an unavailable result is cached
+        :param max_entries: maximum number of urls to cache; the least recently used are evicted first
+        :param timeout_secs: timeout for the HEAD request
+        :param max_connections: maximum number of pooled connections
+        :param transport: optional httpx transport, e.g. for testing
+        """
+        self._ttl_secs = ttl_secs
+        self._negative_ttl_secs = negative_ttl_secs
+        self._max_entries = max_entries
+        # Waiting for a pooled connection is not a sign the video host is slow, so only time the request itself
+        self._timeout = httpx.Timeout(timeout_secs, pool=None)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._transport = transport
+        self._client = None
+        self._loop = None
+        self._cache: OrderedDict[str, tuple[float, VideoInfo]] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # The connection pool is bound to the event loop it was first used in
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(timeout=self._timeout,
+                                             limits=self._limits,
+                                             follow_redirects=True,
+                                             transport=self._transport)
+            self._loop = loop
+        return self._client
+
+    def cached(self, url: str) -> VideoInfo | None:
+        """
+        Get the cached result for a url
+        :param url: video url
+        :return: the cached result, or None if missing or expired
+        """
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        expires, video_info = entry
+        if time.monotonic() > expires:
+            del self._cache[url]
+            return None
+        self._cache.move_to_end(url)
+        return video_info
+
+    def _store(self, video_info: VideoInfo):
+        ttl = self._ttl_secs if video_info.available else self._negative_ttl_secs
+        self._cache[video_info.url] = (time.monotonic() + ttl, video_info)
+        self._cache.move_to_end(video_info.url)
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+
+    async def check(self, url: str) -> VideoInfo:
+        """
+        Check if a video is available at a url
+        :param url: video url to check
+        :return: VideoInfo with the availability, size and ETag of the video
+        """
+        video_info = self.cached(url)
+        if video_info is not None:
+            self.hits += 1
+            debug(f"Video {url} availability {video_info.available} from cache")
+            return video_info
+        self.misses += 1
+
+        # Concurrent checks for the same url share a single request, run in its own task so a caller that is
+        # cancelled, e.g. when its client disconnects, does not cancel the request for the others
+        task = self._pending.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._head(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda done: self._finish(url, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, url: str, task: asyncio.Future):
+        if self._pending.get(url) is task:
+            del self._pending[url]
+        # Retrieving the exception also keeps it from being reported as never retrieved
+        if not task.cancelled() and task.exception() is None:
+            self._store(task.result())
+
+    async def _head(self, url: str) -> VideoInfo:
+        if not url:
+            return VideoInfo(url=url, available=False)
+        try:
+            response = await self._get_client().head(url)  # HEAD is faster than GET for checking availability
+            response.raise_for_status()  # Raises an exception for 4xx and 5xx status codes
+            info(f"Video {url} is available.")
+            content_length = response.headers.get('content-length')
+            return VideoInfo(url=url,
+                             available=True,
+                             status_code=response.status_code,
+                             content_length=int(content_length) if content_length and content_length.isdigit() else None,
+                             etag=response.headers.get('etag'))
+        except httpx.HTTPStatusError as e:
+            info(f"Video {url} is not available: {e}")
+            return VideoInfo(url=url, available=False, status_code=e.response.status_code)
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            info(f"Video {url} is not reachable: {e}")
+            return VideoInfo(url=url, available=False)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
@@ -0,0 +1,54 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: app/utils/wakeup.py
+# Description: Wake the daemon through a UNIX datagram socket next to the job cache database
+
+import socket
+from pathlib import Path
+
+# Each daemon worker listens on its own socket in the database directory, which the API and the daemons share
+WAKEUP_SOCKET_GLOB = 'daemon-*.sock'
+
+# Wakeup messages, one per daemon monitor
+WAKE_DOCKER = b'docker'
+
+
+def wakeup_path(database_path: Path, worker_id: str) -> Path:
+    """
+    Get the path of the wakeup socket of a daemon worker
+    :param database_path: The directory of the job cache database
+    :param worker_id: The worker
+    :return: The socket path
+    """
+    return database_path / WAKEUP_SOCKET_GLOB.replace('*', worker_id)
+
+
+class DaemonWakeup:
+
+    def __init__(self, database_path: Path):
+        """
+        Send wakeups to the daemon workers so they pick up submitted and cancelled jobs straight away instead of on
+        their next poll. Sending never blocks and is a no-op if no worker is listening; the workers still poll.
+        :param database_path: The directory of the job cache database
+        """
+        self._database_path = database_path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def notify(self, message: bytes = WAKE_DOCKER) -> bool:
+        """
+        Wake every daemon worker listening on this machine
+        :param message: Which monitor to wake, e.g. WAKE_DOCKER
+        :return: True if the wakeup was sent to any worker
+        """
+        sent = False
+        for path in self._database_path.glob(WAKEUP_SOCKET_GLOB):
+            try:
+                self._sock.sendto(message, path.as_posix())
+                sent = True
+            except OSError:
+                # Not listening, or its queue is full of wakeups it has yet to read, which is as good
+                pass
+        return sent
+
+    def close(self):
+        self._sock.close()
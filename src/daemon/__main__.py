@@ -13,6 +13,7 @@ import yaml
 import os
 from pathlib import Path
 from daemon.misc import verify_upload
+from daemon.metrics import start_metrics_server
 
 # Setup logging
 log_path = Path(os.path.dirname(__file__)).parent.parent / 'logs'
@@ -101,4 +102,5 @@ async def run():
 
 if __name__ == "__main__":
     if env_check() and asyncio.run(run()):
+        start_metrics_server(int(os.getenv('METRICS_PORT', 9101)))
         main()
@@ -6,7 +6,8 @@ import os
 from pathlib import Path
 from dependency_injector import containers, providers
 
-from daemon import model_sync_client, docker_client, monitor, dispatcher
+from daemon import model_sync_client, docker_client, docker_session, retention_client, worker_client, monitor, \
+    dispatcher
 
 
 class Container(containers.DeclarativeContainer):
@@ -18,7 +19,13 @@ class Container(containers.DeclarativeContainer):
     config = providers.Configuration(yaml_files=[yaml_path.as_posix()])
 
     model_sync_client = providers.Factory(model_sync_client.ModelSyncClient)
-    docker_client = providers.Factory(docker_client.DockerClient)
+    # One docker client, and its pool of connections, for the life of the daemon
+    docker_session = providers.Singleton(docker_session.DockerSession)
+    # Identifies this daemon among the workers claiming jobs from the database
+    worker_client = providers.Singleton(worker_client.WorkerClient, options=config.monitors.worker)
+    docker_client = providers.Factory(docker_client.DockerClient, docker_session=docker_session,
+                                      worker_client=worker_client)
+    retention_client = providers.Factory(retention_client.RetentionClient)
 
     sync_monitor = providers.Factory(
         monitor.ModelSyncMonitor,
@@ -35,10 +42,26 @@ class Container(containers.DeclarativeContainer):
         options=config.monitors.docker,
     )
 
+    retention_monitor = providers.Factory(
+        monitor.RetentionMonitor,
+        retention_client=retention_client,
+        database_path=config.database.path,
+        options=config.monitors.retention,
+    )
+
+    worker_monitor = providers.Factory(
+        monitor.WorkerMonitor,
+        worker_client=worker_client,
+        database_path=config.database.path,
+        options=config.monitors.worker,
+    )
+
     dispatcher = providers.Factory(
         dispatcher.Dispatcher,
         monitors=providers.List(
+            worker_monitor,
             docker_monitor,
             sync_monitor,
+            retention_monitor,
         ),
     )
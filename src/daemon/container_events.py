@@ -0,0 +1,122 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/container_events.py
+# Description: Follow the start, die and oom events of the strongsort containers from the docker events API
+
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import Callable
+
+from daemon.docker_session import DockerSession
+from daemon.logger import info, debug, warn
+from daemon.metrics import DOCKER_EVENTS
+
+# Label with the id of the job a container runs
+JOB_ID_LABEL = 'localtrack.job_id'
+
+# Label with the id of the daemon worker that started a container
+WORKER_ID_LABEL = 'localtrack.worker_id'
+
+# Container events to follow
+EVENTS = ['start', 'die', 'oom']
+
+
+@dataclass
+class ContainerEvent:
+    action: str  # start, die or oom
+    name: str
+    job_id: int | None = None  # From the job id label, if any
+    exit_code: int | None = None  # For die events
+
+
+def parse_event(event: dict, prefix: str) -> ContainerEvent | None:
+    """
+    Parse a docker event
+    :param event: The event from the docker events API
+    :param prefix: Only parse events of containers with names that start with this prefix
+    :return: The event, or None if it is not a start, die or oom event of a matching container
+    """
+    action = event.get('Action') or event.get('status')
+    attributes = event.get('Actor', {}).get('Attributes', {})
+    name = attributes.get('name', '')
+    if event.get('Type') != 'container' or action not in EVENTS or not name.startswith(prefix):
+        return None
+    job_id = attributes.get(JOB_ID_LABEL)
+    exit_code = attributes.get('exitCode')
+    return ContainerEvent(action=action,
+                          name=name,
+                          job_id=int(job_id) if job_id and job_id.isdigit() else None,
+                          exit_code=int(exit_code) if exit_code is not None else None)
+
+
+class ContainerEvents:
+
+    def __init__(self, docker_session: DockerSession, prefix: str, on_event: Callable[[ContainerEvent], None],
+                 on_connect: Callable[[], None] | None = None, max_backoff_secs: float = 30):
+        """
+        Subscribe to the docker events of the containers with names that start with a prefix. One stream serves
+        any number of containers. The subscription reconnects if docker restarts; events are missed while it is
+        disconnected, so on_connect is called to check the containers again.
+        :param docker_session: The shared docker client
+        :param prefix: The container name prefix, e.g. strongsort
+        :param on_event: Called with each event
+        :param on_connect: Called each time the subscription is (re)established
+        :param max_backoff_secs: Maximum seconds to wait before reconnecting
+        """
+        self._docker_session = docker_session
+        self._prefix = prefix
+        self._on_event = on_event
+        self._on_connect = on_connect
+        self._max_backoff_secs = max_backoff_secs
+        self._task = None
+        self.connected = False
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.connected = False
+
+    async def _run(self):
+        backoff_secs = 1
+        filters = json.dumps({'type': ['container'], 'event': EVENTS})
+        while True:
+            try:
+                docker_aio = self._docker_session.docker
+                subscriber = docker_aio.events.subscribe(filters=filters)
+                try:
+                    # The subscription only starts with the request, so make sure docker answers first
+                    await docker_aio.version()
+                    self.connected = True
+                    backoff_secs = 1
+                    info(f'Following docker events of {self._prefix} containers')
+                    if self._on_connect:
+                        self._on_connect()
+                    while True:
+                        event = await subscriber.get()
+                        if event is None:
+                            break
+                        self._publish(event)
+                finally:
+                    # Lets the next subscription start a new stream
+                    await docker_aio.events.stop()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                warn(f'Docker events unavailable: {e}')
+            self.connected = False
+            warn(f'Docker events stream ended. Reconnecting in {backoff_secs} seconds')
+            await asyncio.sleep(backoff_secs)
+            backoff_secs = min(backoff_secs * 2, self._max_backoff_secs)
+
+    def _publish(self, event: dict):
+        container_event = parse_event(event, self._prefix)
+        if container_event is None:
+            return
+        debug(f'Docker {container_event.action} event for container {container_event.name}')
+        DOCKER_EVENTS.labels(container_event.action).inc()
+        self._on_event(container_event)
@@ -8,7 +8,8 @@ import time
 from typing import List
 
 from daemon.monitor import Monitor
-from daemon.logger import info
+from daemon.logger import info, exception
+from daemon.metrics import MONITOR_TICK, MONITOR_WAKEUPS
 
 
 class Dispatcher:
@@ -24,6 +25,9 @@ class Dispatcher:
     async def start(self) -> None:
         info("Starting up")
 
+        for monitor in self._monitors:
+            await monitor.start()
+
         for monitor in self._monitors:
             self._monitor_tasks.append(
                 asyncio.create_task(self._run_monitor(monitor)),
@@ -35,6 +39,8 @@ class Dispatcher:
         await asyncio.gather(*self._monitor_tasks, return_exceptions=True)
 
         self.stop()
+        for monitor in self._monitors:
+            await monitor.close()
 
     def stop(self) -> None:
         if self._stopping:
@@ -46,6 +52,8 @@ class Dispatcher:
         for task, monitor in zip(self._monitor_tasks, self._monitors):
             task.cancel()
         self._monitor_tasks.clear()
+        for monitor in self._monitors:
+            monitor.stop()
         info("Shutdown finished successfully")
 
     @staticmethod
@@ -54,14 +62,23 @@ class Dispatcher:
             time_took = time.time() - last
             return monitor.check_every - time_took
 
+        name = type(monitor).__name__
         while True:
             time_start = time.time()
 
+            # A wakeup during the check runs the next check straight away
+            monitor.wakeup.clear()
             try:
                 await monitor.check()
             except asyncio.CancelledError:
                 break
             except Exception:
-                monitor.logger.exception("Error executing monitor check")
+                exception("Error executing monitor check")
+            MONITOR_TICK.labels(name).observe(time.time() - time_start)
 
-            await asyncio.sleep(_until_next(last=time_start))
+            # Wait for a wakeup, or poll after check_every seconds in case one was missed
+            try:
+                await asyncio.wait_for(monitor.wakeup.wait(), timeout=max(0., _until_next(last=time_start)))
+                MONITOR_WAKEUPS.labels(name, 'wakeup').inc()
+            except asyncio.TimeoutError:
+                MONITOR_WAKEUPS.labels(name, 'poll').inc()
@@ -2,96 +2,276 @@
 # Filename: daemon/docker_client.py
 # Description: Docker client that manages docker containers
 
+import asyncio
 import os
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Dict, List, Set
 
-import docker
 import requests
 import json
 import tempfile
-from aiohttp import ClientResponse
+from aiodocker.containers import DockerContainer
+from sqlalchemy import or_
 from deepsea_ai.database.job import Status, JobType
-from deepsea_ai.database.job.database_helper import json_b64_decode, json_b64_encode, get_status
 
-from app.job import MediaLocal, JobLocal, update_media, PydanticJobWithMedia2, init_db
+from app.job import JobLocal, update_media, PydanticJobWithMedia2, init_db, count_jobs_by_status, get_metadata, \
+    get_results, CANCELLED
+from app.job.dedup import update_followers, get_orphaned_followers
+from app.job.lease import claim_jobs, holds_lease
+from daemon.container_events import ContainerEvents, ContainerEvent, WORKER_ID_LABEL
 from daemon.logger import info, err, warn, exception
+from daemon.metrics import RUNNING_CONTAINERS, NOTIFY_SECONDS, JOBS_FINISHED
 from daemon.docker_runner import DockerRunner, DEFAULT_CONTAINER_NAME
+from daemon.docker_session import DockerSession
+from daemon.scheduler import Scheduler
+from daemon.slots import SlotManager
+from daemon.worker_client import WorkerClient
 
 DEFAULT_ARGS = '--iou-thres 0.5 --conf-thres 0.01 --agnostic-nms --max-det 100'
 
+# Number of queued jobs to try to claim for each free slot
+CLAIM_CANDIDATES_PER_SLOT = 2
+
 
 class DockerClient:
 
-    def __init__(self) -> None:
+    def __init__(self, docker_session: DockerSession | None = None, worker_client: WorkerClient | None = None) -> None:
         info('Initializing DockerClient')
-        self._runners = {}
+        # One docker client for the runners, the events and the checks, so none of them block the daemon
+        self._docker_session = docker_session or DockerSession()
+        # Identifies this daemon among the workers claiming jobs from the database
+        self.worker = worker_client or WorkerClient()
+        # The jobs running in the container slots
+        self._slots = SlotManager()
+        # Jobs with no container, e.g. the video download failed
+        self._lost: Set[int] = set()
+        # Called when a container exits, e.g. to wake the monitor so the job is closed out straight away
+        self.on_exit: Callable[[], None] | None = None
+        # Jobs with containers that exited or ran out of memory, from the docker events
+        self._exited: Dict[int, ContainerEvent] = {}
+        self._oom: Set[int] = set()
+        # Poll every runner until the events are followed; containers may exit while the stream is down
+        self._poll_all = True
+        self._events = ContainerEvents(self._docker_session, DEFAULT_CONTAINER_NAME, self._on_container_event,
+                                       self._on_events_connected)
+
+    def start_events(self) -> None:
+        """
+        Follow the docker events of the job containers instead of polling each container on every check
+        """
+        self._events.start()
+
+    def stop_events(self) -> None:
+        self._events.stop()
+
+    async def close(self) -> None:
+        self._events.stop()
+        await self._docker_session.close()
+
+    def _on_container_event(self, event: ContainerEvent) -> None:
+        """
+        Record a container event of a job
+        :param event: The start, die or oom event
+        """
+        job_id = event.job_id
+        if job_id is None:
+            # Containers without a job id label
+            job_id = next((job_id for job_id, runner in self._slots.runners.items()
+                           if runner.container_name == event.name), None)
+        if job_id is None:
+            return
+
+        if event.action == 'start':
+            self._exited.pop(job_id, None)
+            self._oom.discard(job_id)
+        elif event.action == 'oom':
+            warn(f'Job {job_id} docker container {event.name} ran out of memory')
+            self._oom.add(job_id)
+        elif event.action == 'die':
+            info(f'Job {job_id} docker container {event.name} exited with code {event.exit_code}')
+            self._exited[job_id] = event
+            if self.on_exit:
+                self.on_exit()
+
+    def _on_events_connected(self) -> None:
+        self._poll_all = True
+        if self.on_exit:
+            self.on_exit()
+
+    async def finished_jobs(self) -> List[int]:
+        """
+        Get the jobs with containers that are done. From the docker events if followed, so running containers cost
+        no docker calls, otherwise by polling each container
+        :return: The job ids
+        """
+        if self._events.connected and not self._poll_all:
+            return [job_id for job_id in self._slots.runners if job_id in self._exited or job_id in self._lost]
+
+        # Any exits from here on are in the events
+        self._poll_all = not self._events.connected
+        finished = []
+        for job_id, runner in self._slots.runners.items():
+            if await runner.is_running():
+                info(f'Job {job_id} docker container {runner.container_name} is still running')
+                continue
+            if job_id in self._lost or runner.is_successful() or await runner.failed():
+                finished.append(job_id)
+        return finished
 
-    async def check(self, database_path: Path) -> None:
+    async def check(self, database_path: Path, hardware: str | None = None) -> None:
         """
         Check the status of any running jobs and close them out
         :param database_path: The path to the database
+        :param hardware: Where the jobs are processed, recorded with the results
         :return:
         """
 
         session_maker = init_db(database_path, reset=False)
 
+        # Stop the containers of cancelled jobs first so their processes are free for the next job
+        await self.stop_cancelled(session_maker)
+
         jobs_to_remove = []
-        for job_id, runner in self._runners.items():
+        for job_id in await self.finished_jobs():
+            runner = self._slots.runners[job_id]
 
-            if runner.is_running():
-                info(f'Job {job_id} docker container {runner.container_name} is still running')
+            # A job whose lease expired, e.g. while this worker could not reach the database, may be running on
+            # another worker, which owns its results
+            with session_maker.begin() as db:
+                job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
+                reclaimed = job is None or not holds_lease(job, self.worker.id)
+            if reclaimed:
+                warn(f'Job {job_id} was reclaimed from this worker. Discarding its docker container '
+                     f'{runner.container_name}')
+                jobs_to_remove.append(job_id)
+                await runner.clean()
                 continue
 
             if runner.is_successful():
                 info(f'Job {job_id} docker container {runner.container_name} processing complete')
                 jobs_to_remove.append(job_id)
 
-                # Update the job status and notify
+                # Update the job status, committed before the notifications and upload so the database is not
+                # locked for their round trips
                 with session_maker.begin() as db:
                     job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
-                    if job.media[0].metadata_b64:
-                        metadata = json_b64_decode(job.media[0].metadata_b64)
-                    else:
-                        metadata = {}
-                    job.results, local_path, num_tracks, processing_time_secs = runner.get_results()
-                    metadata['s3_path'] = job.results
-                    metadata['num_tracks'] = num_tracks
-                    metadata['processing_time_secs'] = processing_time_secs
+                    s3_path, local_path, num_tracks, processing_time_secs = runner.get_results()
+                    results = {'s3_path': s3_path,
+                               'num_tracks': num_tracks,
+                               'processing_time_secs': processing_time_secs,
+                               'hardware': hardware}
                     update_media(db, job,
                                  job.media[0].name,
                                  Status.SUCCESS,
-                                 metadata_b64=json_b64_encode(metadata))
-                    await notify(job, local_path)
-                    await runner.fini()
-
-            if runner.failed():
-                warn(f'Job {job_id} docker container {runner.container_name} failed')
+                                 metadata=results)
+                    # Jobs attached to this job share its results
+                    followers = update_followers(db, job, Status.SUCCESS, results)
+                    notifications = [(j.id, get_metadata(j)) for j in [job, *followers]]
+                JOBS_FINISHED.labels(Status.SUCCESS).inc()
+                for notify_id, metadata in notifications:
+                    await notify(notify_id, metadata, local_path)
+                await runner.fini()
+            else:
+                reason = ' out of memory' if job_id in self._oom else ''
+                warn(f'Job {job_id} docker container {runner.container_name} failed{reason}')
                 jobs_to_remove.append(job_id)
-                # Update the job status and notify
+                # Update the job status, committed before the notifications and cleanup
                 with session_maker.begin() as db:
                     job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
-                    if job.media[0].metadata_b64:
-                        metadata = json_b64_decode(job.media[0].metadata_b64)
-                    else:
-                        metadata = {}
                     update_media(db, job,
                                  job.media[0].name,
-                                 Status.FAILED,
-                                 metadata_b64=json_b64_encode(metadata))
-                    # Create a track tar file that is empty
-                    temp_path = Path(tempfile.gettempdir())
-                    local_path = temp_path / 'empty.tar.gz'
-                    local_path.touch()
-                    await notify(job, local_path)
-                    await runner.fini()
-                    local_path.unlink()
+                                 Status.FAILED)
+                    followers = update_followers(db, job, Status.FAILED)
+                    notifications = [(j.id, get_metadata(j)) for j in [job, *followers]]
+                JOBS_FINISHED.labels(Status.FAILED).inc()
+                # Create a track tar file that is empty
+                temp_path = Path(tempfile.gettempdir())
+                local_path = temp_path / 'empty.tar.gz'
+                local_path.touch()
+                for notify_id, metadata in notifications:
+                    await notify(notify_id, metadata, local_path)
+                await runner.fini()
+                local_path.unlink()
 
         # Remove the instances
         for job_id in jobs_to_remove:
-            if job_id in self._runners:
+            if self._slots.release(job_id):
                 info(f'Removing runner for job {job_id} from the list of runners')
-                del self._runners[job_id]
+        # Forget the events of jobs no longer running, e.g. cancelled
+        for job_id in [job_id for job_id in self._exited if job_id not in self._slots.runners]:
+            del self._exited[job_id]
+        self._oom &= set(self._slots.runners)
+        self._lost &= set(self._slots.runners)
+
+        # Close out any attached jobs that missed the completion of the job they are attached to
+        with session_maker.begin() as db:
+            notifications = []
+            for follower in get_orphaned_followers(db):
+                primary = db.query(JobLocal).filter(JobLocal.id == follower.duplicate_of).first()
+                primary_media = primary.media[0]
+                warn(f'Job {follower.id} missed the completion of job {primary.id}. Updating to {primary_media.status}')
+                update_media(db, follower, follower.media[0].name, primary_media.status,
+                             metadata=get_results(primary_media))
+                notifications.append((follower.id, get_metadata(follower)))
+        for notify_id, metadata in notifications:
+            await notify(notify_id, metadata)
+
+    async def stop_cancelled(self, session_maker) -> None:
+        """
+        Stop and remove the containers of running jobs cancelled through the API, and clean up their temp dirs
+        :param session_maker: The database sessionmaker
+        """
+        if not self._slots.runners:
+            return
+
+        with session_maker.begin() as db:
+            cancelled = [job_id for job_id, in db.query(JobLocal.id)
+                         .filter(JobLocal.id.in_(list(self._slots.runners)), JobLocal.status == CANCELLED)]
+
+        for job_id in cancelled:
+            runner = self._slots.release(job_id)
+            info(f'Job {job_id} was cancelled. Stopping docker container {runner.container_name}')
+            try:
+                await runner.clean()
+            except Exception as e:
+                exception(e)
+            JOBS_FINISHED.labels(CANCELLED).inc()
+
+    async def list_containers(self) -> List[DockerContainer]:
+        """
+        Get the strongsort containers of this worker, running or not, and any without a worker label
+        :return: The containers, as listed by docker, with their Names and State
+        """
+        containers = await self._docker_session.docker.containers.list(
+            all=True, filters=json.dumps({'name': [DEFAULT_CONTAINER_NAME]}))
+        # Leave the containers of other workers on the same docker host alone
+        return [container for container in containers
+                if container['Names'][0].lstrip('/').startswith(DEFAULT_CONTAINER_NAME)
+                and (container['Labels'] or {}).get(WORKER_ID_LABEL, self.worker.id) == self.worker.id]
+
+    async def reconcile(self) -> None:
+        """
+        Reconcile the container slots with the containers docker reports, listed once per check
+        """
+        containers = {container['Names'][0].lstrip('/'): container['State']
+                      for container in await self.list_containers()}
+        lost, exited = self._slots.reconcile(containers)
+        lost = set(lost) - self._lost
+        # Exits missed by the events, e.g. before the events stream started, so no job is stranded running. Without
+        # the events every container is polled anyway
+        exited = [job_id for job_id in exited if job_id not in self._exited] if self._events.connected else []
+        for job_id in exited:
+            name = self._slots.runners[job_id].container_name
+            warn(f'Job {job_id} docker container {name} exited without an event')
+            self._exited[job_id] = ContainerEvent(action='die', name=name, job_id=job_id)
+        RUNNING_CONTAINERS.set(self._slots.num_used)
+        if lost or exited:
+            # Close them out straight away
+            self._lost |= lost
+            if self.on_exit:
+                self.on_exit()
 
     async def process(self,
                       has_gpu: bool,
@@ -99,78 +279,73 @@ class DockerClient:
                       database_path: Path,
                       root_bucket: str,
                       track_prefix: str,
-                      s3_track_config: str) -> ClientResponse:
+                      s3_track_config: str,
+                      scheduler: Scheduler | None = None) -> int:
         """
-        Process any jobs that are queued. This function is called by the daemon module
+        Start as many queued jobs as there are free slots. This function is called by the daemon module
         :param has_gpu: True if the machine has a GPU(s)
         :param num_procs: The number of processes to run in parallel
         :param database_path: The path to the database
         :param root_bucket: The root bucket for the track tar files
         :param track_prefix: The prefix for the track tar files
         :param s3_track_config: The s3 track config
+        :param scheduler: Chooses the next jobs to run, oldest first if None
+        :return: The number of jobs started
         """
         session_maker = init_db(database_path, reset=False)
 
-        # Get any media that are queued for processing
-        with session_maker.begin() as db:
-            media = db.query(MediaLocal).filter(MediaLocal.status == Status.QUEUED).first()
-            if not media:
-                info(f'No video queued to process')
-                return
-
-            job_id = media.job_id
-
-        client = docker.from_env()
-
-        # Get all active docker containers
-        all_containers = client.containers.list(all=True)
-        all_containers = [container for container in all_containers if
-                          container.name.startswith(DEFAULT_CONTAINER_NAME)]
-
-        info(f'Found {len(all_containers)} active {DEFAULT_CONTAINER_NAME} docker containers')
-
-        if len(all_containers) <= num_procs:
-            with session_maker.begin() as db:
-                # Get the first job in the queue
-                job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
-                if not job:
-                    err(f'No job found with id {job_id}')
-                    return
-                job_data = PydanticJobWithMedia2.from_orm(job)
-                update_media(db, job, job.media[0].name, Status.RUNNING)
-
-            if job_data:
-                # Make a prefix for the output based on the video path (sans http) and the current time
-                key = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}"
-                output_s3 = f"s3://{root_bucket}/{track_prefix}/{key}"
-
-                # Add default args if none are provided
-                args = job_data.args or DEFAULT_ARGS
-
-                info(f'Running job {job_data.id} with output {output_s3}')
-                runner = DockerRunner(image_name=job_data.engine,
-                                      job_id=job_data.id,
-                                      job_name=job_data.name,
-                                      output_s3=output_s3,
-                                      video_url=job_data.media[0].name,
-                                      model_s3=job_data.model,
-                                      track_s3=s3_track_config,
-                                      args=args)
-
-                with session_maker.begin() as db:
-                    job = db.query(JobLocal).filter(JobLocal.id == job_data.id).first()
-                    update_media(db, job, job.media[0].name, Status.RUNNING)
-
-                self._runners[job_data.id] = runner
+        await self.reconcile()
+        num_free = self._slots.free(num_procs)
+        if num_free == 0:
+            info(f'Already running maximum allowed {self._slots.num_used} jobs. Waiting for one to finish')
+            return 0
 
-                await runner.run(has_gpu)
-            else:
-                err(f'No job found with id {job_id}')
-        else:
-            info(f'Already running maximum allowed {len(all_containers)} jobs. Waiting for one to finish')
+        # Get the next jobs queued for processing; jobs attached to an identical job are not run. Other workers
+        # may claim some of them first, so choose more than there are free slots
+        job_ids = (scheduler or Scheduler()).next_jobs(session_maker, num_free * CLAIM_CANDIDATES_PER_SLOT)
+        if not job_ids:
+            info(f'No video queued to process')
+            return 0
 
-    @staticmethod
-    def startup(database_path: Path) -> None:
+        with session_maker.begin() as db:
+            jobs = [PydanticJobWithMedia2.from_orm(job)
+                    for job in claim_jobs(db, job_ids, self.worker.id, self.worker.lease_secs, max_jobs=num_free)]
+        if not jobs:
+            info(f'Queued jobs {job_ids} were claimed by other workers')
+            return 0
+
+        runners = []
+        for job_data in jobs:
+            # Make a prefix for the output based on the current time and the job, as jobs start together
+            key = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{job_data.id}"
+            output_s3 = f"s3://{root_bucket}/{track_prefix}/{key}"
+
+            # Add default args if none are provided
+            args = job_data.args or DEFAULT_ARGS
+
+            info(f'Running job {job_data.id} with output {output_s3}')
+            runner = DockerRunner(image_name=job_data.engine,
+                                  job_id=job_data.id,
+                                  job_name=job_data.name,
+                                  output_s3=output_s3,
+                                  video_url=job_data.media[0].name,
+                                  model_s3=job_data.model,
+                                  track_s3=s3_track_config,
+                                  args=args,
+                                  docker_session=self._docker_session,
+                                  worker_id=self.worker.id)
+            self._slots.acquire(job_data.id, runner)
+            runners.append(runner)
+
+        # Download the videos and start the containers together. A job that does not start has no container,
+        # so it is closed out as failed once reconciled
+        results = await asyncio.gather(*(runner.run(has_gpu) for runner in runners), return_exceptions=True)
+        for runner, result in zip(runners, results):
+            if isinstance(result, Exception):
+                exception(f'Error starting docker container {runner.container_name}: {result}')
+        return len(runners)
+
+    async def startup(self, database_path: Path) -> None:
         """
         Startup logic to kill any dangling jobs and check for docker
         Check the database for any jobs that were running when the service was restarted and mark them as failed
@@ -181,21 +356,25 @@ class DockerClient:
         session_maker = init_db(database_path, reset=False)
 
         info(f'Checking for valid docker connection')
-        client = docker.from_env()
-
         try:
-            client.ping()
+            await self._docker_session.docker.version()
         except Exception as e:
             err(f"docker not available {e}")
             return
 
         with session_maker.begin() as db:
-            docker_jobs = db.query(JobLocal).filter(JobLocal.job_type == JobType.DOCKER).all()
-            # Get all the job ids with status QUEUED and RUNNING
-            jobs_ids_queued = [job.id for job in docker_jobs if get_status(job) == Status.QUEUED]
-            jobs_ids_running = [job.id for job in docker_jobs if get_status(job) == Status.RUNNING]
-            info(f'Found {len(docker_jobs)} docker jobs in the database. '
-                 f'Number of queued jobs: {len(jobs_ids_queued)}. Number of running jobs: {len(jobs_ids_running)}')
+            num_jobs = count_jobs_by_status(db, JobType.DOCKER)
+            # Get all the job ids with status RUNNING on this worker, or claimed before jobs had a worker. The jobs of
+            # other workers are theirs to close out, or are queued again once their leases expire
+            jobs_ids_running = [job_id for job_id, in db.query(JobLocal.id)
+                                .filter(JobLocal.status == Status.RUNNING, JobLocal.job_type == JobType.DOCKER,
+                                        or_(JobLocal.worker_id == self.worker.id,
+                                            # Attached jobs have no worker; they follow their primary job
+                                            (JobLocal.worker_id.is_(None) & JobLocal.duplicate_of.is_(None))))]
+            info(f'Found {sum(num_jobs.values())} docker jobs in the database. '
+                 f'Number of queued jobs: {num_jobs.get(Status.QUEUED, 0)}. '
+                 f'Number of running jobs: {num_jobs.get(Status.RUNNING, 0)}, '
+                 f'{len(jobs_ids_running)} of them on worker {self.worker.id}')
         if len(jobs_ids_running) > 0:
             for job_id in jobs_ids_running:
                 # Should never get here unless something went wrong and the
@@ -204,12 +383,11 @@ class DockerClient:
                 err(f'Job {job_id} was running but the service was restarted')
                 with session_maker.begin() as db:
                     job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
-                    job.media[0].status = Status.FAILED
+                    update_media(db, job, job.media[0].name, Status.FAILED)
+                    update_followers(db, job, Status.FAILED)
 
         # Get all active docker containers
-        all_containers = client.containers.list(all=True)
-        all_containers = [container for container in all_containers if
-                          container.name.startswith(DEFAULT_CONTAINER_NAME)]
+        all_containers = await self.list_containers()
 
         # Should never get here unless something went wrong
         for container in all_containers:
@@ -217,19 +395,21 @@ class DockerClient:
                 f'Container {container.id} was running but the service was restarted. Stopping and removing it')
             # Stop the container
             try:
-                container = client.containers.get(container.id)
-                if container.status == 'running':
-                    container.stop()
+                if container['State'] == 'running':
+                    await container.stop()
                     info(f"Container {container.id} stopped successfully.")
+                await container.delete()
                 info(f"Container {container.id} removed successfully.")
             except Exception as e:
                 exception(e)
 
 
-async def notify(job: JobLocal, local_path: Path = None) -> None:
+async def notify(job_id: int, metadata: dict, local_path: Path = None) -> None:
     """
-    Notify a receiver through a multipart POST request
-    :param job: The job to notify about
+    Notify a receiver through a multipart POST request. Call after the job status is committed, with plain values
+    rather than database rows, so no transaction is held open for the request.
+    :param job_id: The id of the job to notify about
+    :param metadata: The metadata of the job
     :param local_path: The local path to the track tar file
     :return:
     """
@@ -238,26 +418,29 @@ async def notify(job: JobLocal, local_path: Path = None) -> None:
         warn("NOTIFY_URL environment variable not set. Skipping notification")
         return
 
-    metadata = json_b64_decode(job.metadata_b64)
-
     if local_path and local_path.exists():
-        with local_path.open("rb") as file:
-            results = file.read()
-            form_data = {
-                "metadata": (None, json.dumps(metadata), 'application/json'),
-                "file": results
-            }
+        results = await asyncio.to_thread(local_path.read_bytes)
+        form_data = {
+            "metadata": (None, json.dumps(metadata), 'application/json'),
+            "file": results
+        }
     else:
-        err(f'No track tar file found for job {job.id}')
+        err(f'No track tar file found for job {job_id}')
         form_data = {
             "metadata": (None, json.dumps(metadata), 'application/json'),
             "file": None
         }
 
-    info(f'Sending notification for job {job.id} to {notify_url}')
+    info(f'Sending notification for job {job_id} to {notify_url}')
 
-    # Send the multipart POST request
-    response = requests.post(notify_url, files=form_data)
+    # Send the multipart POST request in a thread so the other monitors keep running
+    time_start = time.perf_counter()
+    try:
+        response = await asyncio.to_thread(requests.post, notify_url, files=form_data)
+    except Exception:
+        NOTIFY_SECONDS.labels('error').observe(time.perf_counter() - time_start)
+        raise
+    NOTIFY_SECONDS.labels(response.status_code).observe(time.perf_counter() - time_start)
 
     # Check the response
     if response.status_code == 200:
@@ -4,19 +4,21 @@
 
 from datetime import datetime
 
-from aiodocker import Docker, DockerError
+from aiodocker import DockerError
 import asyncio
-import docker
 
 import yaml
 import os
 import tarfile
 import shutil
+import uuid
 import json
 from urllib.parse import urlparse
 from pathlib import Path
 
 from daemon.misc import download_video, upload_files_to_s3
+from daemon.container_events import JOB_ID_LABEL, WORKER_ID_LABEL
+from daemon.docker_session import DockerSession
 from daemon.logger import info, debug, err
 
 DEFAULT_CONTAINER_NAME = 'strongsort'
@@ -32,7 +34,9 @@ class DockerRunner:
                  video_url: str,
                  model_s3: str,
                  output_s3: str,
-                 args: str | None = None):
+                 args: str | None = None,
+                 docker_session: DockerSession | None = None,
+                 worker_id: str | None = None):
         """
         Run docker container with the given model and video
         :param job_id: id for the job in the database
@@ -41,9 +45,15 @@ class DockerRunner:
         :param output_s3: location to upload the results
         :param track_s3:: location of the track configuration in s3
         :param args: optional arguments to pass to the track command
+        :param docker_session: The shared docker client
+        :param worker_id: The daemon worker running the job, to label the container with
         """
+        self._docker_session = docker_session or DockerSession()
+        self._worker_id = worker_id
         self._start_utc = None
-        self._container_name = f'{DEFAULT_CONTAINER_NAME}-{datetime.utcnow().strftime("%Y%m%d%H%M%S")}'
+        self._job_id = job_id
+        # Unique as jobs start together
+        self._container_name = f'{DEFAULT_CONTAINER_NAME}-{job_id}-{uuid.uuid4().hex[:8]}'
         self._container = None
         self._image_name = image_name
         self._track_s3 = track_s3
@@ -75,28 +85,32 @@ class DockerRunner:
                                  s3_path=p.path.lstrip('/'),
                                  local_path=self._out_path.as_posix(),
                                  suffixes=['.gz', '.json', ".mp4", ".txt"])
-        self.clean()
+        await self.clean()
 
     @property
     def container_name(self) -> str:
         return self._container_name
 
-    def clean(self):
+    async def clean(self):
         """
         Clean up the input/output directories and the container
         :return:
         """
         # Clean up the container
-        client = docker.from_env()
-        containers = client.containers.list(all=True, filters={'name': self._container_name})
-        if len(containers) == 1:
-            container = client.containers.get(containers[0].id)
-            if container.status == 'running':
-                container.stop()
+        try:
+            container = await self._docker_session.docker.containers.get(self._container_name)
+            if container['State']['Status'] == 'running':
+                await container.stop()
                 info(f"Container {container.id} stopped successfully.")
-            container.remove()
+            await container.delete()
             info(f"Container {container.id} removed successfully.")
+        except DockerError as e:
+            if e.status != 404:
+                raise
+
+        await asyncio.to_thread(self._remove_dirs)
 
+    def _remove_dirs(self):
         # Clean up the input directory
         debug(f'Removing {self._in_path.as_posix()}')
         if self._in_path.exists():
@@ -168,17 +182,13 @@ class DockerRunner:
 
         return None, None, None, None
 
-    def failed(self) -> bool:
+    async def failed(self) -> bool:
         """
         Check if container exited
         :return: True if exited and no data created
         """
-        client = docker.from_env()
-        containers = client.containers.list(all=True, filters={'name': self._container_name})
-        if len(containers) == 1:
-            container = containers[0]
-            if container.status == 'exited' and not self.is_successful():
-                return True
+        if await self.get_container_status() == 'exited' and not self.is_successful():
+            return True
 
         return False
 
@@ -193,81 +203,85 @@ class DockerRunner:
 
         return False
 
-    def get_container_status(self) -> str | None:
+    async def get_container_status(self) -> str | None:
         """
         Get the status of the container
         :return: The status of the container, or None if it does not exist
         """
-        docker_client = docker.from_env()
         try:
-            container = docker_client.containers.get(self._container_name)
-            return container.status
-        except docker.errors.NotFound:
-            pass
+            container = await self._docker_session.docker.containers.get(self._container_name)
+            return container['State']['Status']
+        except DockerError as e:
+            if e.status != 404:
+                raise
         return None
 
-    def is_running(self):
+    async def is_running(self):
         """
         Check if the container is running
         :return: True if the container is not running, False otherwise
         """
-        status = self.get_container_status()
+        status = await self.get_container_status()
         if status == 'running':
             return True
 
         return False
 
     async def wait_for_container(self, has_gpu: bool, command: [str], mode: str):
-        async with Docker() as docker_aoi:
-
-            try:
-
-                # If the volume mount fastapi-localtrack_scratch exists, bind it to the temp directory -
-                # this is pass through from the parent docker container in production
-                binds = [f"{self._temp_path}:{self._temp_path}"]
-                volumes = await docker_aoi.volumes.list()
-                for v in volumes['Volumes']:
-                    if 'scratch' in v['Name'] and mode == 'prod':
-                        binds = [f"{v['Name']}:{self._temp_path}"]
-                        break
-
-                debug(f"Using binds {binds}")
-                debug(f"AWS_DEFAULT_REGION={os.environ.get('AWS_DEFAULT_REGION', 'us-west-2')}")
-                debug(f"AWS_ACCESS_KEY_ID={os.environ.get('MINIO_ACCESS_KEY', 'localtrack')[0:5]}**")
-                debug(f"AWS_SECRET_ACCESS_KEY={os.environ.get('MINIO_SECRET_KEY', 'ReplaceMePassword')[0:5]}**")
-                debug(f"AWS_ENDPOINT_URL={os.environ.get('MINIO_ENDPOINT_URL', 'http://localhost:7000')}")
-
-                # Create the configuration for the docker container
-                config = {
-                    'Image': self._image_name,
-                    'HostConfig': {
-                        'NetworkMode': 'host',
-                        'Binds': binds,
-                    },
-                    'Env': [
-                        f"JOB_NAME={self._job_name}",
-                        f"AWS_DEFAULT_REGION={os.environ.get('AWS_DEFAULT_REGION', 'us-west-2')}",
-                        f"AWS_ACCESS_KEY_ID={os.environ.get('MINIO_ACCESS_KEY', 'localtrack')}",
-                        f"AWS_SECRET_ACCESS_KEY={os.environ.get('MINIO_SECRET_KEY', 'ReplaceMePassword')}",
-                        f"AWS_ENDPOINT_URL={os.environ.get('MINIO_EXTERNAL_ENDPOINT_URL', 'http://localhost:7000')}"
-                    ],
-                    'Cmd': command
-                }
-
-                # Check if the runtime nvidia is available, and if so, use it
-                if has_gpu:
-                    config['HostConfig']['Runtime'] = 'nvidia'
-                    info(f"NVIDIA runtime available")
-
-                # Run with network mode host to allow access to the local minio server
-                self._container = await docker_aoi.containers.create_or_replace(
-                    config=config,
-                    name=self._container_name,
-                )
-                info(f'Running docker container {self._container.id} {self._container_name} with command {command}')
-                await self._container.start()
-            except Exception as e:
-                err(e)
+        docker_aoi = self._docker_session.docker
+
+        try:
+
+            # If the volume mount fastapi-localtrack_scratch exists, bind it to the temp directory -
+            # this is pass through from the parent docker container in production
+            binds = [f"{self._temp_path}:{self._temp_path}"]
+            volumes = await docker_aoi.volumes.list()
+            for v in volumes['Volumes']:
+                if 'scratch' in v['Name'] and mode == 'prod':
+                    binds = [f"{v['Name']}:{self._temp_path}"]
+                    break
+
+            debug(f"Using binds {binds}")
+            debug(f"AWS_DEFAULT_REGION={os.environ.get('AWS_DEFAULT_REGION', 'us-west-2')}")
+            debug(f"AWS_ACCESS_KEY_ID={os.environ.get('MINIO_ACCESS_KEY', 'localtrack')[0:5]}**")
+            debug(f"AWS_SECRET_ACCESS_KEY={os.environ.get('MINIO_SECRET_KEY', 'ReplaceMePassword')[0:5]}**")
+            debug(f"AWS_ENDPOINT_URL={os.environ.get('MINIO_ENDPOINT_URL', 'http://localhost:7000')}")
+
+            # Create the configuration for the docker container
+            config = {
+                'Image': self._image_name,
+                'HostConfig': {
+                    'NetworkMode': 'host',
+                    'Binds': binds,
+                },
+                'Env': [
+                    f"JOB_NAME={self._job_name}",
+                    f"AWS_DEFAULT_REGION={os.environ.get('AWS_DEFAULT_REGION', 'us-west-2')}",
+                    f"AWS_ACCESS_KEY_ID={os.environ.get('MINIO_ACCESS_KEY', 'localtrack')}",
+                    f"AWS_SECRET_ACCESS_KEY={os.environ.get('MINIO_SECRET_KEY', 'ReplaceMePassword')}",
+                    f"AWS_ENDPOINT_URL={os.environ.get('MINIO_EXTERNAL_ENDPOINT_URL', 'http://localhost:7000')}"
+                ],
+                'Cmd': command,
+                # Ties the container events to the job
+                'Labels': {JOB_ID_LABEL: str(self._job_id)}
+            }
+            if self._worker_id:
+                config['Labels'][WORKER_ID_LABEL] = self._worker_id
+
+            # Check if the runtime nvidia is available, and if so, use it
+            if has_gpu:
+                config['HostConfig']['Runtime'] = 'nvidia'
+                info(f"NVIDIA runtime available")
+
+            # Run with network mode host to allow access to the local minio server
+            self._container = await docker_aoi.containers.create_or_replace(
+                config=config,
+                name=self._container_name,
+            )
+            info(f'Running docker container {self._container.id} {self._container_name} with command {command}')
+            await self._container.start()
+        except Exception as e:
+            err(e)
 
 
 async def main():
@@ -283,14 +297,17 @@ async def main():
         output_s3 = f's3://localtrack/{track_prefix}/test/{job_id}'
 
         # Create a docker runner and run it
+        docker_session = DockerSession()
         p = DockerRunner(job_id=job_id,
                          job_name='test',
                          track_s3=config['monitors']['docker']['strongsort_track_config'],
                          output_s3=output_s3,
                          video_url='http://localhost:8090/video/V4361_20211006T162656Z_h265_10frame.mp4',
                          model_s3='s3://localtrack/models/yolov5x_mbay_benthic_model.tar.gz',
-                         args='--iou-thres 0.5 --conf-thres 0.01 --agnostic-nms --max-det 100')
+                         args='--iou-thres 0.5 --conf-thres 0.01 --agnostic-nms --max-det 100',
+                         docker_session=docker_session)
         await p.run()
+        await docker_session.close()
 
         if p.is_successful():
             info(f'Processing complete: {p.is_successful()}')
@@ -0,0 +1,30 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/docker_session.py
+# Description: One long-lived aiodocker client shared by everything in the daemon that talks to docker
+
+from aiodocker import Docker
+
+from daemon.logger import info
+
+
+class DockerSession:
+
+    def __init__(self):
+        """
+        Share one aiodocker client, and so one pool of kept-alive connections to the docker daemon, across the
+        docker client, its runners and the events subscription. The client is created on first use as it belongs
+        to the running event loop.
+        """
+        self._docker = None
+
+    @property
+    def docker(self) -> Docker:
+        if self._docker is None:
+            self._docker = Docker()
+            info('Created the shared docker client')
+        return self._docker
+
+    async def close(self) -> None:
+        if self._docker is not None:
+            docker_aio, self._docker = self._docker, None
+            await docker_aio.close()
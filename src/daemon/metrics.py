@@ -0,0 +1,54 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/metrics.py
+# Description: Prometheus metrics for the daemon, served from a small listener
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from daemon.logger import info, exception
+
+MONITOR_TICK = Histogram('localtrack_daemon_monitor_tick_seconds', 'Time to run one monitor check', ['monitor'])
+
+MONITOR_WAKEUPS = Counter('localtrack_daemon_monitor_wakeups_total',
+                          'Number of monitor checks, by whether the monitor was woken or polled', ['monitor', 'reason'])
+
+RUNNING_CONTAINERS = Gauge('localtrack_daemon_running_containers', 'Number of active strongsort containers')
+
+CONCURRENT_PROCS = Gauge('localtrack_daemon_concurrent_procs', 'Maximum number of containers to run concurrently')
+
+DOWNLOAD_BYTES = Counter('localtrack_daemon_download_bytes_total', 'Bytes of video downloaded')
+
+DOWNLOAD_SECONDS = Histogram('localtrack_daemon_download_seconds', 'Time to download a video', ['result'],
+                             buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')))
+
+UPLOAD_BYTES = Counter('localtrack_daemon_upload_bytes_total', 'Bytes uploaded to S3')
+
+UPLOAD_SECONDS = Histogram('localtrack_daemon_upload_seconds', 'Time to upload a file to S3', ['result'])
+
+NOTIFY_SECONDS = Histogram('localtrack_daemon_notify_seconds', 'Time to send a notification', ['result'])
+
+S3_CALLS = Counter('localtrack_daemon_s3_calls_total', 'Number of S3 API calls', ['operation'])
+
+DOCKER_EVENTS = Counter('localtrack_daemon_docker_events_total', 'Number of strongsort container events', ['event'])
+
+JOBS_FINISHED = Counter('localtrack_daemon_jobs_finished_total', 'Number of jobs finished', ['status'])
+
+JOBS_RECLAIMED = Counter('localtrack_daemon_jobs_reclaimed_total',
+                         'Number of running jobs queued again as their worker stopped renewing their leases')
+
+
+def start_metrics_server(port: int) -> bool:
+    """
+    Serve the daemon metrics on the given port; a port of 0 disables the listener
+    :param port: The port to listen on
+    :return: True if the listener was started
+    """
+    if port <= 0:
+        info('Daemon metrics listener disabled')
+        return False
+    try:
+        start_http_server(port)
+        info(f'Serving daemon metrics on port {port}')
+        return True
+    except OSError as e:
+        exception(f'Could not start the daemon metrics listener on port {port}: {e}')
+        return False
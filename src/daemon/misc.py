@@ -3,12 +3,14 @@
 # Description:  Miscellaneous utility functions for the daemon
 
 import os
+import time
 import boto3
 import pathlib
 import tempfile
 import requests
 from botocore.exceptions import NoCredentialsError, ClientError
 from .logger import debug, info, err, exception
+from .metrics import DOWNLOAD_BYTES, DOWNLOAD_SECONDS, UPLOAD_BYTES, UPLOAD_SECONDS, S3_CALLS
 
 
 async def upload_file(obj, bucket, s3_path) -> bool:
@@ -24,6 +26,7 @@ async def upload_file(obj, bucket, s3_path) -> bool:
         # First check if the file exists in the bucket
         try:
             debug(f'Checking if file {s3_path} exists in s3://{bucket}')
+            S3_CALLS.labels('head_object').inc()
             s3.head_object(Bucket=bucket, Key=s3_path)
             info(f'File {s3_path} already exists in s3://{bucket}')
             return True
@@ -37,7 +40,15 @@ async def upload_file(obj, bucket, s3_path) -> bool:
             exception(f'Error checking if file exists: {ex}')
             pass
 
-        s3.upload_file(obj, bucket, s3_path)
+        time_start = time.perf_counter()
+        S3_CALLS.labels('upload_file').inc()
+        try:
+            s3.upload_file(obj, bucket, s3_path)
+        except Exception:
+            UPLOAD_SECONDS.labels('error').observe(time.perf_counter() - time_start)
+            raise
+        UPLOAD_SECONDS.labels('ok').observe(time.perf_counter() - time_start)
+        UPLOAD_BYTES.inc(os.path.getsize(obj))
         info(f'File uploaded successfully to s3://{bucket}/{s3_path}')
         return True
     except FileNotFoundError:
@@ -112,6 +123,7 @@ def download_video(url: str, save_path: pathlib.Path) -> bool:
     :param save_path:  local path to save to
     :return: True if successful, False otherwise
     """
+    time_start = time.perf_counter()
     response = requests.get(url, stream=True)
     if response.status_code == 200:
         # If the save_path is a directory, use the filename from the url
@@ -121,9 +133,12 @@ def download_video(url: str, save_path: pathlib.Path) -> bool:
         with save_path.open('wb') as file:
             for chunk in response.iter_content(chunk_size=8192):
                 file.write(chunk)
+                DOWNLOAD_BYTES.inc(len(chunk))
+        DOWNLOAD_SECONDS.labels('ok').observe(time.perf_counter() - time_start)
         info(f"Video {url} downloaded successfully to {save_path}.")
         return True
     else:
+        DOWNLOAD_SECONDS.labels('error').observe(time.perf_counter() - time_start)
         err(f"Failed to download {url} to {save_path}")
         return False
 
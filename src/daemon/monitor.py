@@ -2,20 +2,42 @@
 # Filename: daemon/monitor.py
 # Description:  Miscellaneous utility functions for the daemon
 
+import asyncio
 import os
+import platform
 import time
 from pathlib import Path
 from typing import Dict, Any
 
 from daemon.model_sync_client import ModelSyncClient
+from daemon.retention_client import RetentionClient
+from daemon.worker_client import WorkerClient
 from daemon.docker_client import DockerClient
+from daemon.scheduler import Scheduler
+from daemon.wakeup import WakeupListener
 from daemon.logger import info, exception
+from daemon.metrics import CONCURRENT_PROCS
+from app.utils.wakeup import DaemonWakeup, wakeup_path, WAKE_DOCKER
 
 
 class Monitor:
 
     def __init__(self, check_every: int) -> None:
         self.check_every = check_every
+        # Set to run the next check straight away instead of after check_every seconds
+        self.wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        self.wakeup.set()
+
+    async def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
 
     async def check(self) -> None:
         raise NotImplementedError()
@@ -50,17 +72,52 @@ class DockerMonitor(Monitor):
                 self._track_prefix = minio.get("track_prefix")
             self._s3_strongsort_track_config = options.get("strongsort_track_config")
 
-            # Handle startup edge cases
-            DockerClient.startup(self._database_path)
+            # Which queued job runs next, e.g. the oldest, highest priority or shortest
+            self._scheduler = Scheduler(options.get("scheduler"))
+            info(f'Scheduling jobs with the {self._scheduler.name} policy')
+
+            # The API wakes the monitor when jobs are submitted or cancelled, and the client when a container exits,
+            # so check_every is only a safety net. Without the socket the monitor polls every fallback_check_every
+            self._wakeup_listener = None
+            if options.get("wakeup_socket", True):
+                self._wakeup_listener = WakeupListener(wakeup_path(self._database_path, self._client.worker.id),
+                                                       {WAKE_DOCKER: self.wake})
+            self._fallback_check_every = options.get("fallback_check_every", 5)
+            self._client.on_exit = self.wake
+            # Finished containers are found from the docker events instead of polling each container
+            self._docker_events = options.get("docker_events", True)
 
             self._num_gpus = int(os.environ.get('NUM_GPUS', 0)) # Number of GPUs to use
             self._num_procs = int(os.environ.get('NUM_CONCURRENT_PROCS', 1)) # Number of processes to run concurrently
+            CONCURRENT_PROCS.set(self._num_procs)
+
+            # Recorded with each job to compare processing times across machines, e.g. x86_64 1 gpu
+            self._hardware = os.environ.get('HARDWARE',
+                                            f'{platform.machine()} {self._num_gpus} gpu' if self._num_gpus else
+                                            f'{platform.machine()} cpu')
 
             super().__init__(check_every=options.get("check_every"))
         except Exception as e:
             exception(f'Error initializing DockerMonitor: {e}')
             exit(-1)
 
+    async def start(self) -> None:
+        # Handle startup edge cases
+        await self._client.startup(self._database_path)
+        if self._wakeup_listener is None or not self._wakeup_listener.start():
+            self.check_every = min(self.check_every, self._fallback_check_every)
+            info(f'Polling for docker jobs every {self.check_every} seconds')
+        if self._docker_events:
+            self._client.start_events()
+
+    def stop(self) -> None:
+        if self._wakeup_listener is not None:
+            self._wakeup_listener.stop()
+        self._client.stop_events()
+
+    async def close(self) -> None:
+        await self._client.close()
+
     async def check(self) -> None:
         time_start = time.time()
         info('Checking DockerMonitor')
@@ -70,15 +127,17 @@ class DockerMonitor(Monitor):
             has_gpu = True
 
         try:
+            # Close out finished jobs first so their processes are free for the next job
+            await self._client.check(database_path=self._database_path, hardware=self._hardware)
             await self._client.process(
                 has_gpu=has_gpu,
                 num_procs=self._num_procs,
                 database_path=self._database_path,
                 root_bucket=self._root_bucket,
                 track_prefix=self._track_prefix,
-                s3_track_config=self._s3_strongsort_track_config
+                s3_track_config=self._s3_strongsort_track_config,
+                scheduler=self._scheduler
             )
-            await self._client.check(database_path=self._database_path)
         except Exception as e:
             exception(f'Error processing docker jobs: {e}')
             exit(-1)
@@ -128,3 +187,91 @@ class ModelSyncMonitor(Monitor):
         time_took = time_end - time_start
 
         info(f'ModelSyncClient took: {round(time_took, 3)} seconds. Result: {ok}. Found {num_models} models')
+
+
+class RetentionMonitor(Monitor):
+
+    def __init__(
+            self,
+            retention_client: RetentionClient,
+            database_path: Path,
+            options: Dict[str, Any],
+    ) -> None:
+        self._client = retention_client
+        options = options or {}
+
+        if os.environ.get('DATABASE_DIR'):
+            self._database_path = Path(os.environ.get('DATABASE_DIR'))
+        else:
+            self._database_path = Path(database_path)
+
+        self._archive_path = Path(os.environ.get('ARCHIVE_DIR', self._database_path / 'archive'))
+        self._archive_after_days = options.get("archive_after_days", 30)
+        self._event_retention_days = options.get("event_retention_days", 7)
+        self._vacuum_pages = options.get("vacuum_pages", 2000)
+        super().__init__(check_every=options.get("check_every", 3600))
+
+    async def check(self) -> None:
+        time_start = time.time()
+
+        try:
+            num_archived, num_pruned, num_freed = await self._client.run(
+                database_path=self._database_path,
+                archive_path=self._archive_path,
+                archive_after_days=self._archive_after_days,
+                event_retention_days=self._event_retention_days,
+                vacuum_pages=self._vacuum_pages
+            )
+        except Exception as e:
+            exception(f'Error running database retention: {e}')
+            return
+
+        time_end = time.time()
+        time_took = time_end - time_start
+
+        info(f'RetentionClient took: {round(time_took, 3)} seconds. Archived {num_archived} jobs, '
+             f'deleted {num_pruned} events and freed {num_freed} pages')
+
+
+class WorkerMonitor(Monitor):
+
+    def __init__(
+            self,
+            worker_client: WorkerClient,
+            database_path: Path,
+            options: Dict[str, Any],
+    ) -> None:
+        self._client = worker_client
+        options = options or {}
+
+        if os.environ.get('DATABASE_DIR'):
+            self._database_path = Path(os.environ.get('DATABASE_DIR'))
+        else:
+            self._database_path = Path(database_path)
+
+        self._num_slots = int(os.environ.get('NUM_CONCURRENT_PROCS', 1))
+        # Wakes the workers on this machine to run the jobs queued again
+        self._wakeup = DaemonWakeup(self._database_path)
+        # Heartbeats must be well within the lease so a busy database does not let the leases lapse
+        super().__init__(check_every=options.get("check_every", 30))
+
+    async def check(self) -> None:
+        time_start = time.time()
+
+        try:
+            num_renewed, reclaimed = await self._client.run(database_path=self._database_path,
+                                                            num_slots=self._num_slots)
+        except Exception as e:
+            exception(f'Error recording the worker heartbeat: {e}')
+            return
+        if reclaimed:
+            self._wakeup.notify()
+
+        time_end = time.time()
+        time_took = time_end - time_start
+
+        info(f'WorkerClient took: {round(time_took, 3)} seconds. Renewed {num_renewed} leases and queued '
+             f'{len(reclaimed)} jobs of other workers again')
+
+    async def close(self) -> None:
+        self._wakeup.close()
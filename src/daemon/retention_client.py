@@ -0,0 +1,47 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/retention_client.py
+# Description: Archives finished jobs and compacts the job cache database
+
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from deepsea_ai.database.job import Status
+
+from app.job import init_db, count_jobs_by_status
+from app.job.retention import archive_jobs, prune_events, compact
+from daemon.logger import info
+
+
+class RetentionClient:
+
+    async def run(self,
+                  database_path: Path,
+                  archive_path: Path,
+                  archive_after_days: float,
+                  event_retention_days: float,
+                  vacuum_pages: int) -> (int, int, int):
+        """
+        Archive finished jobs and prune old change feed events, then compact the database if no jobs are
+        queued or running. The work runs in a thread so the other monitors are not blocked.
+        :param database_path: The path to the database
+        :param archive_path: The directory to write the archived jobs to
+        :param archive_after_days: Archive finished jobs created this many days ago
+        :param event_retention_days: Delete change feed events created this many days ago
+        :param vacuum_pages: Maximum number of free pages to return to the file system
+        :return: The number of jobs archived, events deleted and pages freed
+        """
+        session_maker = init_db(database_path, reset=False)
+        now = datetime.utcnow()
+        num_archived = await asyncio.to_thread(archive_jobs, session_maker, archive_path,
+                                               now - timedelta(days=archive_after_days))
+        num_pruned = await asyncio.to_thread(prune_events, session_maker, now - timedelta(days=event_retention_days))
+
+        with session_maker.begin() as db:
+            num_jobs = count_jobs_by_status(db)
+        if num_jobs.get(Status.QUEUED, 0) + num_jobs.get(Status.RUNNING, 0) > 0:
+            info(f'Jobs are queued or running. Skipping database compaction')
+            return num_archived, num_pruned, 0
+
+        num_freed = await asyncio.to_thread(compact, session_maker, vacuum_pages)
+        return num_archived, num_pruned, num_freed
@@ -0,0 +1,205 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/scheduler.py
+# Description: Policies that choose which queued jobs to run next
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from deepsea_ai.database.job import Status
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.job import JobLocal, MediaLocal
+from app.job.stats import StatsService
+
+
+@dataclass
+class Candidate:
+    job_id: int
+    priority: int = 0
+    expected_secs: float = 0.  # Estimated processing time
+    client: str | None = None  # Identifies who submitted the job, from the job metadata
+    queued_secs: float = 0.  # Time since the job was submitted
+
+
+class Policy:
+    """
+    Chooses which queued jobs to run next. Policies only see the candidates passed to them, so they can be
+    tested and simulated without a database or docker.
+    """
+    # Number of seconds of recently run jobs the policy needs, if any
+    window_secs = 0
+    # True if the policy needs the expected processing time of the candidates
+    needs_expected_secs = False
+
+    def select(self, candidates: List[Candidate], running: List[Candidate], n: int) -> List[Candidate]:
+        """
+        Choose the jobs to run
+        :param candidates: The queued jobs
+        :param running: The running jobs, and the jobs run in the last window_secs
+        :param n: The number of free slots
+        :return: Up to n candidates, in the order to run them
+        """
+        return sorted(candidates, key=self.key)[:n]
+
+    def key(self, candidate: Candidate):
+        raise NotImplementedError()
+
+
+class FifoPolicy(Policy):
+    """
+    Oldest job first
+    """
+
+    def key(self, candidate: Candidate):
+        return candidate.job_id
+
+
+class PriorityPolicy(Policy):
+
+    def __init__(self, aging_secs: float = 0):
+        """
+        Highest priority first, then oldest job first
+        :param aging_secs: Raise the priority of a job by one for each aging_secs it waits, so low priority jobs
+        are not starved; 0 to disable
+        """
+        self._aging_secs = aging_secs
+
+    def key(self, candidate: Candidate):
+        priority = candidate.priority
+        if self._aging_secs:
+            priority += int(candidate.queued_secs // self._aging_secs)
+        return -priority, candidate.job_id
+
+
+class ShortestJobFirstPolicy(Policy):
+    """
+    Shortest expected processing time first, then oldest job first. Minimizes the mean time to complete jobs,
+    but long jobs wait while shorter jobs keep arriving.
+    """
+
+    needs_expected_secs = True
+
+    def key(self, candidate: Candidate):
+        return candidate.expected_secs, candidate.job_id
+
+
+class FairSharePolicy(Policy):
+
+    def __init__(self, weights: Dict[str, float] = None, default_weight: float = 1., window_secs: float = 3600):
+        """
+        Share the slots between clients in proportion to their weights. The client with the fewest jobs running
+        or run in the last window_secs, relative to its weight, goes next with its oldest job. Jobs without a
+        client share one anonymous client.
+        :param weights: The weight of each client
+        :param default_weight: The weight of clients not in weights
+        :param window_secs: How long a job counts against its client after it starts
+        """
+        self._weights = weights or {}
+        self._default_weight = default_weight
+        self.window_secs = window_secs
+
+    def select(self, candidates: List[Candidate], running: List[Candidate], n: int) -> List[Candidate]:
+        usage = Counter(c.client for c in running)
+        queues = {}
+        for candidate in sorted(candidates, key=lambda c: c.job_id):
+            queues.setdefault(candidate.client, []).append(candidate)
+
+        selected = []
+        while queues and len(selected) < n:
+            client = min(queues, key=lambda c: (usage[c] / self._weights.get(c, self._default_weight),
+                                                queues[c][0].job_id))
+            selected.append(queues[client].pop(0))
+            usage[client] += 1
+            if not queues[client]:
+                del queues[client]
+        return selected
+
+
+POLICIES = {
+    'fifo': FifoPolicy,
+    'priority': PriorityPolicy,
+    'sjf': ShortestJobFirstPolicy,
+    'fair_share': FairSharePolicy,
+}
+
+
+def load_candidates(db: Session, stats: StatsService | None, client_key: str = 'client',
+                    max_candidates: int = 10000, by_priority: bool = False) -> List[Candidate]:
+    """
+    Load the queued jobs to choose from; jobs attached to an identical job are not run
+    :param db: The database session
+    :param stats: Estimates the processing time of each job, or None if the policy does not need it
+    :param client_key: The metadata key that identifies the client
+    :param max_candidates: Maximum number of jobs to load, oldest first
+    :param by_priority: Load the highest priority jobs first
+    :return: The candidates
+    """
+    now = datetime.utcnow()
+    rows = db.query(JobLocal.id, JobLocal.priority, JobLocal.model, JobLocal.args, JobLocal.createdAt,
+                    JobLocal.metadata_json[client_key].as_string(), MediaLocal.size_bytes) \
+        .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+        .filter(JobLocal.status == Status.QUEUED, JobLocal.duplicate_of.is_(None)) \
+        .order_by(*((JobLocal.priority.desc(),) if by_priority else ()), JobLocal.id) \
+        .limit(max_candidates)
+    return [Candidate(job_id=job_id,
+                      priority=priority or 0,
+                      expected_secs=stats.expected_secs(model, args, size_bytes) if stats else 0.,
+                      client=client,
+                      queued_secs=(now - created).total_seconds() if created else 0.)
+            for job_id, priority, model, args, created, client, size_bytes in rows]
+
+
+def load_running(db: Session, window_secs: float = 0, client_key: str = 'client') -> List[Candidate]:
+    """
+    Load the running jobs, and the jobs that completed in the last window_secs
+    :param db: The database session
+    :param window_secs: How far back to include completed jobs; 0 for only the running jobs
+    :param client_key: The metadata key that identifies the client
+    :return: The jobs
+    """
+    since = datetime.utcnow() - timedelta(seconds=window_secs)
+    recent = (JobLocal.status == Status.RUNNING)
+    if window_secs:
+        recent = recent | (JobLocal.status.in_([Status.SUCCESS, Status.FAILED]) & (MediaLocal.updatedAt >= since))
+    rows = db.query(JobLocal.id, JobLocal.priority, JobLocal.metadata_json[client_key].as_string()) \
+        .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+        .filter(recent, JobLocal.duplicate_of.is_(None))
+    return [Candidate(job_id=job_id, priority=priority or 0, client=client) for job_id, priority, client in rows]
+
+
+class Scheduler:
+
+    def __init__(self, options: Dict[str, Any] | None = None):
+        """
+        Choose the queued jobs to run with the policy in the scheduler options of the configuration, e.g.
+        {'policy': 'fair_share', 'client_key': 'client', 'weights': {'dive-planner': 2}}
+        :param options: The policy name, client_key, max_candidates and the arguments of the policy
+        """
+        options = dict(options or {})
+        name = options.pop('policy', None) or 'fifo'
+        self._client_key = options.pop('client_key', None) or 'client'
+        self._max_candidates = options.pop('max_candidates', None) or 10000
+        if name not in POLICIES:
+            raise ValueError(f'Unknown scheduling policy {name}; choose one of {", ".join(POLICIES)}')
+        self.name = name
+        self.policy = POLICIES[name](**options)
+        self._stats = None
+
+    def next_jobs(self, session_maker: sessionmaker, n: int) -> List[int]:
+        """
+        Choose the queued jobs to run next
+        :param session_maker: The database sessionmaker
+        :param n: The number of free slots
+        :return: The ids of up to n jobs, in the order to run them
+        """
+        if self.policy.needs_expected_secs and self._stats is None:
+            self._stats = StatsService(session_maker)
+        with session_maker.begin() as db:
+            candidates = load_candidates(db, self._stats, self._client_key, self._max_candidates,
+                                         by_priority=isinstance(self.policy, PriorityPolicy))
+            if not candidates:
+                return []
+            running = load_running(db, self.policy.window_secs, self._client_key)
+        return [c.job_id for c in self.policy.select(candidates, running, n)]
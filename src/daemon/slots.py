@@ -0,0 +1,62 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/slots.py
+# Description: Track which jobs hold the container slots, reconciled with the containers docker reports
+
+from typing import Dict, List, Tuple
+
+from daemon.docker_runner import DockerRunner
+from daemon.logger import info, warn
+
+# Docker states of containers that are done
+EXITED_STATES = ('exited', 'dead')
+
+
+class SlotManager:
+
+    def __init__(self):
+        """
+        Each running job holds a slot from when its runner is created until it is closed out or cancelled.
+        Docker is the source of truth for what is running, so reconcile with its containers once per check.
+        """
+        self.runners: Dict[int, DockerRunner] = {}
+        # Running containers with no runner, e.g. started outside the daemon, which still use the machine
+        self.num_untracked = 0
+
+    @property
+    def num_used(self) -> int:
+        return len(self.runners) + self.num_untracked
+
+    def free(self, num_slots: int) -> int:
+        """
+        Get the number of free slots
+        :param num_slots: The number of containers to run concurrently
+        :return: The number of jobs that can be started now
+        """
+        return max(0, num_slots - self.num_used)
+
+    def acquire(self, job_id: int, runner: DockerRunner) -> None:
+        self.runners[job_id] = runner
+
+    def release(self, job_id: int) -> DockerRunner | None:
+        return self.runners.pop(job_id, None)
+
+    def reconcile(self, containers: Dict[str, str]) -> Tuple[List[int], List[int]]:
+        """
+        Reconcile the runners with the containers docker reports. Exited containers do not hold a slot.
+        :param containers: The status of each container by name, e.g. {'strongsort-4-1f2e3d4c': 'running'}
+        :return: The ids of the jobs with no container, e.g. the video download failed, to close out as failed, and
+        the ids of the jobs with exited containers, to close out even if their exit was missed
+        """
+        tracked = {runner.container_name for runner in self.runners.values()}
+        untracked = [name for name, status in containers.items() if name not in tracked and status == 'running']
+        if untracked:
+            warn(f'Found {len(untracked)} running containers not started by the daemon: {untracked}')
+        self.num_untracked = len(untracked)
+
+        lost = [job_id for job_id, runner in self.runners.items() if runner.container_name not in containers]
+        for job_id in lost:
+            warn(f'Job {job_id} docker container {self.runners[job_id].container_name} not found')
+        exited = [job_id for job_id, runner in self.runners.items()
+                  if containers.get(runner.container_name) in EXITED_STATES]
+        info(f'Using {self.num_used} slots: {len(self.runners)} jobs and {self.num_untracked} untracked containers')
+        return lost, exited
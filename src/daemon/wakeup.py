@@ -0,0 +1,81 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/wakeup.py
+# Description: Listen for wakeups from the API on a UNIX datagram socket
+
+import asyncio
+import os
+import socket
+from pathlib import Path
+from typing import Callable, Dict
+
+from daemon.logger import info, warn, exception
+
+# Maximum size of a wakeup message
+MAX_MESSAGE_BYTES = 64
+
+
+class WakeupListener:
+
+    def __init__(self, path: Path, handlers: Dict[bytes, Callable[[], None]]):
+        """
+        Call a handler for each wakeup message received, e.g. {b'docker': docker_monitor.wake}. Messages are
+        read as soon as they arrive on the event loop; a burst of messages is read at once.
+        :param path: The socket path
+        :param handlers: The handler for each message
+        """
+        self._path = path
+        self._handlers = handlers
+        self._sock = None
+        self.received = 0
+
+    def start(self) -> bool:
+        """
+        Bind the socket and read it on the running event loop
+        :return: True if listening, False if the socket could not be bound and the daemon can only poll
+        """
+        try:
+            # A socket left by a daemon that did not shut down cleanly is replaced
+            if self._path.is_socket():
+                self._path.unlink()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind(self._path.as_posix())
+            # The API may run as another user
+            os.chmod(self._path, 0o666)
+        except OSError as e:
+            warn(f'Could not listen for wakeups on {self._path}: {e}')
+            return False
+        self._sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._read)
+        info(f'Listening for wakeups on {self._path}')
+        return True
+
+    def _read(self):
+        messages = set()
+        while True:
+            try:
+                messages.add(self._sock.recv(MAX_MESSAGE_BYTES))
+            except BlockingIOError:
+                break
+            except OSError as e:
+                exception(f'Error reading wakeups: {e}')
+                break
+            self.received += 1
+
+        for message in messages:
+            handler = self._handlers.get(message)
+            if handler:
+                handler()
+            else:
+                warn(f'Unknown wakeup {message}')
+
+    def stop(self):
+        if self._sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            self._path.unlink()
+        except OSError:
+            pass
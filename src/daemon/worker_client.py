@@ -0,0 +1,60 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: daemon/worker_client.py
+# Description: Identifies this daemon among the workers draining the queue, and keeps its job leases alive
+
+import asyncio
+import os
+import socket
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.job import init_db
+from app.job.lease import renew_leases, reclaim_expired, record_heartbeat, forget_workers
+from daemon.logger import info, warn
+from daemon.metrics import JOBS_RECLAIMED
+
+
+class WorkerClient:
+
+    def __init__(self, options: Dict[str, Any] | None = None) -> None:
+        """
+        Each daemon process is a worker. Workers claim jobs under a lease and renew the leases of their running
+        jobs with each heartbeat; the jobs of a worker that misses its heartbeats for lease_secs are queued again.
+        The id must be unique among the workers sharing a database and stable across restarts, so a restarted
+        worker only fails its own jobs and stops its own containers. Defaults to the hostname.
+        :param options: The worker options, e.g. lease_secs
+        """
+        options = options or {}
+        self.id = os.environ.get('WORKER_ID') or options.get('id') or socket.gethostname()
+        self.lease_secs = options.get('lease_secs', 300)
+        self._forget_after_secs = options.get('forget_after_secs', 86400)
+        self._started_at = datetime.utcnow()
+        info(f'Running as worker {self.id}')
+
+    async def run(self, database_path: Path, num_slots: int) -> (int, List[int]):
+        """
+        Record a heartbeat, renew the leases of this worker's running jobs and queue again the jobs of workers
+        whose leases expired. The database work runs in a thread so a busy database does not block the other
+        monitors.
+        :param database_path: The path to the database
+        :param num_slots: The number of jobs this worker runs concurrently
+        :return: The number of leases renewed and the ids of the jobs queued again
+        """
+        session_maker = init_db(database_path, reset=False)
+
+        def heartbeat() -> (int, List[int]):
+            with session_maker.begin() as db:
+                num_renewed = renew_leases(db, self.id, self.lease_secs)
+                record_heartbeat(db, self.id, socket.gethostname(), os.getpid(), num_slots, num_renewed,
+                                 self._started_at)
+            with session_maker.begin() as db:
+                reclaimed = reclaim_expired(db)
+                forget_workers(db, self._forget_after_secs)
+            return num_renewed, reclaimed
+
+        num_renewed, reclaimed = await asyncio.to_thread(heartbeat)
+        if reclaimed:
+            warn(f'Queued jobs {reclaimed} again as their worker stopped renewing their leases')
+            JOBS_RECLAIMED.inc(len(reclaimed))
+        return num_renewed, reclaimed
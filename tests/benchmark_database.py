@@ -0,0 +1,109 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/benchmark_database.py
+# Description: Benchmark the queue pick and status queries on a large job database
+# Run with PYTHONPATH=src python tests/benchmark_database.py --num-jobs 100000
+
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from deepsea_ai.database.job.misc import JobType, Status
+from sqlalchemy import text
+
+from app.job import JobLocal, init_db, bulk_add_jobs, query_job_status, count_jobs_by_status
+
+
+def populate(session_maker, num_jobs: int, chunk_size: int = 10000):
+    """
+    Add jobs that are mostly finished with the queued and running jobs at the end, as in a long running service
+    """
+    num_queued = max(1, num_jobs // 100)
+    num_running = 2
+    for start in range(0, num_jobs, chunk_size):
+        jobs, media = [], []
+        for i in range(start, min(start + chunk_size, num_jobs)):
+            if i >= num_jobs - num_queued:
+                status = Status.QUEUED
+            elif i >= num_jobs - num_queued - num_running:
+                status = Status.RUNNING
+            elif i % 50 == 0:
+                status = Status.FAILED
+            else:
+                status = Status.SUCCESS
+            jobs.append(dict(name=f"model-{i % 3} video{i}.mp4 job {i}", engine="mbari/strongsort-yolov5",
+                             model=f's3://localtrack/models/model-{i % 3}.pt', job_type=JobType.DOCKER))
+            media.append(dict(name=f"http://localhost:8090/video/video{i}.mp4", status=status))
+        with session_maker.begin() as db:
+            bulk_add_jobs(db, jobs, media)
+
+
+def queue_pick(db):
+    # As in daemon.docker_client.DockerClient.process
+    return db.query(JobLocal.id) \
+        .filter(JobLocal.status == Status.QUEUED, JobLocal.duplicate_of.is_(None)) \
+        .order_by(JobLocal.id) \
+        .limit(1) \
+        .scalar()
+
+
+def status_by_id(db, job_id: int):
+    job = db.query(JobLocal).filter(JobLocal.id == job_id).first()
+    return job.media[0].status
+
+
+def status_by_name(db, name: str):
+    job = db.query(JobLocal).filter(JobLocal.name == name).first()
+    return job.media[0].status
+
+
+def timed(session_maker, fn, repeat: int) -> float:
+    """
+    Median time in milliseconds to run fn in its own session
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with session_maker.begin() as db:
+            fn(db)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(num_jobs: int, repeat: int, db_path: Path, indexes: bool):
+    session_maker = init_db(db_path, reset=True)
+    engine = session_maker.kw['bind']
+    if not indexes:
+        with engine.begin() as conn:
+            for name in ('ix_media_status_job_id', 'ix_media_job_id', 'ix_job_name', 'ix_job_job_type_id',
+                         'ix_job_status_id'):
+                conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+    start = time.perf_counter()
+    populate(session_maker, num_jobs)
+    print(f'Added {num_jobs} jobs in {time.perf_counter() - start:.2f} seconds')
+
+    last_id = num_jobs
+    benchmarks = {
+        'queue pick': lambda db: queue_pick(db),
+        'status by id': lambda db: status_by_id(db, last_id),
+        'status by name': lambda db: status_by_name(db, f"model-{(last_id - 1) % 3} video{last_id - 1}.mp4 job {last_id - 1}"),
+        'status page': lambda db: query_job_status(db, after_id=num_jobs // 2, limit=100).all(),
+        'queued page': lambda db: query_job_status(db, status=Status.QUEUED, limit=100).all(),
+        'queue depth': lambda db: count_jobs_by_status(db),
+    }
+    print(f'{"query":<16}{"median ms":>10}')
+    for name, fn in benchmarks.items():
+        print(f'{name:<16}{timed(session_maker, fn, repeat):>10.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-jobs', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-indexes', action='store_true', help='Drop the indexes to compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        run(args.num_jobs, args.repeat, Path(temp_dir), not args.no_indexes)
@@ -0,0 +1,87 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/benchmark_serialization.py
+# Description: Benchmark encoding the status and job detail responses
+# Run with PYTHONPATH=src python tests/benchmark_serialization.py --num-jobs 1000
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from app.schemas import JobDetail, JobStatus, StatusPage
+
+
+def make_rows(num_jobs: int) -> list:
+    # As returned by app.job.query_job_status
+    return [(i, f"model-{i % 3} video{i}.mp4 job {i}", 'SUCCESS') for i in range(1, num_jobs + 1)]
+
+
+def make_detail() -> dict:
+    now = datetime.utcnow()
+    return dict(status='SUCCESS', last_updated=f"{now}", created_at=f"{now}", name="model-0 video1.mp4 job 1",
+                job_id=1, video="http://localhost:8090/video/video1.mp4", args="--iou-thres 0.5", model="model-0",
+                metadata={"camera": "i2MAP", "depth": 300}, processing_time_secs=17.4, num_tracks=2,
+                s3_path="s3://localtrack/output/video1.tar.gz")
+
+
+def dict_page(rows: list) -> bytes:
+    # Dicts through the FastAPI default encoder and JSONResponse
+    content = {"jobs": [{"id": i, "name": n, "status": s} for i, n, s in rows], "next_cursor": None}
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def streamed_page(rows: list) -> bytes:
+    # Chunks of json.dumps per job, as streamed before the schemas
+    chunks = [b'{"jobs": [']
+    for i, (job_id, job_name, job_status) in enumerate(rows):
+        prefix = b', ' if i > 0 else b''
+        chunks.append(prefix + json.dumps({"id": job_id, "name": job_name, "status": job_status}).encode())
+    chunks.append(b'], "next_cursor": null}')
+    return b''.join(chunks)
+
+
+def schema_page(rows: list) -> bytes:
+    return ORJSONResponse(StatusPage(jobs=[JobStatus(*row) for row in rows])).body
+
+
+def timed(fn, repeat: int) -> float:
+    """
+    Median time in milliseconds to run fn
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(num_jobs: int, repeat: int):
+    rows = make_rows(num_jobs)
+    detail = make_detail()
+    assert json.loads(dict_page(rows)) == json.loads(streamed_page(rows)) == json.loads(schema_page(rows))
+
+    benchmarks = {
+        'page dicts': lambda: dict_page(rows),
+        'page streamed': lambda: streamed_page(rows),
+        'page schema': lambda: schema_page(rows),
+        'detail dict': lambda: JSONResponse(jsonable_encoder(detail)).body,
+        'detail schema': lambda: ORJSONResponse(JobDetail(**detail)).body,
+    }
+    print(f'{num_jobs} jobs per page')
+    print(f'{"response":<16}{"median ms":>10}')
+    for name, fn in benchmarks.items():
+        print(f'{name:<16}{timed(fn, repeat):>10.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-jobs', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    run(args.num_jobs, args.repeat)
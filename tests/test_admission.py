@@ -0,0 +1,138 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_admission.py
+# Description: Test the limits on queued jobs
+
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media
+from app.job.admission import AdmissionLimits, check_admission, mean_processing_secs
+from app.utils.exceptions import TooManyJobsException
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+
+def new_job(i: int, model: str = 'model-a', client: str | int | None = None, duplicate_of: int | None = None) -> dict:
+    return dict(name=f"job {i}", engine="test docker runner", model=model, job_type=JobType.DOCKER,
+                metadata_json={'client': client} if client else {}, duplicate_of=duplicate_of)
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+
+    # Two completed jobs that took 100 and 200 seconds, then four queued jobs: three for model-a from
+    # client alice, and one for model-b from client bob, plus a queued job attached to the first queued job
+    jobs = [new_job(0), new_job(1)] + [new_job(i, client='alice') for i in range(2, 5)] + \
+           [new_job(5, model='model-b', client='bob'), new_job(6, client='alice', duplicate_of=3)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(len(jobs))]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+        for job_id, secs in ((1, 100.), (2, 200.)):
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            update_media(db, job, job.media[0].name, Status.SUCCESS, metadata={'processing_time_secs': secs})
+    yield
+
+
+def check(limits: AdmissionLimits, jobs: list):
+    with session_maker.begin() as db:
+        check_admission(db, limits, jobs)
+
+
+def test_no_limits(startup):
+    """
+    Test that jobs are admitted without limits
+    """
+    check(AdmissionLimits(), [new_job(i) for i in range(100)])
+
+
+def test_total_limit(startup):
+    """
+    Test the limit on all queued jobs, which does not count attached jobs
+    """
+    check(AdmissionLimits(max_queued=5), [new_job(10)])
+    check(AdmissionLimits(max_queued=5), [new_job(10), new_job(11, duplicate_of=3)])
+    with pytest.raises(TooManyJobsException) as e:
+        check(AdmissionLimits(max_queued=5), [new_job(10), new_job(11)])
+    assert e.value._limit == 'total'
+    # One queued job must start first, at the mean of 150 seconds per job
+    assert e.value._retry_after_secs == 150
+
+
+def test_retry_after_uses_slots(startup):
+    """
+    Test that the wait is shared across the concurrent processes
+    """
+    with pytest.raises(TooManyJobsException) as e:
+        check(AdmissionLimits(max_queued=1, num_procs=2), [new_job(10)])
+    # Four queued jobs must start first on two processes
+    assert e.value._retry_after_secs == 300
+
+
+def test_model_limit(startup):
+    """
+    Test the limit on queued jobs for each model; the wait includes jobs for other models ahead in the queue
+    """
+    limits = AdmissionLimits(max_queued_per_model=3)
+    check(limits, [new_job(10, model='model-b')])
+    with pytest.raises(TooManyJobsException) as e:
+        check(limits, [new_job(10, model='model-a')])
+    assert e.value._limit == 'model'
+    assert e.value._retry_after_secs == 150
+
+    with pytest.raises(TooManyJobsException) as e:
+        check(AdmissionLimits(max_queued_per_model=1), [new_job(10, model='model-b')])
+    # All four queued jobs must start before the model-b job
+    assert e.value._retry_after_secs == 600
+
+
+def test_client_limit(startup):
+    """
+    Test the limit on queued jobs for each client identified in the metadata
+    """
+    limits = AdmissionLimits(max_queued_per_client=3)
+    check(limits, [new_job(10, client='bob')])
+    check(limits, [new_job(10)])
+    with pytest.raises(TooManyJobsException) as e:
+        check(limits, [new_job(10, client='alice')])
+    assert e.value._limit == 'client'
+
+
+def test_numeric_client_limit(startup):
+    """
+    Test the client limit counts the jobs of a client whose id is a number in the metadata
+    """
+    limits = AdmissionLimits(max_queued_per_client=2)
+    check(limits, [new_job(10, client=7), new_job(11, client=7)])
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, [new_job(10, client=7), new_job(11, client=7)],
+                      [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in (10, 11)])
+    with pytest.raises(TooManyJobsException) as e:
+        check(limits, [new_job(12, client=7)])
+    assert e.value._limit == 'client'
+    # The same id sent as text is the same client
+    with pytest.raises(TooManyJobsException):
+        check(limits, [new_job(12, client='7')])
+
+
+def test_default_processing_time():
+    """
+    Test the default processing time is used before any job has completed
+    """
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, [new_job(0)], [dict(name="vid0.mp4", status=Status.QUEUED)])
+        assert mean_processing_secs(db) is None
+        with pytest.raises(TooManyJobsException) as e:
+            check_admission(db, AdmissionLimits(max_queued=1, default_processing_secs=60), [new_job(1)])
+    assert e.value._retry_after_secs == 60
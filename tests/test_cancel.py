@@ -0,0 +1,129 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_cancel.py
+# Description: Test cancelling queued and running jobs, and the jobs attached to them
+
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi.testclient import TestClient
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media, CANCELLED
+from app.job.dedup import update_followers
+from daemon.docker_client import DockerClient
+from daemon.scheduler import Scheduler
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global client, session_maker
+
+
+@pytest.fixture
+def startup():
+    global client, session_maker
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+
+    # Jobs 1 and 2 are queued, job 3 is running with jobs 4 and 5 attached to it
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER,
+                 duplicate_of=3 if i > 3 else None)
+            for i in range(1, 6)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.RUNNING if i >= 3 else Status.QUEUED) for i in range(1, 6)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+
+    from app.main import app
+    client = TestClient(app)
+    yield
+
+
+def get_job(job_id: int) -> (str, int | None):
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+        return job.status, job.duplicate_of
+
+
+def test_cancel_queued(startup):
+    """
+    Test a cancelled queued job is not run, and finished or unknown jobs cannot be cancelled
+    """
+    response = client.delete("/jobs/1")
+    assert response.status_code == 200
+    assert response.json()['previous_status'] == Status.QUEUED
+    assert get_job(1) == (CANCELLED, None)
+    assert client.get("/status_by_id/1").json()['status'] == CANCELLED
+    assert Scheduler().next_jobs(session_maker, 10) == [2]
+
+    assert client.delete("/jobs/1").status_code == 409
+    assert client.delete("/jobs/99").status_code == 404
+
+
+def test_cancel_promotes_follower(startup):
+    """
+    Test the jobs attached to a cancelled running job are queued again, attached to the oldest of them
+    """
+    response = client.delete("/jobs/3")
+    assert response.status_code == 200
+    assert response.json()['promoted'] == 4
+    assert get_job(3) == (CANCELLED, None)
+    assert get_job(4) == (Status.QUEUED, None)
+    assert get_job(5) == (Status.QUEUED, 4)
+    assert Scheduler().next_jobs(session_maker, 10) == [1, 2, 4]
+
+
+def test_cancel_follower(startup):
+    """
+    Test a cancelled attached job keeps its status when the job it is attached to completes
+    """
+    assert client.delete("/jobs/5").status_code == 200
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 3).one()
+        update_media(db, job, job.media[0].name, Status.SUCCESS)
+        assert [f.id for f in update_followers(db, job, Status.SUCCESS)] == [4]
+    assert get_job(4) == (Status.SUCCESS, 3)
+    assert get_job(5) == (CANCELLED, 3)
+
+
+def test_cancel_by_filter(startup):
+    """
+    Test cancelling the jobs that match a filter
+    """
+    assert client.delete("/jobs").status_code == 422
+    assert client.delete("/jobs", params={"status": Status.SUCCESS}).status_code == 422
+
+    response = client.delete("/jobs", params={"status": Status.QUEUED})
+    assert response.status_code == 200
+    assert [c['job_id'] for c in response.json()['jobs']] == [1, 2]
+
+    # Cancelling a job and its attached jobs together cancels them all
+    response = client.delete("/jobs", params={"job_id": [3, 4, 5]})
+    assert [c['job_id'] for c in response.json()['jobs']] == [3, 4, 5]
+    assert [get_job(job_id)[0] for job_id in range(1, 6)] == [CANCELLED] * 5
+    assert client.get("/status", params={"status": CANCELLED}).json()['jobs'][-1]['id'] == 5
+
+
+class StoppedRunner:
+    container_name = 'strongsort-test'
+    stopped = False
+
+    async def clean(self):
+        self.stopped = True
+
+
+def test_stop_cancelled(startup):
+    """
+    Test the daemon stops the container of a cancelled running job and frees its runner
+    """
+    docker_client = DockerClient()
+    runners = {3: StoppedRunner(), 4: StoppedRunner()}
+    docker_client._slots.runners.update(runners)
+
+    assert client.delete("/jobs/3").status_code == 200
+    asyncio.run(docker_client.stop_cancelled(session_maker))
+    assert runners[3].stopped and not runners[4].stopped
+    assert list(docker_client._slots.runners) == [4]
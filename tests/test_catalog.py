@@ -0,0 +1,88 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_catalog.py
+# Description: Test the in-memory model catalog
+
+from pathlib import Path
+
+import pytest
+
+from app.catalog import ModelCatalog
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global num_listings, objects
+
+
+def fake_lister(bucket: str, prefix: str, suffixes: list[str]) -> list[dict]:
+    global num_listings
+    num_listings += 1
+    return objects
+
+
+@pytest.fixture
+def startup():
+    global num_listings, objects
+    num_listings = 0
+    objects = [{"Key": "models/MegadetectorTest.pt", "ETag": '"1"'},
+               {"Key": "models/yolov5x_mbay_benthic_model.tar.gz", "ETag": '"2"'}]
+    yield
+
+
+def test_models_served_from_memory(startup):
+    """
+    Test that the bucket is listed once and then served from memory while fresh
+    """
+    catalog = ModelCatalog('localtrack', 'models', ttl_secs=60, lister=fake_lister)
+    for _ in range(10):
+        models = catalog.models()
+
+    assert num_listings == 1
+    assert models == {"MegadetectorTest": "s3://localtrack/models/MegadetectorTest.pt",
+                      "yolov5x_mbay_benthic_model": "s3://localtrack/models/yolov5x_mbay_benthic_model.tar.gz"}
+    stats = catalog.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 9
+    assert stats['num_models'] == 2
+
+
+def test_stale_catalog_refreshes(startup):
+    """
+    Test that a stale catalog is listed again if it is not refreshed in the background
+    """
+    catalog = ModelCatalog('localtrack', 'models', ttl_secs=0, lister=fake_lister)
+    catalog.models()
+    catalog.models()
+    assert num_listings == 2
+    assert catalog.stats()['misses'] == 2
+
+
+def test_change_detection(startup):
+    """
+    Test that the catalog is only rebuilt when the listing changes
+    """
+    global objects
+    catalog = ModelCatalog('localtrack', 'models', ttl_secs=60, lister=fake_lister)
+    assert catalog.refresh()
+    assert not catalog.refresh()
+
+    objects = objects + [{"Key": "models/new.pt", "ETag": '"3"'}]
+    assert catalog.refresh()
+    assert 'new' in catalog.models()
+    assert catalog.stats()['changes'] == 2
+
+
+def test_refresh_error_keeps_catalog(startup):
+    """
+    Test that a failed listing keeps serving the last good catalog
+    """
+    catalog = ModelCatalog('localtrack', 'models', ttl_secs=60, lister=fake_lister)
+    catalog.refresh()
+
+    def failing_lister(bucket, prefix, suffixes):
+        raise ConnectionError('minio offline')
+
+    catalog._lister = failing_lister
+    assert not catalog.refresh()
+    assert len(catalog.models()) == 2
+    assert catalog.stats()['errors'] == 1
@@ -0,0 +1,153 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_container_events.py
+# Description: Test finished containers are found from the docker events instead of polling each container
+
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+from daemon.container_events import ContainerEvents, parse_event, JOB_ID_LABEL
+from daemon.docker_client import DockerClient
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+
+def container_event(action: str, name: str, job_id: int | None = None, **attributes) -> dict:
+    if job_id is not None:
+        attributes[JOB_ID_LABEL] = str(job_id)
+    return {'Type': 'container', 'Action': action, 'status': action,
+            'Actor': {'ID': 'abc123', 'Attributes': {'name': name, 'image': 'mbari/strongsort-yolov5', **attributes}}}
+
+
+class FakeRunner:
+
+    def __init__(self, container_name: str):
+        self.container_name = container_name
+        self.polls = 0
+
+    async def is_running(self) -> bool:
+        self.polls += 1
+        return True
+
+    def is_successful(self) -> bool:
+        return False
+
+    async def failed(self) -> bool:
+        return False
+
+
+def test_parse_event():
+    """
+    Test only the start, die and oom events of the strongsort containers are parsed
+    """
+    event = parse_event(container_event('die', 'strongsort-20231006', job_id=7, exitCode='137'), 'strongsort')
+    assert event.action == 'die' and event.job_id == 7 and event.exit_code == 137
+    assert parse_event(container_event('start', 'strongsort-20231006'), 'strongsort').job_id is None
+    assert parse_event(container_event('die', 'minio'), 'strongsort') is None
+    assert parse_event(container_event('exec_die', 'strongsort-20231006'), 'strongsort') is None
+    assert parse_event({'Type': 'network', 'Action': 'connect', 'Actor': {}}, 'strongsort') is None
+
+
+def test_finished_from_events():
+    """
+    Test running containers are not polled once the events are followed, and a die event finishes its job
+    """
+    client = DockerClient()
+    woken = []
+    client.on_exit = lambda: woken.append(True)
+    runners = {job_id: FakeRunner(f'strongsort-{job_id}') for job_id in range(1, 11)}
+    client._slots.runners.update(runners)
+
+    # Polled until the events are followed
+    assert asyncio.run(client.finished_jobs()) == []
+    assert all(runner.polls == 1 for runner in runners.values())
+
+    client._events.connected = True
+    client._on_events_connected()
+    assert woken
+    asyncio.run(client.finished_jobs())  # Catches up on any exits missed while the events were not followed
+    for _ in range(10):
+        assert asyncio.run(client.finished_jobs()) == []
+    assert all(runner.polls == 2 for runner in runners.values())
+
+    woken.clear()
+    client._events._publish(container_event('die', 'strongsort-3', job_id=3, exitCode='0'))
+    client._events._publish(container_event('oom', 'strongsort-5', job_id=5))
+    client._events._publish(container_event('die', 'strongsort-5', job_id=5, exitCode='137'))
+    # Without the label the container name is matched
+    client._events._publish(container_event('die', 'strongsort-8', exitCode='1'))
+    client._events._publish(container_event('die', 'strongsort-99', job_id=99, exitCode='0'))
+    assert len(woken) == 4
+    assert sorted(asyncio.run(client.finished_jobs())) == [3, 5, 8]
+    assert 5 in client._oom
+
+    # A container started again is running
+    client._events._publish(container_event('start', 'strongsort-8', job_id=8))
+    assert sorted(asyncio.run(client.finished_jobs())) == [3, 5]
+    assert all(runner.polls == 2 for runner in runners.values())
+
+
+class FakeSubscriber:
+
+    def __init__(self, events: list):
+        self._events = events
+
+    async def get(self):
+        if self._events:
+            return self._events.pop(0)
+        # The stream stays open
+        await asyncio.Event().wait()
+
+
+class FakeEvents:
+    """
+    Docker events whose first stream ends, as when the docker daemon restarts
+    """
+
+    def __init__(self):
+        self._streams = [[container_event('die', 'strongsort-1', job_id=1, exitCode='0'), None],
+                         [container_event('die', 'strongsort-2', job_id=2, exitCode='0')]]
+        self.stopped = 0
+
+    def subscribe(self, **params):
+        assert 'filters' in params
+        return FakeSubscriber(self._streams.pop(0))
+
+    async def stop(self):
+        self.stopped += 1
+
+
+class FakeDocker:
+
+    def __init__(self):
+        self.events = FakeEvents()
+
+    async def version(self):
+        return {}
+
+
+def test_reconnect():
+    """
+    Test the subscription reconnects when the events stream ends, and reports each connection
+    """
+    docker_session = SimpleNamespace(docker=FakeDocker())
+
+    async def run():
+        received = []
+        connected = []
+        events = ContainerEvents(docker_session, 'strongsort', received.append, lambda: connected.append(True))
+        events.start()
+        for _ in range(300):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert events.connected
+        events.stop()
+        await asyncio.sleep(0)
+        return received, connected
+
+    received, connected = asyncio.run(run())
+    assert [event.job_id for event in received] == [1, 2]
+    assert len(connected) == 2
+    assert docker_session.docker.events.stopped == 2
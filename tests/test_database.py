@@ -7,13 +7,17 @@ from datetime import datetime
 from pathlib import Path
 import os
 import signal
+import sqlite3
 
 import pytest
+from sqlalchemy import text, func
 from sqlalchemy.orm import Session
 from deepsea_ai.database.job.database_helper import get_num_failed, get_num_completed, json_b64_decode, json_b64_encode, \
     get_status
 from deepsea_ai.database.job.misc import JobType, Status, job_hash
-from app.job import JobLocal, MediaLocal, PydanticJobWithMedia2, init_db, update_media
+from app.job import JobLocal, MediaLocal, PydanticJobWithMedia2, init_db, update_media, query_job_status, \
+    bulk_add_jobs, count_jobs_by_status, get_metadata, get_results
+from app.job.database import migrate_metadata
 
 from app import logger
 
@@ -77,20 +81,46 @@ def test_pydantic_sqlalchemy(startup):
             "model": 'yolov5x-mbay-benthic',
             "name": "Dive 1377 with yolov5x-mbay-benthic",
             'metadata_b64': json_b64_encode(fake_metadata),
+            "metadata_json": None,
             "job_type": JobType.DOCKER,
+            "content_key": None,
+            "idempotency_key": None,
+            "duplicate_of": None,
+            "priority": 0,
+            "status": Status.QUEUED,
+            "num_media": 2,
+            "num_queued": 1,
+            "num_running": 0,
+            "num_failed": 0,
+            "num_success": 1,
+            "num_cancelled": 0,
+            "worker_id": None,
+            "lease_expires": None,
             "media": [
                 {"name": "vid1.mp4",
                  "id": 1,
                  'metadata_b64': None,
+                 "metadata_json": None,
                  "job_id": 1,
                  "status": Status.QUEUED,
+                 "s3_path": None,
+                 "num_tracks": None,
+                 "processing_time_secs": None,
+                 "hardware": None,
+                 "size_bytes": None,
                  "updatedAt": None
                  },
                 {"name": "vid2.mp4",
                  "id": 2,
                  "job_id": 1,
                  'metadata_b64': None,
+                 "metadata_json": None,
                  "status": Status.SUCCESS,
+                 "s3_path": None,
+                 "num_tracks": None,
+                 "processing_time_secs": None,
+                 "hardware": None,
+                 "size_bytes": None,
                  "updatedAt": None
                  }
             ],
@@ -257,5 +287,194 @@ def test_update_one_media(startup):
         assert media_updated.updatedAt > media.createdAt
 
 
+def add_jobs(db: Session, statuses: list[str]):
+    """
+    Helper function to add a job with a single media for each status
+    """
+    for i, status in enumerate(statuses):
+        job = JobLocal(engine="test docker runner",
+                       name=f"job {i}",
+                       model='yolov5x-mbay-benthic',
+                       job_type=JobType.DOCKER)
+        job.media = [MediaLocal(name=f"vid{i}.mp4", status=status)]
+        db.add(job)
+
+
+def test_status_pages(startup):
+    """
+    Test that the job status is paged by job id and matches the status derived from the media
+    """
+    with session_maker.begin() as db:
+        add_jobs(db, [Status.RUNNING, Status.FAILED, Status.SUCCESS, Status.QUEUED])
+
+    with session_maker.begin() as db:
+        first_page = query_job_status(db, limit=3).all()
+        assert [row.id for row in first_page] == [1, 2, 3]
+        second_page = query_job_status(db, after_id=first_page[-1].id, limit=3).all()
+        assert [row.id for row in second_page] == [4, 5]
+
+        for job in db.query(JobLocal).all():
+            row = query_job_status(db, after_id=job.id - 1, limit=1).one()
+            assert row.status == get_status(job)
+
+
+def test_status_filter(startup):
+    """
+    Test that the job status can be filtered by status and model
+    """
+    with session_maker.begin() as db:
+        add_jobs(db, [Status.RUNNING, Status.FAILED, Status.SUCCESS, Status.QUEUED])
+
+    with session_maker.begin() as db:
+        assert [row.id for row in query_job_status(db, status=Status.QUEUED)] == [1, 5]
+        assert [row.id for row in query_job_status(db, status=Status.FAILED)] == [3]
+        assert query_job_status(db, model='missing').count() == 0
+
+
+def test_bulk_add_jobs(startup):
+    """
+    Test that jobs added in bulk get the ids of their rows and their media
+    """
+    jobs = [dict(name=f"bulk {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(100)]
+    media = [dict(name=f"bulk{i}.mp4", status=Status.QUEUED) for i in range(100)]
+    with session_maker.begin() as db:
+        job_ids = bulk_add_jobs(db, jobs, media)
+
+    assert job_ids == list(range(2, 102))
+    with session_maker.begin() as db:
+        for i, job_id in enumerate(job_ids):
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            assert job.name == f"bulk {i}"
+            assert [m.name for m in job.media] == [f"bulk{i}.mp4"]
+
+
+def test_migrate_existing_database(tmp_path):
+    """
+    Test that a database created without the indexes is migrated in place and opened in WAL mode
+    """
+    db = tmp_path / 'sqlite_job_cache_docker.db'
+    with sqlite3.connect(db) as conn:
+        conn.execute('CREATE TABLE job (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, engine VARCHAR NOT NULL, '
+                     'job_type VARCHAR NOT NULL, "createdAt" TIMESTAMP, args VARCHAR, metadata_b64 VARCHAR, '
+                     'model VARCHAR NOT NULL)')
+        conn.execute('CREATE TABLE media (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, status VARCHAR NOT NULL, '
+                     'metadata_b64 VARCHAR, "createdAt" TIMESTAMP, "updatedAt" TIMESTAMP, job_id INTEGER)')
+        conn.execute("INSERT INTO job VALUES (1, 'old job', 'engine', 'DOCKER', NULL, NULL, ?, 'model')",
+                     (json_b64_encode(fake_metadata),))
+        conn.execute("INSERT INTO media VALUES (1, 'old.mp4', 'QUEUED', ?, NULL, NULL, 1)",
+                     (json_b64_encode({'num_tracks': 7, 's3_path': 's3://localtrack/tracks/old.tar.gz', 'a': 1}),))
+
+    migrated = init_db(tmp_path, reset=False)
+    with sqlite3.connect(db) as conn:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        plan = ' '.join(str(row) for row in conn.execute("EXPLAIN QUERY PLAN SELECT job_id FROM media "
+                                                         "WHERE status = 'QUEUED' ORDER BY job_id LIMIT 1"))
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert {'ix_media_status_job_id', 'ix_media_job_id', 'ix_job_name', 'ix_job_job_type_id'} <= indexes
+    assert 'ix_media_status_job_id' in plan
+    with migrated.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.name == 'old job').one()
+        assert job.media[0].status == Status.QUEUED
+        assert (job.status, job.num_media, job.num_queued) == (Status.QUEUED, 1, 1)
+        media = job.media[0]
+        assert (job.metadata_b64, media.metadata_b64) == (None, None)
+        assert job.metadata_json == fake_metadata
+        assert media.metadata_json == {'a': 1}
+        assert (media.num_tracks, media.s3_path) == (7, 's3://localtrack/tracks/old.tar.gz')
+
+
+def test_job_status_in_sync(startup):
+    """
+    Test that the stored job status and media counters follow every media change
+    """
+    def stored(job_id: int):
+        with session_maker.begin() as db:
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            assert job.status == get_status(job)
+            return job.status, job.num_media, job.num_queued, job.num_running, job.num_failed, job.num_success
+
+    assert stored(1) == (Status.QUEUED, 2, 1, 0, 0, 1)
+
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        update_media(db, job, "vid1.mp4", Status.RUNNING)
+    assert stored(1) == (Status.RUNNING, 2, 0, 1, 0, 1)
+
+    # Media changed directly rather than with update_media
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        job.media[0].status = Status.FAILED
+    assert stored(1) == (Status.FAILED, 2, 0, 0, 1, 1)
+
+    # Media added by job id alone
+    with session_maker.begin() as db:
+        db.add(MediaLocal(name="vid3.mp4", status=Status.QUEUED, job_id=1))
+    assert stored(1) == (Status.QUEUED, 3, 1, 0, 1, 1)
+
+    with session_maker.begin() as db:
+        jobs = [dict(name="bulk", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)]
+        job_id, = bulk_add_jobs(db, jobs, [dict(name="bulk.mp4", status=Status.QUEUED)])
+    assert stored(job_id) == (Status.QUEUED, 1, 1, 0, 0, 0)
+
+    with session_maker.begin() as db:
+        assert count_jobs_by_status(db) == {Status.QUEUED: 2}
+        plan = ' '.join(str(row) for row in db.execute(text('EXPLAIN QUERY PLAN ' + str(
+            query_job_status(db, status=Status.QUEUED, limit=100).statement.compile(
+                compile_kwargs={"literal_binds": True})))))
+        assert 'ix_job_status_id' in plan
+
+
+def test_metadata_columns(startup):
+    """
+    Test that results are stored in their own columns and can be aggregated in SQL, and that base64 metadata
+    written by an earlier version is still read
+    """
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        assert get_metadata(job) == fake_metadata
+        assert get_results(job.media[0]) == {'s3_path': None, 'num_tracks': None, 'processing_time_secs': None,
+                                            'hardware': None}
+
+        add_jobs(db, [Status.RUNNING, Status.RUNNING, Status.RUNNING])
+        db.flush()
+        for job_id, model, num_tracks, secs in [(2, 'a', 10, 30.0), (3, 'a', 5, 90.5), (4, 'b', 2, 60.0)]:
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            job.model = model
+            update_media(db, job, job.media[0].name, Status.SUCCESS,
+                         metadata={'num_tracks': num_tracks, 'processing_time_secs': secs, 'client': 'test'})
+
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 3).one()
+        assert get_metadata(job.media[0]) == {'client': 'test'}
+        assert get_results(job.media[0])['num_tracks'] == 5
+
+        assert db.query(func.sum(MediaLocal.num_tracks)).scalar() == 17
+        slowest = db.query(JobLocal.model, func.max(MediaLocal.processing_time_secs)) \
+            .join(MediaLocal, MediaLocal.job_id == JobLocal.id) \
+            .group_by(JobLocal.model) \
+            .order_by(JobLocal.model) \
+            .all()
+        assert slowest == [('a', 90.5), ('b', 60.0), ('yolov5x-mbay-benthic', None)]
+
+
+def test_migrate_undecodable_metadata(tmp_path):
+    """
+    Test that base64 metadata that cannot be decoded is left in place rather than replaced with empty metadata
+    """
+    migrated = init_db(tmp_path, reset=False)
+    rows = [dict(id=1, name='bad', metadata_b64='not base64 json'),
+            dict(id=2, name='good', metadata_b64=json_b64_encode(fake_metadata))]
+    with migrated.begin() as db:
+        db.execute(JobLocal.__table__.insert(), [dict(engine='test', job_type=JobType.DOCKER, model='test', **row)
+                                                for row in rows])
+        assert migrate_metadata(db.connection(), JobLocal.__table__) == 1
+
+    with migrated.begin() as db:
+        bad, good = db.query(JobLocal).order_by(JobLocal.id)
+        assert (bad.metadata_b64, bad.metadata_json) == ('not base64 json', None)
+        assert (good.metadata_b64, good.metadata_json) == (None, fake_metadata)
+
+
 if __name__ == '__main__':
     test_pydantic_sqlalchemy()
@@ -0,0 +1,175 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_dedup.py
+# Description: Test reuse of results for identical video, model and args submissions
+
+import asyncio
+import sqlite3
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+from app.job import JobLocal, MediaLocal, init_db, get_metadata, set_metadata
+from app.job.dedup import normalize_args, content_key, find_duplicates, update_followers, get_orphaned_followers
+import daemon.docker_client
+from daemon.docker_client import DockerClient
+from daemon.worker_client import WorkerClient
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker, db_path
+
+video_url = 'http://localhost:8090/video/V4361_20211006T162656Z_h265_10frame.mp4'
+model_s3 = 's3://localtrack/models/MegadetectorTest.pt'
+
+
+@pytest.fixture
+def startup():
+    global session_maker, db_path
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    yield
+
+
+def add_job(db, key: str, status: str, duplicate_of: int = None, metadata: dict = None) -> JobLocal:
+    job = JobLocal(engine="test docker runner",
+                   name=f"job {key} {status}",
+                   model=model_s3,
+                   job_type=JobType.DOCKER,
+                   content_key=key,
+                   duplicate_of=duplicate_of)
+    media = MediaLocal(name=video_url, status=status)
+    set_metadata(media, metadata or {})
+    job.media = [media]
+    db.add(job)
+    db.flush()
+    return job
+
+
+def test_normalize_args():
+    """
+    Test that equivalent arguments normalize to the same string
+    """
+    assert normalize_args('--conf-thres=0.01 --iou-thres=0.4 --agnostic-nms --imgsz 640') == \
+           normalize_args('--imgsz 640 --agnostic-nms --iou-thres 0.4  --conf-thres 0.01')
+    assert normalize_args('--conf-thres=0.01') != normalize_args('--conf-thres=0.02')
+    assert normalize_args(None) == ''
+
+
+def test_content_key():
+    """
+    Test that the content key changes with the video content, model and args
+    """
+    key = content_key(video_url, '"abc"', 100, model_s3, '--conf-thres=0.01 --max-det 100')
+    assert key == content_key(video_url, '"abc"', 100, model_s3, '--max-det=100 --conf-thres 0.01')
+    assert key != content_key(video_url, '"def"', 100, model_s3, '--conf-thres=0.01 --max-det 100')
+    assert key != content_key(video_url, '"abc"', 100, 's3://localtrack/models/other.pt', '--conf-thres=0.01')
+
+
+def test_find_duplicates_prefers_completed(startup):
+    """
+    Test that a completed job is found before an in flight job, and failed jobs are not found
+    """
+    with session_maker.begin() as db:
+        add_job(db, 'a', Status.SUCCESS, metadata={'s3_path': 's3://localtrack/tracks/a.tar.gz', 'num_tracks': 3})
+        add_job(db, 'a', Status.QUEUED)
+        add_job(db, 'b', Status.RUNNING)
+        add_job(db, 'c', Status.FAILED)
+
+    with session_maker.begin() as db:
+        duplicates = find_duplicates(db, ['a', 'b', 'c', 'd'])
+        assert duplicates['a'].status == Status.SUCCESS
+        assert duplicates['a'].s3_path == 's3://localtrack/tracks/a.tar.gz'
+        assert duplicates['a'].num_tracks == 3
+        assert duplicates['b'].status == Status.RUNNING
+        assert 'c' not in duplicates
+        assert 'd' not in duplicates
+
+
+def test_update_followers(startup):
+    """
+    Test that attached jobs share the status and results of the job they are attached to
+    """
+    with session_maker.begin() as db:
+        primary = add_job(db, 'a', Status.RUNNING)
+        follower = add_job(db, 'a', Status.RUNNING, duplicate_of=primary.id, metadata={'client': 'test'})
+        follower_id = follower.id
+        followers = update_followers(db, primary, Status.SUCCESS, {'s3_path': 's3://localtrack/tracks/a.tar.gz'})
+        assert [f.id for f in followers] == [follower_id]
+
+    with session_maker.begin() as db:
+        follower = db.query(JobLocal).filter(JobLocal.id == follower_id).one()
+        assert follower.media[0].status == Status.SUCCESS
+        assert get_metadata(follower.media[0]) == {'client': 'test'}
+        assert follower.media[0].s3_path == 's3://localtrack/tracks/a.tar.gz'
+
+
+def test_orphaned_followers(startup):
+    """
+    Test that attached jobs still in flight after the job they are attached to completed are found
+    """
+    with session_maker.begin() as db:
+        primary = add_job(db, 'a', Status.SUCCESS)
+        orphan_id = add_job(db, 'a', Status.RUNNING, duplicate_of=primary.id).id
+        add_job(db, 'a', Status.SUCCESS, duplicate_of=primary.id)
+        running = add_job(db, 'b', Status.RUNNING)
+        add_job(db, 'b', Status.RUNNING, duplicate_of=running.id)
+
+    with session_maker.begin() as db:
+        assert [job.id for job in get_orphaned_followers(db)] == [orphan_id]
+
+
+class FinishedRunner:
+    container_name = 'strongsort-1-aaaaaaaa'
+    finished = False
+
+    async def is_running(self) -> bool:
+        return False
+
+    def is_successful(self) -> bool:
+        return True
+
+    def get_results(self):
+        return 's3://localtrack/tracks/a.tar.gz', None, 3, 10.0
+
+    async def fini(self):
+        self.finished = True
+
+
+def test_notify_after_commit(startup, monkeypatch):
+    """
+    Test the job and its attached jobs are committed before they are notified, so the database is not locked
+    while the notifications are sent
+    """
+    with session_maker.begin() as db:
+        primary = add_job(db, 'a', Status.RUNNING)
+        primary.worker_id = 'worker-1'
+        follower_id = add_job(db, 'a', Status.RUNNING, duplicate_of=primary.id).id
+        primary_id = primary.id
+
+    notified = []
+
+    def post(url, files):
+        # Fails straight away if the daemon still holds the write lock
+        with sqlite3.connect(db_path / 'sqlite_job_cache_docker.db', timeout=0.1) as conn:
+            conn.execute("UPDATE job SET priority = priority + 1")
+            status = conn.execute("SELECT status FROM job WHERE id = ?", (primary_id,)).fetchone()[0]
+        notified.append(status)
+        return SimpleNamespace(status_code=200, text='')
+
+    monkeypatch.setattr(daemon.docker_client.requests, 'post', post)
+    monkeypatch.setenv('NOTIFY_URL', 'http://localhost:8090/notify')
+    docker_client = DockerClient(worker_client=WorkerClient({'id': 'worker-1'}))
+    runner = FinishedRunner()
+    docker_client._slots.runners[primary_id] = runner
+    asyncio.run(docker_client.check(db_path))
+
+    assert notified == [Status.SUCCESS, Status.SUCCESS]
+    assert runner.finished
+    with session_maker.begin() as db:
+        follower = db.query(JobLocal).filter(JobLocal.id == follower_id).one()
+        assert follower.status == Status.SUCCESS
@@ -0,0 +1,87 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_executor.py
+# Description: Test running database work off the event loop
+
+import asyncio
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+from app.job import JobLocal, init_db, bulk_add_jobs
+from app.job.executor import DatabaseExecutor
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker, db_path
+
+
+@pytest.fixture
+def startup():
+    global session_maker, db_path
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    yield
+
+
+def add_job_once(name: str) -> bool:
+    """
+    Add a job unless one with the same name exists, like a submission checking for duplicates
+    """
+    with session_maker.begin() as db:
+        if db.query(JobLocal).filter(JobLocal.name == name).first():
+            return False
+        # Widen the window between the check and the insert
+        time.sleep(0.05)
+        bulk_add_jobs(db, [dict(name=name, engine="test docker runner", model='yolov5x-mbay-benthic',
+                                job_type=JobType.DOCKER)],
+                      [dict(name="vid.mp4", status=Status.QUEUED)])
+        return True
+
+
+def test_locked_database_does_not_block_loop(startup):
+    """
+    Test that a write waiting on a database lock held by another process leaves the event loop free
+    """
+    executor = DatabaseExecutor()
+    db_file = db_path / 'sqlite_job_cache_docker.db'
+
+    async def run():
+        # Hold the write lock from another connection, as the daemon would
+        lock = sqlite3.connect(db_file, isolation_level=None)
+        lock.execute('BEGIN IMMEDIATE')
+        write = asyncio.ensure_future(executor.write(add_job_once, 'job 1'))
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.02)
+            ticks += 1
+        assert not write.done()
+        lock.execute('COMMIT')
+        lock.close()
+        return ticks, await write
+
+    ticks, added = asyncio.run(run())
+    executor.shutdown()
+    assert ticks == 10
+    assert added
+
+
+def test_writes_are_serialized(startup):
+    """
+    Test that concurrent duplicate submissions add only one job
+    """
+    executor = DatabaseExecutor()
+
+    async def run():
+        return await asyncio.gather(*[executor.write(add_job_once, 'job 1') for _ in range(4)])
+
+    added = asyncio.run(run())
+    executor.shutdown()
+    assert added.count(True) == 1
+    with session_maker.begin() as db:
+        assert db.query(JobLocal).count() == 1
@@ -0,0 +1,73 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_feed.py
+# Description: Test the job status change feed
+
+import asyncio
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+from app.job import JobLocal, JobEvent, init_db, update_media, bulk_add_jobs
+from app.job.feed import JobFeed
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(2)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(2)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+    yield
+
+
+def update_job(job_id: int, status: str, metadata: dict = None):
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+        update_media(db, job, job.media[0].name, status, metadata=metadata)
+
+
+def test_events_recorded(startup):
+    """
+    Test that queueing and updating a job records its status transitions
+    """
+    update_job(1, Status.RUNNING)
+    update_job(1, Status.SUCCESS, {'num_tracks': 2, 'processing_time_secs': 17.4})
+
+    with session_maker.begin() as db:
+        events = db.query(JobEvent).filter(JobEvent.job_id == 1).order_by(JobEvent.id).all()
+        assert [e.status for e in events] == [Status.QUEUED, Status.RUNNING, Status.SUCCESS]
+        assert events[-1].num_tracks == 2
+        assert events[-1].processing_time_secs == 17.4
+
+
+def test_feed_publishes_new_events(startup):
+    """
+    Test that subscribers receive only new events for the jobs they subscribed to
+    """
+    feed = JobFeed(session_maker, poll_secs=0.01)
+
+    async def listen():
+        async with feed.listen([2]) as subscription:
+            await asyncio.to_thread(update_job, 1, Status.RUNNING)
+            await asyncio.to_thread(update_job, 2, Status.RUNNING)
+            event = await subscription.get(timeout=5)
+            no_event = await subscription.get(timeout=0.1)
+        await feed.stop()
+        return event, no_event
+
+    event, no_event = asyncio.run(listen())
+    assert event['job_id'] == 2
+    assert event['status'] == Status.RUNNING
+    assert no_event is None
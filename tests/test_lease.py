@@ -0,0 +1,180 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_lease.py
+# Description: Test daemon workers claim jobs atomically, and the jobs of a worker that stops are queued again
+
+import asyncio
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi.testclient import TestClient
+
+from app.job import JobLocal, init_db, bulk_add_jobs
+from app.job.lease import claim_jobs, renew_leases, reclaim_expired, holds_lease
+from daemon.docker_client import DockerClient
+from daemon.worker_client import WorkerClient
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker, db_path
+
+NUM_JOBS = 20
+NUM_WORKERS = 4
+
+
+@pytest.fixture
+def startup():
+    global session_maker, db_path
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(1, NUM_JOBS + 1)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(1, NUM_JOBS + 1)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+    yield
+
+
+def get_jobs() -> dict:
+    with session_maker.begin() as db:
+        return {job.id: (job.status, job.worker_id) for job in db.query(JobLocal)}
+
+
+def test_claim_race(startup):
+    """
+    Test workers racing for the same queued jobs never claim the same job twice, and drain the queue
+    """
+    barrier = threading.Barrier(NUM_WORKERS)
+    claims = {}
+
+    def work(worker_id: str):
+        claimed = []
+        barrier.wait()
+        while True:
+            # Every worker chooses the same oldest jobs
+            with session_maker.begin() as db:
+                job_ids = [job_id for job_id, in db.query(JobLocal.id).filter(JobLocal.status == Status.QUEUED)
+                           .order_by(JobLocal.id).limit(4)]
+            if not job_ids:
+                break
+            with session_maker.begin() as db:
+                claimed += [job.id for job in claim_jobs(db, job_ids, worker_id, lease_secs=300, max_jobs=2)]
+        claims[worker_id] = claimed
+
+    threads = [threading.Thread(target=work, args=(f'worker-{i}',)) for i in range(NUM_WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f'\nJobs claimed by each worker: {[len(claimed) for claimed in claims.values()]}')
+    all_claimed = [job_id for claimed in claims.values() for job_id in claimed]
+    assert sorted(all_claimed) == list(range(1, NUM_JOBS + 1))
+    jobs = get_jobs()
+    for worker_id, claimed in claims.items():
+        assert all(jobs[job_id] == (Status.RUNNING, worker_id) for job_id in claimed)
+
+
+def test_reclaim(startup):
+    """
+    Test the running jobs of a worker that stops renewing its leases are queued again for another worker, and
+    the first worker no longer holds them
+    """
+    with session_maker.begin() as db:
+        claim_jobs(db, [1, 2], 'dead', lease_secs=-1)
+        claim_jobs(db, [3], 'alive', lease_secs=-1)
+    with session_maker.begin() as db:
+        assert renew_leases(db, 'alive', lease_secs=300) == 1
+    with session_maker.begin() as db:
+        assert reclaim_expired(db) == [1, 2]
+    with session_maker.begin() as db:
+        assert reclaim_expired(db) == []
+
+    jobs = get_jobs()
+    assert jobs[1] == (Status.QUEUED, None) and jobs[2] == (Status.QUEUED, None)
+    assert jobs[3] == (Status.RUNNING, 'alive')
+
+    with session_maker.begin() as db:
+        assert [job.id for job in claim_jobs(db, [1, 2, 3], 'alive', lease_secs=300)] == [1, 2]
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        assert holds_lease(job, 'alive') and not holds_lease(job, 'dead')
+        assert job.lease_expires > datetime.utcnow()
+
+
+def test_heartbeat(startup):
+    """
+    Test the worker heartbeat renews the leases of its jobs and is listed by the API
+    """
+    worker = WorkerClient({'id': 'gpu-box-1', 'lease_secs': 300})
+    with session_maker.begin() as db:
+        claim_jobs(db, [1, 2], worker.id, lease_secs=-1)
+        claim_jobs(db, [3], 'gpu-box-2', lease_secs=-1)
+
+    num_renewed, reclaimed = asyncio.run(worker.run(db_path, num_slots=4))
+    assert num_renewed == 2
+    assert reclaimed == [3]
+
+    from app.main import app
+    client = TestClient(app)
+    workers = client.get("/workers").json()['workers']
+    assert [w['id'] for w in workers] == ['gpu-box-1']
+    assert workers[0]['num_slots'] == 4 and workers[0]['num_running'] == 2
+    assert workers[0]['heartbeat_age_secs'] < 60
+
+
+class StaleContainer(dict):
+    """
+    A container left by the worker before it restarted
+    """
+    removed = False
+
+    def __init__(self):
+        super().__init__(Names=['/strongsort-1-aaaaaaaa'], State='exited', Labels={})
+        self.id = 'abc123'
+
+    async def delete(self):
+        self.removed = True
+
+
+class FakeDocker:
+
+    def __init__(self):
+        self.containers = self
+        self.stale = StaleContainer()
+
+    async def version(self):
+        return {}
+
+    async def list(self, **kwargs):
+        return [self.stale]
+
+
+def test_startup_own_jobs(startup):
+    """
+    Test a restarted worker fails only its own running jobs and the jobs attached to them, and removes its
+    containers. Jobs attached to a job on another worker are left to follow it.
+    """
+    with session_maker.begin() as db:
+        claim_jobs(db, [1], 'gpu-box-1', lease_secs=300)
+        claim_jobs(db, [2], 'gpu-box-2', lease_secs=300)
+        for follower_id, primary_id in [(3, 1), (4, 2)]:
+            job = db.query(JobLocal).filter(JobLocal.id == follower_id).one()
+            job.duplicate_of = primary_id
+            job.media[0].status = Status.RUNNING
+
+    docker = FakeDocker()
+    client = DockerClient(SimpleNamespace(docker=docker), WorkerClient({'id': 'gpu-box-1'}))
+    asyncio.run(client.startup(db_path))
+
+    jobs = get_jobs()
+    assert jobs[1] == (Status.FAILED, 'gpu-box-1') and jobs[3][0] == Status.FAILED
+    assert jobs[2] == (Status.RUNNING, 'gpu-box-2') and jobs[4][0] == Status.RUNNING
+    assert docker.stale.removed
@@ -0,0 +1,81 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_metrics.py
+# Description: Test the Prometheus metrics for the API
+
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry, REGISTRY
+
+from app.catalog import ModelCatalog
+from app.job import init_db, bulk_add_jobs
+from app.metrics import MetricsMiddleware, ApiCollector, register_collector
+from app.utils.video_checker import VideoChecker
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    statuses = [Status.QUEUED, Status.QUEUED, Status.RUNNING, Status.SUCCESS]
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(len(statuses))]
+    media = [dict(name=f"vid{i}.mp4", status=s) for i, s in enumerate(statuses)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+    yield
+
+
+def test_request_latency_by_route():
+    """
+    Test that request latency is recorded by route template rather than by the requested path
+    """
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/jobs/{job_id}")
+    async def read_job(job_id: int):
+        return {"job_id": job_id}
+
+    client = TestClient(app)
+    labels = {'method': 'GET', 'route': '/jobs/{job_id}', 'status': '200'}
+    before = REGISTRY.get_sample_value('localtrack_api_request_duration_seconds_count', labels) or 0
+    for job_id in range(3):
+        assert client.get(f'/jobs/{job_id}').status_code == 200
+    assert client.get('/missing').status_code == 404
+
+    assert REGISTRY.get_sample_value('localtrack_api_request_duration_seconds_count', labels) == before + 3
+    assert REGISTRY.get_sample_value('localtrack_api_request_duration_seconds_count',
+                                     {'method': 'GET', 'route': 'unmatched', 'status': '404'}) >= 1
+
+
+def test_queue_depth(startup):
+    """
+    Test that the queue depth by status and the cache counters are collected on scrape
+    """
+    catalog = ModelCatalog('localtrack', 'models', ttl_secs=60,
+                           lister=lambda bucket, prefix, suffixes: [{"Key": "models/MegadetectorTest.pt", "ETag": '"1"'}])
+    catalog.models()
+    registry = CollectorRegistry()
+    register_collector(ApiCollector(session_maker, catalog, VideoChecker()), registry)
+
+    assert registry.get_sample_value('localtrack_jobs', {'status': Status.QUEUED}) == 2
+    assert registry.get_sample_value('localtrack_jobs', {'status': Status.RUNNING}) == 1
+    assert registry.get_sample_value('localtrack_jobs', {'status': Status.SUCCESS}) == 1
+    assert registry.get_sample_value('localtrack_models') == 1
+    assert registry.get_sample_value('localtrack_model_catalog_misses_total') == 1
+
+    # Registering again replaces the previous collector rather than failing on duplicate names
+    register_collector(ApiCollector(session_maker, catalog, VideoChecker()), registry)
+    assert registry.get_sample_value('localtrack_models') == 1
@@ -78,6 +78,17 @@ def test_predict_invalid_model(startup, shutdown):
     assert response.status_code == 404
 
 
+def test_predict_batch_invalid_size(startup, shutdown):
+    info('Test that a prediction batch with no videos or too many videos returns a 422 status code')
+    from app.main import MAX_PREDICT_BATCH
+    for videos in ([], [test_video_url] * (MAX_PREDICT_BATCH + 1)):
+        response = client.post('/predict/batch', json={
+            'model': 'yolov5sfoobar',
+            'videos': videos,
+        })
+        assert response.status_code == 422
+
+
 @pytest.mark.skipif(not DAEMON_AVAILABLE, reason="This test is excluded because it requires a daemon process")
 def test_predict_sans_metadata(startup, shutdown):
     info('Test that the prediction for yolov5 returns a 200 status code')
@@ -0,0 +1,108 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_results.py
+# Description: Test downloading the track results of a job
+
+import os
+from pathlib import Path
+
+import boto3
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi.testclient import TestClient
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global client
+
+results = bytes(range(256)) * 1000
+results_key = 'tracks/test_results/output/video.tracks.tar.gz'
+
+
+@pytest.fixture
+def startup():
+    global client
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['MINIO_ENDPOINT_URL'] = 'http://localhost:7000'
+    os.environ['MINIO_ACCESS_KEY'] = 'localtrack'
+    os.environ['MINIO_SECRET_KEY'] = 'ReplaceMePassword'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+
+    s3 = boto3.client('s3',
+                      endpoint_url=os.environ['MINIO_ENDPOINT_URL'],
+                      aws_secret_access_key=os.environ['MINIO_SECRET_KEY'],
+                      aws_access_key_id=os.environ['MINIO_ACCESS_KEY'])
+    s3.put_object(Bucket='localtrack', Key=results_key, Body=results)
+
+    # A completed job with results, a queued job, and a completed job whose results were deleted
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(3)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(3)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+        for job_id, key in ((1, results_key), (3, 'tracks/test_results/missing.tracks.tar.gz')):
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            update_media(db, job, job.media[0].name, Status.SUCCESS, metadata={'s3_path': f's3://localtrack/{key}'})
+
+    from app.main import app
+    client = TestClient(app)
+    yield
+    s3.delete_object(Bucket='localtrack', Key=results_key)
+
+
+def test_results(startup):
+    """
+    Test the results are streamed whole, in ranges and only when changed
+    """
+    response = client.get('/jobs/1/results')
+    assert response.status_code == 200
+    assert response.content == results
+    assert response.headers['content-length'] == str(len(results))
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert 'video.tracks.tar.gz' in response.headers['content-disposition']
+    etag = response.headers['etag']
+
+    response = client.get('/jobs/1/results', headers={'Range': 'bytes=1000-1999'})
+    assert response.status_code == 206
+    assert response.content == results[1000:2000]
+    assert response.headers['content-range'] == f'bytes 1000-1999/{len(results)}'
+
+    response = client.get('/jobs/1/results', headers={'Range': f'bytes={len(results)}-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(results)}'
+
+    response = client.get('/jobs/1/results', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+    response = client.get('/jobs/1/results', headers={'If-Match': '"stale"'})
+    assert response.status_code == 412
+
+    response = client.head('/jobs/1/results')
+    assert response.status_code == 200
+    assert response.headers['content-length'] == str(len(results))
+    assert response.headers['etag'] == etag
+
+
+def test_results_redirect(startup):
+    """
+    Test the redirect to a presigned url
+    """
+    response = client.get('/jobs/1/results?redirect=true', follow_redirects=False)
+    assert response.status_code == 307
+    location = response.headers['location']
+    assert results_key in location
+    assert 'X-Amz-Signature' in location
+
+
+def test_results_unavailable(startup):
+    """
+    Test jobs without results
+    """
+    assert client.get('/jobs/2/results').status_code == 409
+    assert client.get('/jobs/3/results').status_code == 404
+    assert client.get('/jobs/99/results').status_code == 404
@@ -0,0 +1,155 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_retention.py
+# Description: Test archiving finished jobs and compacting the job cache database
+
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from sqlalchemy import func
+
+from app.job import JobLocal, MediaLocal, JobEvent, init_db, bulk_add_jobs
+from app.job.retention import archive_jobs, read_archive, prune_events, compact, database_stats
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+    yield
+
+
+def add_jobs(statuses: list, days_old: float = 0) -> list:
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(len(statuses))]
+    media = [dict(name=f"vid{i}.mp4", status=s) for i, s in enumerate(statuses)]
+    with session_maker.begin() as db:
+        job_ids = bulk_add_jobs(db, jobs, media)
+        created = datetime.utcnow() - timedelta(days=days_old)
+        db.query(JobLocal).filter(JobLocal.id.in_(job_ids)).update({JobLocal.createdAt: created},
+                                                                   synchronize_session=False)
+        db.query(JobEvent).filter(JobEvent.job_id.in_(job_ids)).update({JobEvent.createdAt: created},
+                                                                      synchronize_session=False)
+    return job_ids
+
+
+def test_archive_finished_jobs(startup, tmp_path):
+    """
+    Test that only old finished jobs are moved to the archive, with their media
+    """
+    old_ids = add_jobs([Status.SUCCESS, Status.FAILED, Status.QUEUED, Status.RUNNING], days_old=40)
+    new_ids = add_jobs([Status.SUCCESS], days_old=1)
+
+    # A finished job with an attached job still in flight is kept
+    primary_id, follower_id = add_jobs([Status.SUCCESS, Status.QUEUED], days_old=40)
+    with session_maker.begin() as db:
+        db.query(JobLocal).filter(JobLocal.id == follower_id).update({JobLocal.duplicate_of: primary_id})
+
+    num_archived = archive_jobs(session_maker, tmp_path, datetime.utcnow() - timedelta(days=30), batch_size=1)
+    assert num_archived == 2
+
+    archived = [job for f in tmp_path.glob('*.ndjson.gz') for job in read_archive(f)]
+    assert [job['id'] for job in archived] == old_ids[:2]
+    assert [job['status'] for job in archived] == [Status.SUCCESS, Status.FAILED]
+    assert [m['name'] for m in archived[0]['media']] == ['vid0.mp4']
+
+    with session_maker.begin() as db:
+        remaining = [job_id for job_id, in db.query(JobLocal.id).order_by(JobLocal.id)]
+        assert remaining == old_ids[2:] + new_ids + [primary_id, follower_id]
+        assert db.query(MediaLocal).filter(MediaLocal.job_id.in_(old_ids[:2])).count() == 0
+        assert db.query(JobEvent).filter(JobEvent.job_id.in_(old_ids[:2])).count() == 0
+
+
+def test_archived_ids_not_reused(startup, tmp_path):
+    """
+    Test that the ids of archived jobs and pruned events are not handed out again, so clients holding them never
+    get another job or miss new events
+    """
+    old_ids = add_jobs([Status.SUCCESS, Status.FAILED, Status.SUCCESS], days_old=40)
+    with session_maker.begin() as db:
+        last_event_id = db.query(func.max(JobEvent.id)).scalar()
+    assert archive_jobs(session_maker, tmp_path, datetime.utcnow() - timedelta(days=30)) == 3
+    prune_events(session_maker, datetime.utcnow())
+
+    job_id, = add_jobs([Status.QUEUED])
+    assert job_id > max(old_ids)
+    with session_maker.begin() as db:
+        assert db.query(func.min(JobEvent.id)).scalar() > last_event_id
+
+
+def test_migrate_autoincrement(tmp_path):
+    """
+    Test that job tables created without AUTOINCREMENT are rebuilt with their rows and indexes
+    """
+    db = tmp_path / 'sqlite_job_cache_docker.db'
+    with sqlite3.connect(db) as conn:
+        conn.execute('CREATE TABLE job_event (id INTEGER PRIMARY KEY, job_id INTEGER NOT NULL, '
+                     'status VARCHAR NOT NULL, num_tracks INTEGER, processing_time_secs FLOAT, "createdAt" TIMESTAMP)')
+        conn.executemany("INSERT INTO job_event (id, job_id, status) VALUES (?, ?, 'QUEUED')", [(1, 1), (2, 2)])
+
+    migrated = init_db(tmp_path, reset=False)
+    with sqlite3.connect(db) as conn:
+        tables = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall())
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'AUTOINCREMENT' in tables['job_event'] and 'AUTOINCREMENT' in tables['job']
+    assert 'job_event_rebuilt' not in tables
+    assert 'ix_job_event_job_id' in indexes
+    with migrated.begin() as db:
+        assert [e.job_id for e in db.query(JobEvent).order_by(JobEvent.id)] == [1, 2]
+        db.query(JobEvent).filter(JobEvent.id == 2).delete()
+        db.add(JobEvent(job_id=3, status=Status.QUEUED))
+    with migrated.begin() as db:
+        assert db.query(func.max(JobEvent.id)).scalar() == 3
+
+
+def test_prune_events(startup):
+    """
+    Test that only old change feed events are deleted
+    """
+    add_jobs([Status.SUCCESS, Status.SUCCESS], days_old=10)
+    add_jobs([Status.QUEUED], days_old=0)
+    assert prune_events(session_maker, datetime.utcnow() - timedelta(days=7)) == 2
+    with session_maker.begin() as db:
+        assert db.query(JobEvent).count() == 1
+
+
+def test_compact(startup, tmp_path):
+    """
+    Test that free pages left by archiving are returned to the file system
+    """
+    add_jobs([Status.SUCCESS] * 5000, days_old=40)
+
+    # The first call converts the database to incremental vacuum
+    compact(session_maker)
+    assert database_stats(session_maker)['incremental_vacuum']
+
+    archive_jobs(session_maker, tmp_path, datetime.utcnow() - timedelta(days=30))
+    free_pages = database_stats(session_maker)['free_pages']
+    assert free_pages > 0
+    assert compact(session_maker, max_pages=free_pages) == free_pages
+    assert database_stats(session_maker)['free_pages'] == 0
+
+
+def test_database_stats(startup, tmp_path):
+    """
+    Test that the database size and row counts are reported
+    """
+    add_jobs([Status.SUCCESS, Status.QUEUED], days_old=40)
+    archive_jobs(session_maker, tmp_path, datetime.utcnow() - timedelta(days=30))
+
+    stats = database_stats(session_maker, tmp_path)
+    assert stats['rows'] == {'job': 1, 'media': 1, 'job_event': 1}
+    assert stats['file_bytes'] > 0
+    assert stats['page_count'] * stats['page_size'] >= stats['file_bytes'] - stats['wal_bytes']
+    assert len(stats['archive']['files']) == 1
+    assert stats['archive']['bytes'] > 0
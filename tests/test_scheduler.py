@@ -0,0 +1,169 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_scheduler.py
+# Description: Test the scheduling policies, and simulate the latency of each policy for a mixed workload
+
+import random
+import statistics
+from dataclasses import dataclass
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+from app.job import init_db, bulk_add_jobs, JobLocal, update_media
+from daemon.scheduler import Candidate, Scheduler, FifoPolicy, PriorityPolicy, ShortestJobFirstPolicy, \
+    FairSharePolicy
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+NUM_SLOTS = 2
+
+
+@dataclass
+class SimJob:
+    job_id: int
+    client: str
+    arrival: float
+    secs: float
+    priority: int = 0
+    start: float | None = None
+    end: float | None = None
+
+
+def workload(seed: int = 42) -> list:
+    """
+    A batch of 200 long videos submitted at once, and 20 short interactive videos submitted every 5 minutes
+    with a higher priority
+    """
+    rng = random.Random(seed)
+    jobs = [SimJob(i, 'batch', 0., rng.uniform(300, 900)) for i in range(200)]
+    jobs += [SimJob(200 + i, 'interactive', 60. + 300 * i, rng.uniform(30, 120), priority=1) for i in range(20)]
+    return jobs
+
+
+def simulate(policy, jobs: list, num_slots: int = NUM_SLOTS) -> list:
+    """
+    Run the jobs on num_slots processes, choosing the next jobs with the policy whenever a process is free
+    :return: The jobs with their start and end times
+    """
+    pending = sorted(jobs, key=lambda j: j.arrival)
+    queued, running, done = [], [], []
+    t = 0.
+    while pending or queued or running:
+        while pending and pending[0].arrival <= t:
+            queued.append(pending.pop(0))
+        for job in [j for j in running if j.end <= t]:
+            running.remove(job)
+            done.append(job)
+
+        free = num_slots - len(running)
+        if free > 0 and queued:
+            candidates = [Candidate(job_id=j.job_id, priority=j.priority, expected_secs=j.secs, client=j.client,
+                                    queued_secs=t - j.arrival) for j in queued]
+            recent = [Candidate(job_id=j.job_id, client=j.client)
+                      for j in running + done if j.start >= t - policy.window_secs or j in running]
+            for candidate in policy.select(candidates, recent, free):
+                job = next(j for j in queued if j.job_id == candidate.job_id)
+                queued.remove(job)
+                job.start, job.end = t, t + job.secs
+                running.append(job)
+
+        # Advance to the next arrival or completion
+        events = [j.end for j in running] + ([pending[0].arrival] if pending else [])
+        if not events:
+            break
+        t = min(events)
+    return done
+
+
+def latency(jobs: list, client: str | None = None) -> list:
+    return sorted(j.end - j.arrival for j in jobs if client is None or j.client == client)
+
+
+def test_fifo():
+    candidates = [Candidate(job_id=3), Candidate(job_id=1), Candidate(job_id=2)]
+    assert [c.job_id for c in FifoPolicy().select(candidates, [], 2)] == [1, 2]
+
+
+def test_priority():
+    candidates = [Candidate(job_id=1), Candidate(job_id=2, priority=2), Candidate(job_id=3, priority=2)]
+    assert [c.job_id for c in PriorityPolicy().select(candidates, [], 3)] == [2, 3, 1]
+
+    # Waiting two aging periods raises a job above the higher priority jobs
+    candidates[0].queued_secs = 1200
+    assert [c.job_id for c in PriorityPolicy(aging_secs=600).select(candidates, [], 1)] == [1]
+
+
+def test_shortest_job_first():
+    candidates = [Candidate(job_id=1, expected_secs=600), Candidate(job_id=2, expected_secs=60),
+                  Candidate(job_id=3, expected_secs=60)]
+    assert [c.job_id for c in ShortestJobFirstPolicy().select(candidates, [], 3)] == [2, 3, 1]
+
+
+def test_fair_share():
+    candidates = [Candidate(job_id=i, client='a') for i in range(1, 6)] + [Candidate(job_id=6, client='b')]
+    policy = FairSharePolicy()
+    # Client a has a job running, so client b goes first, then a takes the remaining slots
+    assert [c.job_id for c in policy.select(candidates, [Candidate(job_id=0, client='a')], 3)] == [6, 1, 2]
+
+    # With twice the weight client a gets two slots for each slot of client b
+    candidates += [Candidate(job_id=7, client='b'), Candidate(job_id=8, client='b')]
+    policy = FairSharePolicy(weights={'a': 2})
+    assert [c.job_id for c in policy.select(candidates, [], 6)] == [1, 6, 2, 3, 7, 4]
+
+
+def test_simulation():
+    """
+    Simulate a long batch and a trickle of short interactive jobs under each policy
+    """
+    results = {}
+    for name, policy in (('fifo', FifoPolicy()),
+                         ('priority', PriorityPolicy()),
+                         ('sjf', ShortestJobFirstPolicy()),
+                         ('fair_share', FairSharePolicy())):
+        done = simulate(policy, workload())
+        assert len(done) == 220
+        results[name] = {client: latency(done, client) for client in ('batch', 'interactive', None)}
+
+    print(f'\n{"policy":<12}{"client":<13}{"mean min":>10}{"p50 min":>10}{"p90 min":>10}{"max min":>10}')
+    for name, by_client in results.items():
+        for client, secs in by_client.items():
+            p90 = secs[int(0.9 * (len(secs) - 1))]
+            print(f'{name:<12}{client or "all":<13}{statistics.fmean(secs) / 60:>10.1f}'
+                  f'{statistics.median(secs) / 60:>10.1f}{p90 / 60:>10.1f}{secs[-1] / 60:>10.1f}')
+
+    def mean(name, client):
+        return statistics.fmean(results[name][client])
+
+    # Interactive jobs wait behind the whole batch with fifo, and not with the other policies
+    assert mean('fifo', 'interactive') > 10 * mean('priority', 'interactive')
+    assert mean('fifo', 'interactive') > 10 * mean('sjf', 'interactive')
+    assert mean('fifo', 'interactive') > 10 * mean('fair_share', 'interactive')
+    # Shortest job first minimizes the mean latency
+    assert mean('sjf', None) < mean('fifo', None)
+
+
+def test_scheduler():
+    """
+    Test the scheduler loads the queued jobs with their priority and client from the database
+    """
+    # As defined in .env.dev
+    session_maker = init_db(Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data', reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER,
+                 metadata_json={'client': client}, priority=priority)
+            for i, (client, priority) in enumerate([('a', 0), ('a', 0), ('a', 5), ('b', 0), ('a', 0)])]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(len(jobs))]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        update_media(db, job, job.media[0].name, Status.RUNNING)
+
+    assert Scheduler().next_jobs(session_maker, 2) == [2, 3]
+    assert Scheduler({'policy': 'priority'}).next_jobs(session_maker, 2) == [3, 2]
+    # Client a has a job running
+    assert Scheduler({'policy': 'fair_share'}).next_jobs(session_maker, 2) == [4, 2]
+    assert Scheduler({'policy': 'sjf'}).next_jobs(session_maker, 1) == [2]
+
+    with pytest.raises(ValueError):
+        Scheduler({'policy': 'random'})
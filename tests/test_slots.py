@@ -0,0 +1,134 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_slots.py
+# Description: Test the daemon fills every free container slot in one check and reconciles the slots with docker
+
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+
+import daemon.docker_client
+from app.job import JobLocal, init_db, bulk_add_jobs
+from daemon.docker_client import DockerClient
+from daemon.docker_runner import DockerRunner
+from daemon.slots import SlotManager
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker, db_path
+
+NUM_JOBS = 6
+NUM_PROCS = 4
+
+# The containers docker reports, by name
+containers = {}
+
+
+@pytest.fixture
+def startup(monkeypatch, tmp_path):
+    global session_maker, db_path
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    os.environ['TEMP_DIR'] = tmp_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(1, NUM_JOBS + 1)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(1, NUM_JOBS + 1)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+
+    containers.clear()
+    monkeypatch.setattr(daemon.docker_client, 'DockerRunner', StartedRunner)
+    yield
+    os.environ.pop('TEMP_DIR')
+
+
+class StartedRunner(DockerRunner):
+    """
+    A runner that starts its container without downloading the video or running docker
+    """
+
+    async def run(self, has_gpu: bool = False):
+        await asyncio.sleep(0.01)
+        containers[self.container_name] = 'running'
+
+
+class FakeDocker:
+
+    def __init__(self):
+        self.containers = self
+
+    async def list(self, **kwargs):
+        return [{'Names': [f'/{name}'], 'State': status, 'Labels': {}} for name, status in containers.items()]
+
+
+def process(client: DockerClient) -> int:
+    return asyncio.run(client.process(has_gpu=False, num_procs=NUM_PROCS, database_path=db_path,
+                                      root_bucket='localtrack', track_prefix='tracks',
+                                      s3_track_config='s3://localtrack/models/track-config/strong_sort_benthic.yaml'))
+
+
+def running_jobs() -> list:
+    with session_maker.begin() as db:
+        return [job_id for job_id, in db.query(JobLocal.id).filter(JobLocal.status == Status.RUNNING)]
+
+
+def test_fill_slots(startup):
+    """
+    Test one check starts a job in every free slot, with a unique container for each
+    """
+    client = DockerClient(SimpleNamespace(docker=FakeDocker()))
+    assert process(client) == NUM_PROCS
+    assert sorted(running_jobs()) == [1, 2, 3, 4]
+    assert len(containers) == NUM_PROCS
+    assert all(name.startswith(f'strongsort-{job_id}-') for job_id, name in zip(range(1, 5), sorted(containers)))
+
+    # No free slots until a job finishes
+    assert process(client) == 0
+
+    # Exited containers do not hold a slot once their job is closed out
+    name = client._slots.runners[2].container_name
+    containers[name] = 'exited'
+    client._slots.release(2)
+    assert process(client) == 1
+    assert sorted(running_jobs()) == [1, 2, 3, 4, 5]
+
+
+def test_reconcile():
+    """
+    Test running containers the daemon did not start hold a slot, and jobs with no container are found
+    """
+    slots = SlotManager()
+    slots.acquire(1, SimpleNamespace(container_name='strongsort-1-aaaaaaaa'))
+    slots.acquire(2, SimpleNamespace(container_name='strongsort-2-bbbbbbbb'))
+    slots.acquire(3, SimpleNamespace(container_name='strongsort-3-cccccccc'))
+    lost, exited = slots.reconcile({'strongsort-1-aaaaaaaa': 'running',
+                                    'strongsort-3-cccccccc': 'dead',
+                                    'strongsort-20231006120000': 'running',
+                                    'strongsort-20231005120000': 'exited'})
+    assert lost == [2]
+    assert exited == [3]
+    assert slots.num_untracked == 1
+    assert slots.free(5) == 1
+    assert slots.free(4) == 0
+
+
+def test_missed_exit(startup):
+    """
+    Test a container that exits without a die event, e.g. before the events stream started, is still finished
+    """
+    client = DockerClient(SimpleNamespace(docker=FakeDocker()))
+    process(client)
+    client._events.connected = True
+    client._poll_all = False
+    assert asyncio.run(client.finished_jobs()) == []
+
+    name = client._slots.runners[3].container_name
+    containers[name] = 'exited'
+    asyncio.run(client.reconcile())
+    assert asyncio.run(client.finished_jobs()) == [3]
@@ -0,0 +1,176 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_stats.py
+# Description: Test the processing time statistics and the start and completion estimates
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from sqlalchemy import event
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media
+from app.job.stats import StatsService
+from app.job.status_cache import StatusCache
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+GB = 1000 ** 3
+
+
+def new_job(i: int, model: str = 'model-a', args: str = '--iou-thres 0.5', duplicate_of: int | None = None) -> dict:
+    return dict(name=f"job {i}", engine="test docker runner", model=model, args=args, job_type=JobType.DOCKER,
+                duplicate_of=duplicate_of)
+
+
+def complete(db, job_id: int, secs: float, hardware: str = 'x86_64 1 gpu'):
+    job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+    update_media(db, job, job.media[0].name, Status.SUCCESS,
+                 metadata={'processing_time_secs': secs, 'hardware': hardware})
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    session_maker = init_db(db_path, reset=True)
+
+    # Completed jobs for model-a: 1 GB in 100 seconds and 2 GB in 200 seconds on a gpu, 1 GB in 1000 seconds on a cpu,
+    # and an attached job that shares the processing time of the first. One completed job for model-b in 50 seconds.
+    jobs = [new_job(0), new_job(1), new_job(2), new_job(3, duplicate_of=1), new_job(4, model='model-b')]
+    sizes = [GB, 2 * GB, GB, GB, None]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED, size_bytes=size) for i, size in enumerate(sizes)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+        complete(db, 1, 100.)
+        complete(db, 2, 200.)
+        complete(db, 3, 1000., hardware='x86_64 cpu')
+        complete(db, 4, 100.)
+        complete(db, 5, 50.)
+    yield
+
+
+def test_model_stats(startup):
+    """
+    Test the statistics are grouped by hardware, normalized by size and do not count attached jobs
+    """
+    stats = StatsService(session_maker).model_stats('model-a')
+    assert [(s.hardware, s.num_jobs) for s in stats] == [('x86_64 1 gpu', 2), ('x86_64 cpu', 1)]
+    gpu = stats[0]
+    assert gpu.args == '--iou-thres 0.5'
+    assert gpu.mean_secs == 150.
+    assert gpu.secs_per_gb == 100.
+    assert gpu.jobs_per_hour == 24.
+    assert StatsService(session_maker).model_stats('model-c') == []
+
+
+def test_recent_jobs_only(startup):
+    """
+    Test that only the most recent jobs are kept for each group
+    """
+    stats = StatsService(session_maker, num_recent=1).model_stats('model-a')
+    assert [(s.hardware, s.mean_secs) for s in stats] == [('x86_64 1 gpu', 200.), ('x86_64 cpu', 1000.)]
+
+
+def test_expected_secs(startup):
+    """
+    Test the processing time estimate falls back from model and args, to model, to any model, to the default
+    """
+    service = StatsService(session_maker, default_processing_secs=42.)
+    # (100 + 200 + 1000) seconds for 4 GB
+    assert service.expected_secs('model-a', '--iou-thres 0.5', 2 * GB) == pytest.approx(650.)
+    assert service.expected_secs('model-a', '--iou-thres 0.5', None) == pytest.approx(1300. / 3)
+    assert service.expected_secs('model-a', '--max-det 10', None) == pytest.approx(1300. / 3)
+    assert service.expected_secs('model-b', None, GB) == 50.
+    assert service.expected_secs('model-c', None, None) == pytest.approx(1350. / 4)
+
+    session_maker_empty = init_db(Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data', reset=True)
+    assert StatsService(session_maker_empty, default_processing_secs=42.).expected_secs('model-a', None, None) == 42.
+
+
+def test_estimate_queued(startup):
+    """
+    Test the start of a queued job waits for the running job and the queued jobs ahead of it
+    """
+    service = StatsService(session_maker)
+    jobs = [new_job(10, model='model-b'), new_job(11, model='model-b'), new_job(12, model='model-b'),
+            new_job(13, model='model-b', duplicate_of=7)]
+    started = datetime.utcnow() - timedelta(seconds=20)
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(len(jobs))]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+        running = db.query(JobLocal).filter(JobLocal.id == 6).one()
+        update_media(db, running, running.media[0].name, Status.RUNNING)
+        running.media[0].updatedAt = started
+
+    with session_maker.begin() as db:
+        now = datetime.utcnow()
+        job = db.query(JobLocal).filter(JobLocal.id == 6).one()
+        start, completion = service.estimate(db, job, num_procs=1)
+        assert start == started
+        assert completion == started + timedelta(seconds=50)
+
+        # On one process, job 8 starts after the running job and job 7 complete; 30 + 50 seconds from now
+        job = db.query(JobLocal).filter(JobLocal.id == 8).one()
+        start, completion = service.estimate(db, job, num_procs=1)
+        assert (start - now).total_seconds() == pytest.approx(80, abs=1)
+        assert (completion - start).total_seconds() == pytest.approx(50)
+
+        # On two processes, job 8 starts when the running job completes, 30 seconds from now
+        start, _ = service.estimate(db, job, num_procs=2)
+        assert (start - now).total_seconds() == pytest.approx(30, abs=1)
+
+        # The attached job completes with job 7
+        job = db.query(JobLocal).filter(JobLocal.id == 9).one()
+        primary = db.query(JobLocal).filter(JobLocal.id == 7).one()
+        assert service.estimate(db, job, num_procs=1) == service.estimate(db, primary, num_procs=1)
+
+        # Completed jobs have no estimate
+        job = db.query(JobLocal).filter(JobLocal.id == 1).one()
+        assert service.estimate(db, job, num_procs=1) == (None, None)
+
+
+def test_queue_simulated_once(startup):
+    """
+    Test the queue is simulated once for the estimates of every queued job until the database changes
+    """
+    status_cache = StatusCache(session_maker)
+    service = StatsService(session_maker, data_version=status_cache.data_version)
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, [new_job(i, model='model-b') for i in range(10, 30)],
+                      [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(10, 30)])
+
+    queue_queries = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'JOIN media' in statement:
+            queue_queries.append(statement)
+
+    def estimate(job_id: int):
+        with session_maker.begin() as db:
+            job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+            return service.estimate(db, job, num_procs=1)
+
+    engine = session_maker.kw['bind']
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        first = estimate(6)
+        num_queries = len(queue_queries)
+        assert num_queries > 0
+        estimates = [estimate(job_id) for job_id in range(7, 26)]
+        assert len(queue_queries) == num_queries
+        assert all(a[1] == b[0] for a, b in zip([first] + estimates, estimates))
+
+        # Completing the first job in the queue moves the others up
+        with session_maker.begin() as db:
+            complete(db, 6, 50.)
+        assert estimate(25)[0] < estimates[-1][0]
+        assert len(queue_queries) > num_queries
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+        status_cache.close()
@@ -0,0 +1,146 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_status_batch.py
+# Description: Test batch status lookups and conditional status requests
+
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global client, session_maker
+
+NUM_JOBS = 60
+
+
+@pytest.fixture
+def startup():
+    global client, session_maker
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(1, NUM_JOBS + 1)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(1, NUM_JOBS + 1)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+
+    from app.main import app
+    client = TestClient(app)
+    yield
+
+
+def update_job(job_id: int, status: str):
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+        update_media(db, job, job.media[0].name, status)
+
+
+def test_conditional_status(startup):
+    """
+    Test a status request with the ETag of the current status is a 304 until the job changes
+    """
+    response = client.get("/status_by_id/1")
+    etag = response.headers['etag']
+    assert etag.startswith('W/') and response.json()['etag'] == etag
+
+    response = client.get("/status_by_id/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.content == b''
+    assert client.get("/status_by_name/job 1", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+
+    update_job(1, Status.RUNNING)
+    response = client.get("/status_by_id/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()['status'] == Status.RUNNING
+    assert response.headers['etag'] != etag
+
+    # A client with an older version is not kept waiting
+    response = client.get("/status_by_id/1", params={"wait": 30}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_status_batch(startup):
+    """
+    Test jobs are looked up by id and name in one request, in the order requested
+    """
+    response = client.post("/status/batch", json={"job_ids": [3, 1, 99, 3], "job_names": ["job 2", "missing"]})
+    assert response.status_code == 200
+    batch = response.json()
+    assert [job['job_id'] for job in batch['jobs']] == [3, 1, 2]
+    assert batch['not_found_ids'] == [99]
+    assert batch['not_found_names'] == ["missing"]
+    assert batch['jobs'][0]['estimated_start'] is not None
+
+    # The same status as the single job requests
+    single = client.get("/status_by_id/3").json()
+    assert batch['jobs'][0]['etag'] == single['etag']
+    # Jobs start now with no jobs running
+    start = datetime.fromisoformat(batch['jobs'][0]['estimated_start'])
+    assert abs(start - datetime.fromisoformat(single['estimated_start'])) < timedelta(seconds=1)
+
+    # Unchanged jobs are left out, and an unchanged batch is a 304
+    etags = [job['etag'] for job in batch['jobs']]
+    body = {"job_ids": [1, 2, 3], "if_none_match": etags}
+    response = client.post("/status/batch", json=body)
+    assert response.json()['jobs'] == []
+    assert response.json()['not_modified'] == [1, 2, 3]
+    assert client.post("/status/batch", json=body, headers={"If-None-Match": response.headers['etag']}).status_code == 304
+
+    update_job(2, Status.RUNNING)
+    response = client.post("/status/batch", json=body)
+    assert [job['job_id'] for job in response.json()['jobs']] == [2]
+    assert response.json()['not_modified'] == [1, 3]
+
+    assert client.post("/status/batch", json={"job_ids": list(range(1001))}).status_code == 422
+
+
+def test_status_batch_shares_cache(startup):
+    """
+    Test a batch is served from the status cached by single job requests, and the other way around
+    """
+    from app.main import job_status_cache
+    client.get("/status_by_id/1")
+    client.get("/status_by_name/job 2")
+    hits = job_status_cache.hits
+    response = client.post("/status/batch", json={"job_ids": [1], "job_names": ["job 2"]})
+    assert [job['job_id'] for job in response.json()['jobs']] == [1, 2]
+    assert job_status_cache.hits == hits + 2
+
+    client.post("/status/batch", json={"job_ids": [3]})
+    client.get("/status_by_id/3")
+    assert job_status_cache.hits == hits + 3
+
+
+def test_status_batch_queries(startup):
+    """
+    Test the number of queries for a batch does not grow with the number of jobs
+    """
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'data_version' not in statement:
+            statements.append(statement)
+
+    engine = session_maker.kw['bind']
+    num_statements = []
+    for num_jobs in (10, NUM_JOBS):
+        update_job(num_jobs, Status.RUNNING)  # Clear the status cache
+        statements.clear()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            response = client.post("/status/batch", json={"job_ids": list(range(1, num_jobs + 1))})
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert len(response.json()['jobs']) == num_jobs
+        num_statements.append(len(statements))
+    print(f'\nStatements for a batch of 10 and {NUM_JOBS} jobs: {num_statements}')
+    assert num_statements[0] == num_statements[1]
@@ -0,0 +1,136 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_status_cache.py
+# Description: Test the job status cache is served from memory and cleared when the database changes
+
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from deepsea_ai.database.job.misc import JobType, Status
+from fastapi.testclient import TestClient
+
+from app.job import JobLocal, init_db, bulk_add_jobs, update_media
+from app.job.status_cache import StatusCache, status_key
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+global session_maker
+
+
+@pytest.fixture
+def startup():
+    global session_maker
+    # As defined in .env.dev
+    db_path = Path.home() / 'fastapi_localtrack_dev' / 'sqlite_data'
+    os.environ['DATABASE_DIR'] = db_path.as_posix()
+    session_maker = init_db(db_path, reset=True)
+    jobs = [dict(name=f"job {i}", engine="test docker runner", model='yolov5x-mbay-benthic', job_type=JobType.DOCKER)
+            for i in range(2)]
+    media = [dict(name=f"vid{i}.mp4", status=Status.QUEUED) for i in range(2)]
+    with session_maker.begin() as db:
+        bulk_add_jobs(db, jobs, media)
+    yield
+
+
+def update_job(job_id: int, status: str):
+    with session_maker.begin() as db:
+        job = db.query(JobLocal).filter(JobLocal.id == job_id).one()
+        update_media(db, job, job.media[0].name, status)
+
+
+def test_invalidation(startup):
+    """
+    Test cached values are cleared by any commit to the database, and values read before a commit are not cached
+    """
+    cache = StatusCache(session_maker)
+    version, value = cache.get(('job_id', 1))
+    assert value is None
+    cache.put(('job_id', 1), 'queued', version)
+    assert cache.get(('job_id', 1))[1] == 'queued'
+
+    update_job(1, Status.RUNNING)
+    assert cache.get(('job_id', 1))[1] is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 2, "invalidations": 1}
+
+    # A value read before the commit is stale
+    version, _ = cache.get(('job_id', 2))
+    update_job(2, Status.RUNNING)
+    cache.get(('job_id', 1))
+    cache.put(('job_id', 2), 'queued', version)
+    assert cache.get(('job_id', 2))[1] is None
+    cache.close()
+
+
+def test_eviction(startup):
+    """
+    Test the least recently used entries are evicted, and entries expire
+    """
+    cache = StatusCache(session_maker, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(key, key, cache.get(key)[0])
+    cache.get('a')
+    cache.put('c', 'c', cache.get('c')[0])
+    assert [cache.get(key)[1] for key in ('a', 'b', 'c')] == ['a', None, 'c']
+    cache.close()
+
+    cache = StatusCache(session_maker, ttl_secs=0)
+    cache.put('a', 'a', cache.get('a')[0])
+    assert cache.get('a')[1] is None
+    cache.close()
+
+
+def test_status_by_id(startup):
+    """
+    Test repeated polls are served from the cache until the daemon updates the job
+    """
+    from app.main import app, job_status_cache
+    client = TestClient(app)
+
+    hits = job_status_cache.hits
+    assert client.get("/status_by_id/1").json()['status'] == Status.QUEUED
+    assert client.get("/status_by_id/1").json()['status'] == Status.QUEUED
+    assert job_status_cache.hits == hits + 1
+
+    update_job(1, Status.RUNNING)
+    assert client.get("/status_by_id/1").json()['status'] == Status.RUNNING
+    assert client.get("/status_by_name/job 1").json()['status'] == Status.QUEUED
+    assert client.get("/status_by_id/99").status_code == 404
+
+    # Time a cached read against a database read
+    num_reads = 1000
+    key = status_key('job_id', 1)
+    time_start = time.perf_counter()
+    for _ in range(num_reads):
+        assert job_status_cache.get(key)[1] is not None
+    cached_secs = (time.perf_counter() - time_start) / num_reads
+
+    from app.main import get_job_detail
+    time_start = time.perf_counter()
+    for _ in range(num_reads // 10):
+        get_job_detail(job_id=1)
+    db_secs = (time.perf_counter() - time_start) / (num_reads // 10)
+    print(f'\nCached status {cached_secs * 1e6:.1f} us, database status {db_secs * 1e6:.1f} us')
+    assert cached_secs < db_secs
+
+
+def test_version_read_off_event_loop(startup, monkeypatch):
+    """
+    Test the database version is read in the database reader threads, not on the event loop
+    """
+    from app.main import app, job_status_cache
+    client = TestClient(app)
+
+    threads = []
+    data_version = job_status_cache._data_version
+
+    def recorded_data_version():
+        threads.append(threading.current_thread().name)
+        return data_version()
+
+    monkeypatch.setattr(job_status_cache, '_data_version', recorded_data_version)
+    assert client.get("/status_by_id/1").status_code == 200
+    assert client.post("/status/batch", json={"job_ids": [1, 2]}).status_code == 200
+    assert threads and all(name.startswith('db-read') for name in threads)
@@ -0,0 +1,100 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_video_checker.py
+# Description: Test the cached video availability check
+
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+from app.utils.video_checker import VideoChecker
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+test_video_url = 'http://localhost:8090/video/V4361_20211006T162656Z_h265_10frame.mp4'
+test_video_url_missing = 'http://localhost:8090/video/V4361_20211006T162656Z_h265_1sec_missing.mp4'
+
+global num_requests
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    global num_requests
+    num_requests += 1
+    assert request.method == 'HEAD'
+    if request.url == test_video_url:
+        return httpx.Response(200, headers={'content-length': '1048576', 'etag': '"abc"'})
+    return httpx.Response(404)
+
+
+@pytest.fixture
+def checker():
+    global num_requests
+    num_requests = 0
+    yield VideoChecker(ttl_secs=60, negative_ttl_secs=60, max_entries=2, transport=httpx.MockTransport(handler))
+
+
+def test_available(checker):
+    video_info = asyncio.run(checker.check(test_video_url))
+    assert video_info.available
+    assert video_info.content_length == 1048576
+    assert video_info.etag == '"abc"'
+
+
+def test_missing_is_cached(checker):
+    async def check_twice():
+        first = await checker.check(test_video_url_missing)
+        second = await checker.check(test_video_url_missing)
+        return first, second
+
+    first, second = asyncio.run(check_twice())
+    assert not first.available and not second.available
+    assert first.status_code == 404
+    assert num_requests == 1
+    assert checker.hits == 1
+
+
+def test_concurrent_checks_share_request(checker):
+    async def check_many():
+        return await asyncio.gather(*[checker.check(test_video_url) for _ in range(10)])
+
+    results = asyncio.run(check_many())
+    assert all(r.available for r in results)
+    assert num_requests == 1
+
+
+def test_cancelled_check(checker):
+    """
+    Test a check that is cancelled while others wait for the same url does not fail the others
+    """
+    async def slow_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.05)
+        return handler(request)
+
+    checker = VideoChecker(transport=httpx.MockTransport(slow_handler))
+
+    async def cancel_first():
+        first = asyncio.create_task(checker.check(test_video_url))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(checker.check(test_video_url))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(cancel_first()).available
+    assert num_requests == 1
+    assert checker.cached(test_video_url) is not None
+
+
+def test_cache_is_bounded(checker):
+    async def check_all():
+        for i in range(3):
+            await checker.check(f'{test_video_url_missing}?{i}')
+        # The first url was evicted so it is requested again
+        await checker.check(f'{test_video_url_missing}?0')
+
+    asyncio.run(check_all())
+    assert num_requests == 4
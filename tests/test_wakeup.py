@@ -0,0 +1,133 @@
+# fastapi-localtrack, Apache-2.0 license
+# Filename: tests/test_wakeup.py
+# Description: Test the API wakes the daemon monitors through the wakeup socket
+
+import asyncio
+import time
+from pathlib import Path
+
+from app.utils.wakeup import DaemonWakeup, wakeup_path, WAKE_DOCKER
+from daemon.dispatcher import Dispatcher
+from daemon.monitor import Monitor
+from daemon.wakeup import WakeupListener
+from app import logger
+
+logger = logger.create_logger_file(Path(__file__).parent, __file__)
+
+
+class CountingMonitor(Monitor):
+
+    def __init__(self, check_every: int) -> None:
+        super().__init__(check_every=check_every)
+        self.checks = []
+
+    async def check(self) -> None:
+        self.checks.append(time.perf_counter())
+
+
+def test_wakeup(tmp_path):
+    """
+    Test a wakeup reaches the listener, and a burst of wakeups does not block the sender once the socket queue
+    is full; the wakeups still queued are as good
+    """
+    path = wakeup_path(tmp_path, 'test')
+    sender = DaemonWakeup(tmp_path)
+    assert not sender.notify()  # Nobody is listening
+
+    async def listen():
+        woken = asyncio.Event()
+        calls = []
+
+        def wake():
+            calls.append(time.perf_counter())
+            woken.set()
+
+        listener = WakeupListener(path, {WAKE_DOCKER: wake})
+        assert listener.start()
+        time_start = time.perf_counter()
+        assert sender.notify()
+        await asyncio.wait_for(woken.wait(), timeout=1)
+        latency = calls[0] - time_start
+
+        sent = sum(sender.notify() for _ in range(100))
+        await asyncio.sleep(0.05)
+        listener.stop()
+        return latency, sent, len(calls), listener.received
+
+    latency, sent, num_calls, received = asyncio.run(listen())
+    print(f'\nWakeup latency {latency * 1e3:.3f} ms, {sent} of a burst of 100 wakeups sent')
+    assert latency < 0.1
+    assert sent > 0
+    assert received == sent + 1
+    assert num_calls <= received
+    assert not path.exists()
+    sender.close()
+
+
+def test_stale_socket(tmp_path):
+    """
+    Test a socket left by a daemon that did not stop cleanly is replaced
+    """
+    path = wakeup_path(tmp_path, 'test')
+
+    async def listen():
+        first = WakeupListener(path, {})
+        assert first.start()
+        second = WakeupListener(path, {})
+        assert second.start()
+        second.stop()
+
+    asyncio.run(listen())
+
+
+def test_dispatcher_wakeup(tmp_path):
+    """
+    Test a woken monitor checks straight away instead of waiting check_every seconds
+    """
+    path = wakeup_path(tmp_path, 'test')
+    sender = DaemonWakeup(tmp_path)
+
+    async def run():
+        monitor = CountingMonitor(check_every=60)
+        listener = WakeupListener(path, {WAKE_DOCKER: monitor.wake})
+        listener.start()
+        task = asyncio.create_task(Dispatcher._run_monitor(monitor))
+        await asyncio.sleep(0.1)
+        num_idle_checks = len(monitor.checks)
+
+        time_start = time.perf_counter()
+        sender.notify()
+        while len(monitor.checks) == num_idle_checks:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        listener.stop()
+        return num_idle_checks, monitor.checks[-1] - time_start
+
+    num_idle_checks, latency = asyncio.run(run())
+    print(f'\nCheck {latency * 1e3:.3f} ms after the wakeup')
+    assert num_idle_checks == 1
+    assert latency < 0.1
+    sender.close()
+
+
+def test_wakeup_workers(tmp_path):
+    """
+    Test every worker sharing the database directory is woken
+    """
+    sender = DaemonWakeup(tmp_path)
+
+    async def listen():
+        woken = []
+        listeners = [WakeupListener(wakeup_path(tmp_path, worker_id),
+                                    {WAKE_DOCKER: lambda w=worker_id: woken.append(w)})
+                     for worker_id in ('gpu-box-1', 'gpu-box-2')]
+        for listener in listeners:
+            assert listener.start()
+        assert sender.notify()
+        await asyncio.sleep(0.05)
+        for listener in listeners:
+            listener.stop()
+        return woken
+
+    assert sorted(asyncio.run(listen())) == ['gpu-box-1', 'gpu-box-2']
+    sender.close()